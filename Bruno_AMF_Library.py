@@ -13,12 +13,931 @@ Crash warning:
  This library has nested PCells. Running this macro with a layout open may
  cause it to crash. Close the layout first before running.
 
+PCell cache:
+ Produced variants can be kept on disk (see PCellDiskCache) and loaded back
+ in later sessions. The cache is off unless BRUNO_PCELL_CACHE is set: to a
+ directory, or to 1 for ~/.klayout/bruno_pcell_cache. BRUNO_PCELL_CACHE_MB
+ caps its size.
+
+Shared sub-cells:
+ The ring block, its halves and the delay spiral are plain cells named after
+ the parameters they depend on (see keyed_cell, RING_SILICON, RING_HEATER).
+ A variant that changes only the heater width redraws only the heater side;
+ the silicon and the spiral of earlier variants are instantiated again.
+
+Ports:
+ Every PCell also publishes its ports (name, position, direction, width and
+ type) as a "ports" LayoutMetaInfo: the optical ports and the heater pads
+ (elec1, elec2, ... see via_ports). Read it with cell_ports(cell), which
+ follows library proxies to the library cell holding the table. The
+ "device" meta info next to it (device_info) names the PCell and its
+ parameters; Bruno_Netlist.py builds circuit netlists from the two. The
+ functions and names are shared with the other tools in Bruno_Ports.py.
+
+Profiling:
+ Set BRUNO_PCELL_PROFILE=1 to print the time, shapes and instances of each
+ section of produce_impl for every produced variant, or to a file name to
+ append the traces to it as JSON lines (see SectionProfiler).
+
 """
 
+import collections
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+import warnings
+import weakref
+from math import ceil, floor, pi
+
 import pya
-from pya import DPoint, DPath, Path, Polygon, Point, Text, Trans, Application, LayoutMetaInfo
+from pya import DPoint, DPath, Path, Polygon, Point, Text, Trans, LayoutMetaInfo
+import numpy as np
 
 from SiEPIC.utils import get_technology_by_name
+from Bruno_Ports import PORTS, DEVICE, port_table, device_info, cell_ports
+
+
+@functools.lru_cache(maxsize=256)
+def arc_outline(r, w, theta_start, theta_stop):
+    """
+    Vertex offsets (dx, dy arrays) of a waveguide arc outline centred on the
+    origin, sampled like SiEPIC.utils.arc_wg_xy. Shared by all PCells of the
+    library; arc_outline.cache_info() reports the hits and misses. End
+    points on a quarter turn are exact, where the sampled angle leaves cos
+    or sin a little off 0, so the arc ends on the edges of the straight
+    waveguide it joins.
+    """
+    from math import pi, cos, sin
+    from SiEPIC.utils import points_per_circle
+
+    circle_fraction = abs(theta_stop - theta_start) / 360.0
+    npoints = int(points_per_circle(r/1000) * circle_fraction)
+    if npoints == 0:
+        npoints = 1
+    da = 2 * pi / npoints * circle_fraction
+    th = theta_start / 360.0 * 2 * pi
+    angles = [i * da + th for i in range(0, npoints + 1)]
+    radii = [r + w / 2] * len(angles) + [r - w / 2] * len(angles)
+    angles = angles + angles[::-1]
+    dx = np.array([rr * cos(a) for rr, a in zip(radii, angles)])
+    dy = np.array([rr * sin(a) for rr, a in zip(radii, angles)])
+    # like arc_wg_xy, the arc turns counterclockwise whatever the sign of the span
+    for i, theta in ((0, theta_start), (npoints, theta_start + abs(theta_stop - theta_start))):
+        if theta % 90 == 0:
+            c, s = ((1, 0), (0, 1), (-1, 0), (0, -1))[int(theta // 90) % 4]
+            for j, rr in ((i, r + w / 2), (len(dx) - 1 - i, r - w / 2)):
+                dx[j], dy[j] = rr * c, rr * s
+    return dx, dy
+
+
+def snap(values, origin=0):
+    """
+    Coordinates in dbu (scalar or array) snapped to the integer grid as int64,
+    rounding half away from origin (an integer). pya.Point and pya.Box
+    truncate float coordinates instead, so sums of half widths such as
+    MMI_w/4 + w/2 could land one dbu off on either side of the axis.
+    """
+    values = np.asarray(values, dtype=float) - origin
+    return np.where(values > 0, np.floor(values + 0.5), np.ceil(values - 0.5)).astype(np.int64) + origin
+
+
+def snap_coord(value, origin=0):
+    """Scalar form of snap, without the NumPy overhead, for single boxes, paths and transformations."""
+    value -= origin
+    return origin + (int(floor(value + 0.5)) if value > 0 else int(ceil(value - 0.5)))
+
+
+def taper_xy(x_wide, x_narrow, y, w_wide, w_narrow):
+    """
+    Vertices (n, 4, 2) in dbu of n linear tapers along x, from the wide end
+    at x_wide to the narrow end at x_narrow, centred on y. The arguments are
+    broadcast against each other, so one call draws a whole taper group.
+    """
+    x_wide, x_narrow, y = np.broadcast_arrays(*(np.atleast_1d(v).astype(float) for v in (x_wide, x_narrow, y)))
+    xs = np.stack([x_wide, x_narrow, x_narrow, x_wide], axis=-1)
+    ys = np.stack([y + w_wide/2, y + w_narrow/2, y - w_narrow/2, y - w_wide/2], axis=-1)
+    return np.stack([xs, ys], axis=-1)
+
+
+def mirror_x(xy, x):
+    """Vertices xy mirrored about the vertical axis at x, with their orientation kept."""
+    mirrored = xy[..., ::-1, :].copy()
+    mirrored[..., 0] = 2*x - mirrored[..., 0]
+    return mirrored
+
+
+class Grid(object):
+    """
+    The dbu grid of a device drawn around the integer point (x0, y0), the
+    centre of MMI 1 (or of the MZI input). The PCells compute their
+    coordinates from integer lengths (to_itype), exact up to a half or
+    quarter dbu, and round each of them once here, half away from the
+    anchor: both sides of a joint, computed from the same values, land on
+    the same grid point. Cells drawn around their own origin with Grid()
+    and placed at the anchor, mirrored or not, round the same way.
+    """
+
+    def __init__(self, x0=0, y0=0):
+        self.x0 = x0
+        self.y0 = y0
+
+    def x(self, value):
+        return snap_coord(value, self.x0)
+
+    def y(self, value):
+        return snap_coord(value, self.y0)
+
+    def box(self, left, bottom, right, top):
+        """pya.Box with its corners snapped to the grid."""
+        return pya.Box(self.x(left), self.y(bottom), self.x(right), self.y(top))
+
+    def path(self, points, width):
+        """pya.Path of (x, y) points in dbu, with the points and width snapped to the grid."""
+        return pya.Path([pya.Point(self.x(px), self.y(py)) for px, py in points], snap_coord(width))
+
+    def trans(self, rot, x, y):
+        """pya.Trans of rotation rot with its displacement snapped to the grid."""
+        return pya.Trans(rot, self.x(x), self.y(y))
+
+    def polygon(self, xs, ys):
+        """pya.Polygon of vertex coordinate arrays in dbu."""
+        return pya.Polygon([pya.Point(px, py) for px, py in
+                            zip(snap(xs, self.x0).tolist(), snap(ys, self.y0).tolist())])
+
+    def polygons(self, xy):
+        """pya.Polygon objects of vertex arrays (n, m, 2) in dbu, e.g. of taper_xy, converted in one pass."""
+        xy = np.stack([snap(xy[..., 0], self.x0), snap(xy[..., 1], self.y0)], axis=-1)
+        return [pya.Polygon([pya.Point(px, py) for px, py in vertices]) for vertices in xy.tolist()]
+
+    def arc(self, x, y, r, w, theta_start, theta_stop):
+        """
+        Drop-in replacement for SiEPIC.utils.arc_wg_xy (lengths in dbu, angles
+        in degrees) that translates the cached outline of arc_outline to (x, y).
+        """
+        dx, dy = arc_outline(r, w, theta_start, theta_stop)
+        return self.polygon(x + dx, y + dy)
+
+
+def spiral_arms(wg_width, min_radius, wg_spacing, turns, spiral_ports=1):
+    """
+    Centre lines of the Archimedean double spiral drawn by the EBeam Spiral
+    PCell, as arrays (c, theta0, theta1) of arms r = c + a*theta (microns,
+    radians). turns full turns of both arms, plus the half turn that brings
+    both ports to the same side if spiral_ports is set.
+    """
+    spacing = wg_spacing + wg_width
+    a = spacing / pi
+    k = np.arange(turns)
+    c = np.concatenate([2*min_radius + 2*pi*a*k, 2*min_radius + 2*pi*a*k - spacing])
+    theta0 = np.concatenate([np.zeros(turns), np.full(turns, pi)])
+    if spiral_ports:
+        c = np.append(c, 2*min_radius + 2*pi*a*turns)
+        theta0 = np.append(theta0, 0)
+    theta1 = theta0 + 2*pi
+    if spiral_ports:
+        theta1[-1] = pi
+    return a, c, theta0, theta1
+
+
+def spiral_length(wg_width, min_radius, wg_spacing, turns, spiral_ports=1):
+    """
+    Exact centre line length of the spiral in microns: the closed form arc
+    length of each Archimedean arm plus the two semicircles of the S-bend.
+    """
+    a, c, theta0, theta1 = spiral_arms(wg_width, min_radius, wg_spacing, turns, spiral_ports)
+
+    def F(u):
+        return a/2 * (u*np.sqrt(1 + u*u) + np.arcsinh(u))
+
+    return float(np.sum(F(c/a + theta1) - F(c/a + theta0))) + 2*pi*min_radius
+
+
+def spiral_turns(length, wg_width, min_radius, wg_spacing, spiral_ports=1):
+    """Smallest number of full turns whose spiral_length reaches length."""
+    turns = 1
+    while spiral_length(wg_width, min_radius, wg_spacing, turns, spiral_ports) < length:
+        turns += 1
+    return turns
+
+
+def spiral_polygons(length, wg_width, min_radius, wg_spacing, spiral_ports=1, dbu=0.001):
+    """
+    Native replacement for the EBeam-dev Spiral PCell: the waveguide polygons
+    (in dbu, centred on the origin, ports on the negative x axis) of the
+    smallest spiral at least length microns long, and its exact length.
+    Each arm is sampled at once with NumPy, on the same points as the PCell.
+    """
+    from SiEPIC.utils import points_per_circle
+
+    grid = Grid()
+    turns = spiral_turns(length, wg_width, min_radius, wg_spacing, spiral_ports)
+    a, c, theta0, theta1 = spiral_arms(wg_width, min_radius, wg_spacing, turns, spiral_ports)
+    polygons = []
+    for ci, t0, t1 in zip(c.tolist(), theta0.tolist(), theta1.tolist()):
+        xs, ys = [], []
+        for r, direction in ((ci - wg_width/2, 1), (ci + wg_width/2, -1)):
+            npoints = int(points_per_circle(r))
+            t = (np.arange(npoints + 1) * ((t1 - t0) / npoints) + t0)[::direction]
+            xs.append((a*t + r) * np.cos(t) / dbu)
+            ys.append((a*t + r) * np.sin(t) / dbu)
+        polygons.append(grid.polygon(np.concatenate(xs), np.concatenate(ys)))
+
+    # Centre S-shape connecting waveguide
+    b, w = min_radius/dbu, wg_width/dbu
+    polygons.append(grid.arc(-b, 0, b, w, 0, 180))
+    polygons.append(grid.arc(b, 0, b, w, 180, 0))
+    return polygons, spiral_length(wg_width, min_radius, wg_spacing, turns, spiral_ports)
+
+
+def copy_cell_tree(src_ly, src_cell, dst_ly, dst_cell, cell_map=None):
+    """
+    Copies the shapes and instances of src_cell into dst_cell, which may live
+    in another layout. Library proxies are resolved again through their
+    library in dst_ly and other child cells are reused by name when dst_ly
+    already has them, so shared sub-cells are not duplicated.
+    """
+    if cell_map is None:
+        cell_map = {}
+    for info in src_cell.each_meta_info():
+        dst_cell.add_meta_info(info)
+    for li in src_ly.layer_indexes():
+        shapes = src_cell.shapes(li)
+        if not shapes.is_empty():
+            dst_cell.shapes(dst_ly.layer(src_ly.get_info(li))).insert(shapes)
+    for inst in src_cell.each_inst():
+        ci = inst.cell_index
+        if ci not in cell_map:
+            child = src_ly.cell(ci)
+            if child.is_library_cell():
+                if child.is_pcell_variant():
+                    dst_child = dst_ly.create_cell(child.basic_name(), child.library().name(),
+                                                   child.pcell_parameters_by_name())
+                else:
+                    dst_child = dst_ly.create_cell(child.basic_name(), child.library().name())
+            else:
+                dst_child = dst_ly.cell(child.name)
+                if dst_child is None:
+                    dst_child = dst_ly.create_cell(child.name)
+                    copy_cell_tree(src_ly, child, dst_ly, dst_child, cell_map)
+            cell_map[ci] = dst_child.cell_index()
+        cell_inst = inst.cell_inst.dup()
+        cell_inst.cell_index = cell_map[ci]
+        dst_cell.insert(cell_inst)
+
+
+def via_stack_cell(ly, vl, mh, ml, pinrec):
+    """
+    Returns the via stack cell of ly for these layer indexes: VL, MH, ML and
+    PinRec squares centred on the origin with the elec2h2 pin label. The cell
+    is created on first use and shared by every PCell variant of the layout.
+    """
+    name = "via_stack_" + "_".join(
+        "%d_%d" % (ly.get_info(li).layer, ly.get_info(li).datatype) for li in (vl, mh, ml, pinrec))
+    cell = ly.cell(name)
+    if cell is None:
+        dbu = ly.dbu
+        cell = ly.create_cell(name)
+        sq_s = 3.0/2
+        sq_L = 6.0/2
+        boxVL3 = pya.Box(-sq_s / dbu, -sq_s / dbu, sq_s / dbu, sq_s / dbu)
+        boxMH1 = pya.Box(-sq_L / dbu, -sq_L / dbu, sq_L / dbu, sq_L / dbu)
+        cell.shapes(vl).insert(boxVL3)
+        cell.shapes(mh).insert(boxMH1)
+        cell.shapes(ml).insert(boxMH1)
+        cell.shapes(pinrec).insert(boxMH1)
+        cell.shapes(pinrec).insert(
+            pya.Text("elec2h2", pya.Trans(pya.Trans.R0, 0, 0))
+        ).text_size = 0.5 / dbu
+        port_table(cell, dbu, {"elec2h2": (0, 0, None, 2 * sq_L / dbu, "electrical")})
+    return cell
+
+
+def via_ports(cell, via):
+    """
+    Pads of the via stack cell via placed anywhere below cell, as port_table
+    entries in dbu: the elec2h2 pad of each placement moved into cell, named
+    elec1, elec2, ... from left to right (bottom to top at the same x), so
+    the heater connections of a device are in its own port table.
+    """
+    dbu = cell.layout().dbu
+    pads = []
+    it = cell.begin_instances_rec()
+    it.targets = [via.cell_index()]
+    while not it.at_end():
+        trans = it.trans() * it.inst_trans()
+        for name, p in sorted(cell_ports(via).items()):
+            pos = trans * pya.Point(int(round(p["x"] / dbu)), int(round(p["y"] / dbu)))
+            pads.append((pos.x, pos.y, None, p["width"] * trans.mag / dbu, p["type"]))
+        it.next()
+    pads.sort(key=lambda pad: (pad[0], pad[1]))
+    return dict(("elec%d" % (i + 1), pad) for i, pad in enumerate(pads))
+
+
+def keyed_cell(ly, prefix, key, draw):
+    """
+    Returns the cell of ly named prefix plus a hash of key, calling
+    draw(cell) to fill it on first use. key lists everything the geometry
+    depends on (parameters, layers), so variants that agree on it reuse the
+    cell instead of drawing it again.
+    """
+    name = prefix + hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+    cell = ly.cell(name)
+    if cell is None:
+        cell = ly.create_cell(name)
+        draw(cell)
+    return cell
+
+
+def batched_draw(layers, draw, *args):
+    """draw(cell, shapes, *args) for keyed_cell, with a ShapeBatch on layers flushed afterwards."""
+    def draw_cell(cell):
+        shapes = ShapeBatch(cell, layers)
+        draw(cell, shapes, *args)
+        shapes.flush()
+    return draw_cell
+
+
+# Set to False to draw both halves of the ring block flat, e.g. to compare
+SYMMETRY_CELLS = True
+
+# Dimensions of the double MMI ring block in dbu (r and w_mh of the heater,
+# dbu itself to scale the fixed micron sizes)
+RingDims = collections.namedtuple("RingDims", "MMI_L MMI_L2 MMI_w tap_ls tap_l tap_w w r w_mh dbu")
+
+# The dimensions the silicon and the heater side of the ring block depend
+# on: a change of w_mh only redraws the heater side and a change of the
+# waveguide width only redraws the silicon (and moves the vias)
+RING_SILICON = ("MMI_L", "MMI_L2", "MMI_w", "tap_ls", "tap_l", "tap_w", "w", "r", "dbu")
+RING_HALF_HEATER = ("MMI_L", "MMI_w", "tap_ls", "r", "w_mh", "dbu")
+RING_HEATER = RING_HALF_HEATER + ("w",)
+
+
+def ring_key(dims, names, *layers):
+    """Key of keyed_cell for the part of the ring block that depends on the dims names."""
+    return tuple(str(li) for li in layers) + tuple((n, getattr(dims, n)) for n in names)
+
+
+def ring_half_silicon(dims):
+    """
+    Left half of the silicon of the double MMI ring block of Db_MMI_RR,
+    DbRR_MZI_sSpiral and DbRR_Isolated relative to the centre of MMI 1: the
+    MMI tapers and the connecting arcs. The right half is its mirror image
+    about the vertical axis of the MMIs.
+    """
+    grid = Grid()
+    dy1 = dims.MMI_w/2 + 2*dims.r
+    x = -dims.MMI_L/2 - dims.tap_ls
+    silicon = grid.polygons(np.concatenate([
+        taper_xy(-dims.MMI_L/2 - np.array([dims.tap_ls, dims.tap_l]), -dims.MMI_L/2,
+                 np.array([dims.MMI_w/4, -dims.MMI_w/4]), dims.w, dims.tap_w),
+        taper_xy(x, -dims.MMI_L2/2, dy1 + np.array([dims.MMI_w/4, -dims.MMI_w/4]), dims.w, dims.tap_w),
+    ]))
+    for dy in (0, dy1):
+        silicon.append(grid.arc(x, dy + dims.r + dims.MMI_w/4, dims.r, dims.w, 90, -90))
+    return silicon
+
+
+def ring_half_heater(dims):
+    """Left half of the heater of the ring block, like ring_half_silicon: the heater arcs and their connection."""
+    from SiEPIC.extend import to_itype
+    dbu = dims.dbu
+    grid = Grid()
+    dy1 = dims.MMI_w/2 + 2*dims.r
+    x = -dims.MMI_L/2 - dims.tap_ls
+    heater = [grid.arc(x - dims.w_mh/2, dy + dims.r + dims.MMI_w/4, dims.r - to_itype(1, dbu), to_itype(3, dbu), 90, -90)
+              for dy in (0, dy1)]
+    heater.append(grid.box(
+        x - to_itype(2, dbu), 2*dims.r + dims.MMI_w/4 - to_itype(2.5, dbu),
+        x, 2*dims.r + dims.MMI_w/4 + to_itype(3.5, dbu),
+    ))
+    return heater
+
+
+def place_ring_halves(cell, shapes, layer, half, names, dims, x0, y0):
+    """
+    Draws the polygons of half(dims) on layer, one half of the ring block
+    centred on MMI 1 at the integer point (x0, y0), and their mirror image:
+    two instances of a cell keyed on the dims names, the second mirrored at
+    the y axis, or, without SYMMETRY_CELLS, the polygons inserted twice into
+    shapes. The half is drawn on the grid around its own origin (Grid()),
+    so placing it at (x0, y0) rounds nothing again.
+    """
+    ly = cell.layout()
+    halves = (pya.Trans(pya.Trans.R0, x0, y0), pya.Trans(pya.Trans.M90, x0, y0))
+    if SYMMETRY_CELLS:
+        def draw(half_cell):
+            half_cell.shapes(layer).insert(pya.Region(half(dims)).merged())
+        key = (half.__name__,) + ring_key(dims, names, ly.get_info(layer))
+        half_cell = keyed_cell(ly, "ring_half_", key, draw)
+        for t in halves:
+            cell.insert(pya.CellInstArray(half_cell.cell_index(), t))
+    else:
+        polygons = half(dims)
+        for t in halves:
+            for polygon in polygons:
+                shapes(layer).insert(polygon.transformed(t))
+
+
+def draw_ring_silicon(cell, shapes, si, dims, x0, y0):
+    """
+    Draws the silicon of the double MMI ring block centred on MMI 1 at
+    (x0, y0) into cell: both MMIs, the waveguide on top of the ring and the
+    mirrored ring_half_silicon.
+    """
+    MMI_L, MMI_L2, MMI_w, tap_ls, tap_l, tap_w, w, r, w_mh, dbu = dims
+    grid = Grid(x0, y0)
+    y1 = y0 + MMI_w/2 + 2*r
+    shapes(si).insert(grid.box(x0 - MMI_L/2, y0 + MMI_w/2, x0 + MMI_L/2, y0 - MMI_w/2))
+    shapes(si).insert(grid.box(x0 - MMI_L2/2, y1 + MMI_w/2, x0 + MMI_L2/2, y1 - MMI_w/2))
+    shapes(si).insert(grid.box(
+        x0 - MMI_L/2 - tap_ls, y1 + MMI_w/2 + 2*r - w/2,
+        x0 + MMI_L/2 + tap_ls, y1 + MMI_w/2 + 2*r - 3*w/2
+    ))
+    place_ring_halves(cell, shapes, si, ring_half_silicon, RING_SILICON, dims, x0, y0)
+
+
+def draw_ring_heater(cell, shapes, layers, dims, x0, y0):
+    """
+    Draws the heater side of the ring block centred on MMI 1 at (x0, y0)
+    into cell: the mirrored ring_half_heater, the MMI 2 heater, the via
+    stacks and the two common ground lines. layers are the indexes
+    (vl, ml, mh, pinrec).
+    """
+    from SiEPIC.extend import to_itype
+    vl, ml, mh, pinrec = layers
+    MMI_L, MMI_L2, MMI_w, tap_ls, tap_l, tap_w, w, r, w_mh, dbu = dims
+    grid = Grid(x0, y0)
+    via = via_stack_cell(cell.layout(), vl, mh, ml, pinrec)
+
+    def vias(x_v, y_v):
+        cell.insert(pya.CellInstArray(via.cell_index(), grid.trans(pya.Trans.R0, x_v, y_v)))
+
+    place_ring_halves(cell, shapes, mh, ring_half_heater, RING_HALF_HEATER, dims, x0, y0)
+
+    # MMI 2 heater
+    shapes(mh).insert(grid.box(
+        x0 - MMI_L/2, y0 + MMI_w/2 + 2*r + w_mh/2,
+        x0 + MMI_L/2, y0 + MMI_w/2 + 2*r - w_mh/2
+    ))
+    vias(x0 - MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
+    vias(x0 + MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
+
+    # Vias of the arc heaters and their common ground, below and above the ring
+    for y_v, y_g in ((y0 + MMI_w/4 - w, y0), (y0 + MMI_w/4 - w + 4*r + 4*w, y0 + 4*r + 6*w)):
+        vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y_v)
+        vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y_v)
+        shapes(ml).insert(grid.path([
+            (x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y_g),
+            (x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y_g)], to_itype(4, dbu)
+        ))
+
+
+def draw_ring_block(cell, shapes, layers, dims, x0, y0):
+    """
+    Draws the whole ring block centred on MMI 1 at (x0, y0) into cell.
+    layers are the indexes (si, vl, ml, mh, pinrec).
+    """
+    draw_ring_silicon(cell, shapes, layers[0], dims, x0, y0)
+    draw_ring_heater(cell, shapes, layers[1:], dims, x0, y0)
+
+
+def ring_block_cell(ly, layers, dims):
+    """
+    Returns the cell of ly with the ring block of dims around the origin.
+    It references a silicon and a heater cell, each keyed on the dimensions
+    it depends on (RING_SILICON, RING_HEATER), so Db_MMI_RR,
+    DbRR_MZI_sSpiral and DbRR_Isolated variants with the same ring share one
+    block, and a variant that only changes the heater reuses the silicon.
+    """
+    si, vl, ml, mh, pinrec = layers
+    infos = [ly.get_info(li) for li in layers]
+    silicon = keyed_cell(ly, "ring_silicon_", ring_key(dims, RING_SILICON, infos[0]),
+                         batched_draw((si,), draw_ring_silicon, si, dims, 0, 0))
+    heater = keyed_cell(ly, "ring_heater_", ring_key(dims, RING_HEATER, *infos[1:]),
+                        batched_draw((mh,), draw_ring_heater, layers[1:], dims, 0, 0))
+
+    def draw(cell):
+        for part in (silicon, heater):
+            cell.insert(pya.CellInstArray(part.cell_index(), pya.Trans()))
+
+    return keyed_cell(ly, "ring_block_", ring_key(dims, RingDims._fields, *infos), draw)
+
+
+# Set to False to draw the ring block into every device cell, e.g. to compare
+SHARED_RING_BLOCK = True
+
+
+def place_ring_block(cell, shapes, layers, dims, x0, y0):
+    """Places the ring block centred on MMI 1 at the integer point (x0, y0) in cell, as an instance of ring_block_cell."""
+    if SHARED_RING_BLOCK:
+        block = ring_block_cell(cell.layout(), layers, dims)
+        cell.insert(pya.CellInstArray(block.cell_index(), pya.Trans(pya.Trans.R0, x0, y0)))
+    else:
+        draw_ring_block(cell, shapes, layers, dims, x0, y0)
+
+
+def spiral_cell(ly, layers, length, wg_width, min_radius, wg_spacing, spiral_ports=1):
+    """
+    Returns the cell of ly with the spiral of these arguments. layers are
+    the indexes (si, pinrec, devrec): the cell holds the spiral_polygons on
+    si and, like the EBeam-dev Spiral it replaces, the pin1/pin2 pins on
+    pinrec and the DevRec outline and compact model texts on devrec, with
+    the exact spiral length. The spiral depends on none of the device
+    parameters, so every variant reuses the cell.
+    """
+    si, pinrec, devrec = layers
+    args = (length, wg_width, min_radius, wg_spacing, spiral_ports)
+
+    def draw(cell):
+        from math import cos, sin
+        from SiEPIC._globals import PIN_LENGTH as pin_length
+        from SiEPIC.utils import points_per_circle
+        dbu = ly.dbu
+        grid = Grid()
+        polygons, spiral_l = spiral_polygons(*args, dbu=dbu)
+        for polygon in polygons:
+            cell.shapes(si).insert(polygon)
+
+        # Pins on the waveguide ends, on the negative x axis (pin1 on the
+        # positive one without spiral_ports)
+        turns = spiral_turns(*args)
+        a = (wg_spacing + wg_width) / pi
+        w = wg_width / dbu
+        x = -(2*min_radius + a*turns*2*pi) / dbu
+        t = grid.trans(Trans.R0, x, 0)
+        cell.shapes(pinrec).insert(Path([Point(0, pin_length/2), Point(0, -pin_length/2)], w).transformed(t))
+        cell.shapes(pinrec).insert(Text("pin2", t)).text_size = 0.4 / dbu
+        if spiral_ports:
+            x = -(2*min_radius + a*(turns + 0.5)*2*pi) / dbu
+        else:
+            x = (2*min_radius + a*turns*2*pi) / dbu
+        t = grid.trans(Trans.R0, x, 0)
+        cell.shapes(pinrec).insert(Path([Point(0, -pin_length/2), Point(0, pin_length/2)], w).transformed(t))
+        cell.shapes(pinrec).insert(Text("pin1", t)).text_size = 0.4 / dbu
+
+        # Compact model information
+        texts = (
+            (-abs(x), 0, "Length=%.3fu" % spiral_l, abs(x) / 8),
+            (0, 0, "Lumerical_INTERCONNECT_library=Design kits/ebeam_v1.2", 0.1 / dbu),
+            (0, w*2, "Component=ebeam_wg_strip_1550", 0.1 / dbu),
+            (0, -w*2, "Spice_param:wg_length=%.3fu wg_width=%.3fu min_radius=%.3fu wg_spacing=%.3fu"
+             % (spiral_l, wg_width, min_radius, wg_spacing), 0.1 / dbu),
+        )
+        for tx, ty, text, size in texts:
+            cell.shapes(devrec).insert(Text(text, grid.trans(Trans.R0, tx, ty))).text_size = size
+
+        # Device recognition outline, 2 waveguide widths outside the spiral
+        npoints = int(points_per_circle(abs(x)) / 10)
+        r = abs(x) + 2*w
+        da = 2*pi / npoints
+        cell.shapes(devrec).insert(grid.polygon(
+            [r*cos(i*da) for i in range(npoints + 1)], [r*sin(i*da) for i in range(npoints + 1)]))
+
+    key = tuple(str(ly.get_info(li)) for li in layers) + (ly.dbu,) + args
+    return keyed_cell(ly, "spiral_", key, draw)
+
+
+# Set to True to merge the Si and MH shapes of each variant into few polygons.
+# Off by default: the merge costs more time than it saves (see
+# Bruno_Benchmarks.bench_shape_batching), also with Si batched alone.
+BATCH_SHAPES = False
+
+
+class ShapeBatch(object):
+    """
+    Stand-in for cell.shapes in produce_impl. Boxes and polygons inserted on
+    the batched layers are collected and flush() inserts each layer once as a
+    merged Region, so touching pieces (tapers, MMI boxes, arcs) reach the
+    layout as few polygons. Shapes on other layers, and all shapes unless
+    BATCH_SHAPES is set, are inserted directly.
+    """
+
+    class _Collector(list):
+        insert = list.append
+
+    def __init__(self, cell, layers):
+        self.cell = cell
+        self.batches = dict((li, self._Collector()) for li in layers) if BATCH_SHAPES else {}
+
+    def __call__(self, layer):
+        if layer in self.batches:
+            return self.batches[layer]
+        return self.cell.shapes(layer)
+
+    def flush(self):
+        for li, batch in self.batches.items():
+            if batch:
+                self.cell.shapes(li).insert(pya.Region(batch).merged())
+            del batch[:]
+
+
+def via_count(top_cell):
+    """Number of via stacks placed anywhere in the hierarchy below top_cell."""
+    ly = top_cell.layout()
+    vias = [c.cell_index() for c in ly.each_cell() if c.name.startswith("via_stack_")]
+    if not vias:
+        return 0
+    it = top_cell.begin_instances_rec()
+    it.targets = vias
+    return sum(1 for _ in it)
+
+
+# Set to False to resolve every library cell with create_cell, e.g. to time it
+RESOLVE_CACHED = True
+
+
+class LibraryCells(object):
+    """
+    Per-layout resolver for cells of other libraries (the Y-branch). Each
+    (cell, library, parameters) is resolved with create_cell once per layout;
+    later instances get the cached cell index. The layouts are held weakly,
+    so the entries of a layout go away with it. The time spent is recorded
+    per (library, cell) and printed by report().
+    """
+
+    def __init__(self):
+        self.layouts = weakref.WeakKeyDictionary()
+        self.stats = {}
+
+    @staticmethod
+    def params_key(params):
+        return tuple(sorted((k, str(v) if isinstance(v, pya.LayerInfo) else v)
+                            for k, v in (params or {}).items()))
+
+    def cell_index(self, ly, name, lib, params=None):
+        t0 = time.perf_counter()
+        cells = self.layouts.setdefault(ly, {})
+        key = (name, lib, self.params_key(params))
+        ci = cells.get(key) if RESOLVE_CACHED else None
+        # the cell may have been deleted from the layout since, so check it is still ours
+        hit = (ci is not None and ly.is_valid_cell_index(ci) and ly.cell(ci).is_library_cell()
+               and ly.cell(ci).library().name() == lib)
+        if not hit:
+            cell = ly.create_cell(name, lib, params) if params else ly.create_cell(name, lib)
+            if cell is None:
+                raise ValueError("Cell %s not found in library %s" % (name, lib))
+            ci = cells[key] = cell.cell_index()
+        stats = self.stats.setdefault((lib, name), [0, 0, 0.0])
+        stats[0] += 1
+        stats[1] += not hit
+        stats[2] += time.perf_counter() - t0
+        return ci
+
+    def clear(self):
+        self.layouts.clear()
+        self.stats.clear()
+
+    def report(self):
+        print("Library cell resolution: library, cell, calls, create_cell calls, time [ms]")
+        for (lib, name), (calls, misses, dt) in sorted(self.stats.items()):
+            print("%-20s %-22s %5d %5d %8.2f" % (lib, name, calls, misses, dt*1e3))
+
+
+LIBRARY_CELLS = LibraryCells()
+
+
+class PCellDiskCache(object):
+    """
+    Persistent cache of produced PCell variants. Each variant is stored as an
+    OASIS fragment named by a hash of the PCell class, its parameters, the
+    dbu and the library version, so a layout reopened in a new session loads
+    the geometry instead of running produce_impl again. The version hashes
+    the source files of this module and of Bruno_Ports; when one of them is
+    unknown (e.g. the library run as a macro without a file) nothing is
+    cached, since a change to the code could not invalidate the entries.
+
+    Entries live in a sub-directory per library version; directories of other
+    versions are removed when the library source changes. The least recently
+    used entries are evicted once the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = bool(path)
+        self._version = None
+
+    @property
+    def version(self):
+        """
+        Hash of the library source, the part of the key that invalidates
+        entries, or None if a source file is unknown.
+        """
+        if self._version is None:
+            import Bruno_Ports
+            h = hashlib.sha1()
+            for source in (globals().get("__file__"), getattr(Bruno_Ports, "__file__", None)):
+                if not (source and os.path.isfile(source)):
+                    self._version = ""
+                    break
+                with open(source, "rb") as f:
+                    h.update(f.read())
+            else:
+                self._version = h.hexdigest()[:16]
+        return self._version or None
+
+    def key(self, decl):
+        """
+        Content address of the variant currently being produced by decl, or
+        None if the library version is unknown.
+        """
+        if self.version is None:
+            return None
+        params = []
+        for p in decl.get_parameters():
+            value = getattr(decl, p.name)
+            if isinstance(value, float):
+                value = round(value, 9)
+            params.append((p.name, str(value)))
+        text = repr((type(decl).__name__, tuple(params), round(decl.layout.dbu, 12), self.version))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, self.version, key + ".oas")
+
+    def load(self, key, ly, cell):
+        """Fills cell from the cache entry for key; returns False on a miss."""
+        path = self._file(key)
+        if not os.path.isfile(path):
+            return False
+        try:
+            src_ly = pya.Layout()
+            src_ly.read(path)
+            src_cell = src_ly.top_cell()
+            copy_cell_tree(src_ly, src_cell, ly, cell)
+        except Exception:
+            cell.clear()
+            return False
+        os.utime(path, None)
+        return True
+
+    def store(self, key, ly, cell):
+        """Writes cell and its sub-cells as the cache entry for key."""
+        try:
+            directory = os.path.join(self.path, self.version)
+            if not os.path.isdir(directory):
+                self.invalidate()
+                os.makedirs(directory)
+            dst_ly = pya.Layout()
+            dst_ly.dbu = ly.dbu
+            copy_cell_tree(ly, cell, dst_ly, dst_ly.create_cell(cell.name))
+            fd, tmp = tempfile.mkstemp(suffix=".oas", dir=directory)
+            os.close(fd)
+            dst_ly.write(tmp)
+            os.replace(tmp, self._file(key))
+            self.evict()
+        except Exception as e:
+            warnings.warn("PCell cache: cannot store %s in %s: %s" % (cell.name, self.path, e))
+
+    def entries(self):
+        """(mtime, size, path) of every entry, oldest first."""
+        directory = os.path.join(self.path, self.version)
+        if not os.path.isdir(directory):
+            return []
+        out = []
+        for name in os.listdir(directory):
+            if name.endswith(".oas"):
+                st = os.stat(os.path.join(directory, name))
+                out.append((st.st_mtime, st.st_size, os.path.join(directory, name)))
+        return sorted(out)
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def invalidate(self, all_versions=False):
+        """Drops the entries of other library versions, or of every version."""
+        import shutil
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if all_versions or name != self.version:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+# Set BRUNO_PCELL_CACHE to a directory, or to 1 for the default one, to enable the cache
+_cache_path = os.environ.get("BRUNO_PCELL_CACHE", "")
+if _cache_path == "1":
+    _cache_path = os.path.join(os.path.expanduser("~"), ".klayout", "bruno_pcell_cache")
+PCELL_CACHE = PCellDiskCache(
+    "" if _cache_path == "0" else _cache_path,
+    int(os.environ.get("BRUNO_PCELL_CACHE_MB", 256)) * 1024 * 1024)
+
+
+def disk_cached(produce_impl):
+    """Decorator for produce_impl that loads and stores variants in PCELL_CACHE."""
+    @functools.wraps(produce_impl)
+    def produce(self):
+        key = PCELL_CACHE.key(self) if PCELL_CACHE.enabled else None
+        if key and PCELL_CACHE.load(key, self.layout, self.cell):
+            if PROFILER.enabled:
+                PROFILER.emit({"pcell": type(self).__name__, "cell": self.cell.name, "cached": True})
+            return
+        produce_impl(self)
+        if key:
+            PCELL_CACHE.store(key, self.layout, self.cell)
+    return produce
+
+
+class SectionTrace(object):
+    """
+    Trace of one produce_impl call. trace(name) ends the running section and
+    starts name; each section records its wall time and how many shapes,
+    instances and layout cells were added while it ran (shapes still held
+    by the ShapeBatch count as inserted). done() closes the trace.
+    """
+
+    def __init__(self, profiler, decl, batch):
+        self.profiler = profiler
+        self.decl = decl
+        self.batch = batch
+        self.sections = []
+        self.t_start = time.perf_counter()
+        self.name = "Setup"
+        self.counts = self._counts()
+        self.t = time.perf_counter()
+
+    def _counts(self):
+        cell, ly = self.decl.cell, self.decl.layout
+        shapes = sum(cell.shapes(li).size() for li in ly.layer_indexes())
+        if self.batch is not None:
+            shapes += sum(len(b) for b in self.batch.batches.values())
+        return shapes, cell.child_instances(), ly.cells()
+
+    def __call__(self, name):
+        dt = time.perf_counter() - self.t
+        counts = self._counts()
+        self.sections.append({"section": self.name, "ms": dt*1e3,
+                              "shapes": counts[0] - self.counts[0],
+                              "instances": counts[1] - self.counts[1],
+                              "cells": counts[2] - self.counts[2]})
+        self.name, self.counts = name, counts
+        self.t = time.perf_counter()
+
+    def done(self):
+        self(None)
+        params = dict((p.name, getattr(self.decl, p.name)) for p in self.decl.get_parameters())
+        self.profiler.emit({
+            "pcell": type(self.decl).__name__, "cell": self.decl.cell.name,
+            "params": dict((k, v if isinstance(v, (int, float, str)) else str(v)) for k, v in params.items()),
+            "total_ms": (time.perf_counter() - self.t_start)*1e3, "sections": self.sections})
+
+
+class _NoTrace(object):
+    def __call__(self, name):
+        pass
+
+    def done(self):
+        pass
+
+
+class SectionProfiler(object):
+    """
+    Opt-in instrumentation of produce_impl. target is "" (off), "1" (print
+    each trace) or a file name the traces are appended to as JSON lines. The
+    last traces are also kept in self.traces. While disabled, trace() hands
+    out a no-op, so the section markers cost a function call.
+    """
+
+    def __init__(self, target=""):
+        self.target = target
+        self.enabled = bool(target)
+        self.traces = collections.deque(maxlen=1000)
+
+    def trace(self, decl, batch=None):
+        return SectionTrace(self, decl, batch) if self.enabled else _NoTrace()
+
+    def emit(self, trace):
+        self.traces.append(trace)
+        if self.target == "1":
+            self.report(trace)
+        elif self.target:
+            with open(self.target, "a") as f:
+                f.write(json.dumps(trace) + "\n")
+
+    @staticmethod
+    def report(trace):
+        if trace.get("cached"):
+            print("%s %s: loaded from the PCell cache" % (trace["pcell"], trace["cell"]))
+            return
+        print("%s %s: %.2f ms" % (trace["pcell"], trace["cell"], trace["total_ms"]))
+        for s in trace["sections"]:
+            print("  %-60s %8.2f ms %6d shapes %4d instances %3d cells" % (
+                s["section"], s["ms"], s["shapes"], s["instances"], s["cells"]))
+
+
+# Set BRUNO_PCELL_PROFILE to 1 to print section traces, or to a file name to log them
+PROFILER = SectionProfiler(os.environ.get("BRUNO_PCELL_PROFILE", ""))
+
 
 class Db_MMI_RR(pya.PCellDeclarationHelper):
     """
@@ -54,6 +973,7 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
     def can_create_from_shape_impl(self):
         return False
 
+    @disk_cached
     def produce_impl(self):
         # This is the main part of the implementation: create the layout
         from math import pi, cos, sin
@@ -63,7 +983,6 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
     #    TECHNOLOGY = get_technology_by_name('GSiP')
         dbu = self.layout.dbu
         ly = self.layout
-        shapes = self.cell.shapes
 
         LayerSi = self.silayer
         LayerSi3 = ly.layer(self.si3layer)
@@ -75,13 +994,17 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
         LayerPinRecN = ly.layer(self.pinrec)
         LayerDevRecN = ly.layer(self.devrec)
 
+        # Silicon and heater polygons are collected and inserted merged by flush()
+        shapes = ShapeBatch(self.cell, (LayerSiN, LayermhN))
+        trace = PROFILER.trace(self, shapes)
+
         # Define variables for the Modulator
         # Variables for the Si waveguide
         w = to_itype(self.w, dbu)
         r = to_itype(self.r, dbu)
 
         # Variables for the N layer
-        w_1 = 2.0 / dbu  # same for N, P, N+, P+ layer
+        w_1 = to_itype(2.0, dbu)  # same for N, P, N+, P+ layer
         r_n = to_itype(self.r - 1.0, dbu)
 
         # Variables for the VC layer
@@ -109,311 +1032,101 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
 
         # Variables for the MH layer
         w_mh = to_itype(self.w_mh, dbu)
-        w_mh_min = 2.0/dbu
+        w_mh_min = to_itype(2.0, dbu)
 
-        # Define Ring centre
-        x0 = r + w / 2
+        # Define Ring centre, the integer anchor of the device grid
+        x0 = snap_coord(r + w/2)
         y0 = r + w
+        grid = Grid(x0, y0)
 
-        MMI_L = self.MMI_L/dbu
-        MMI_w = self.MMI_w/dbu
-        yb_l = 15/dbu
-        yb_w = 6/dbu
-        tap_w = 0.8 / dbu
-        tap_ls = self.tap_ls/dbu
+        MMI_L = to_itype(self.MMI_L, dbu)
+        MMI_w = to_itype(self.MMI_w, dbu)
+        yb_l = to_itype(15, dbu)
+        yb_w = to_itype(6, dbu)
+        tap_w = to_itype(0.8, dbu)
+        tap_ls = to_itype(self.tap_ls, dbu)
 
-        if tap_ls >= 14/dbu:
+        if tap_ls >= to_itype(14, dbu):
             tap_l = tap_ls
         else:
-            tap_l = 14/dbu
+            tap_l = to_itype(14, dbu)
 
-        Spiral_Dx = 5/dbu
+        Spiral_Dx = to_itype(5, dbu)
 
-        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - 36.5/dbu
-        x_end = x0 + MMI_L/2 + tap_l + yb_l + 0.2/dbu
+        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - to_itype(36.5, dbu)
+        x_end = x0 + MMI_L/2 + tap_l + yb_l + to_itype(0.2, dbu)
+
+        via = via_stack_cell(ly, LayervlN, LayermhN, LayermlN, LayerPinRecN)
 
         def vias(x_v, y_v):
-            sq_s = 3.0/2
-            sq_L = 6.0/2
-            boxVL3 = pya.Box(x_v - sq_s / dbu, y_v - sq_s / dbu,
-                    x_v + sq_s / dbu, y_v + sq_s / dbu)
-            boxMH1 = pya.Box(x_v - sq_L / dbu, y_v - sq_L / dbu,
-                x_v + sq_L / dbu, y_v + sq_L / dbu)
-            shapes(LayervlN).insert(boxVL3)
-            shapes(LayermhN).insert(boxMH1)
-            shapes(LayermlN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(
-                pya.Text("elec2h2", pya.Trans(pya.Trans.R0, x_v, y_v))
-            ).text_size = 0.5 / dbu
+            self.cell.insert(pya.CellInstArray(via.cell_index(),
+                grid.trans(pya.Trans.R0, x_v, y_v)))
 
         #####################
         # Generate the layout:
-        # MMI 1
-
-
-        mmi = pya.Box(x0 - MMI_L/2, y0 + MMI_w / 2,
-                      x0 + MMI_L/2, y0 - MMI_w / 2)
-        shapes(LayerSiN).insert(mmi)
-
-
-
-        # Tapers for MMI 1
-
-        taperTL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 - w/2),
-        ])
-        taperTR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 - w/2),
-        ])
-        shapes(LayerSiN).insert(taperTL)
-        shapes(LayerSiN).insert(taperBL)
-        shapes(LayerSiN).insert(taperTR)
-        shapes(LayerSiN).insert(taperBR)
-
-        from SiEPIC.utils import arc_wg_xy
-        # def arc_wg_xy(x, y, r, w, theta_start, theta_stop, DevRec=None):
-
-        # Connecting arcs - MMI 1 to MMI 2
-
-        arcR = pya.Polygon(arc_wg_xy(
-                x0 + MMI_L/2 + tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                -90, 90
-        ))
-        arcL = pya.Polygon(arc_wg_xy(
-                x0 - MMI_L/2 - tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                90, -90
-        ))
-        shapes(LayerSiN).insert(arcR)
-        shapes(LayerSiN).insert(arcL)
-
-        # MMI 2, tapers and ring
-
-        x1 = x0
-        y1 = y0 + MMI_w/2 + 2*self.r/dbu
+        # Double MMI ring block with its heaters, vias and ground lines, shared
+        # by every device with the same ring
+        trace("Ring block")
 
         MMI_L2 = to_itype(self.MMI_L2, dbu)
-
-        mmi2 = pya.Box(x1 - MMI_L2/2, y1 + MMI_w / 2,
-                      x1 + MMI_L2/2, y1 - MMI_w / 2)
-        shapes(LayerSiN).insert(mmi2)
-
-        taperTL2 = pya.Polygon([
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/4 + w/2),
-                pya.Point(x1 - MMI_L2/2, y1 + MMI_w/4 + tap_w/2),
-                pya.Point(x1 - MMI_L2/2, y1 + MMI_w/4 - tap_w/2),
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/4 - w/2),
-        ])
-        taperBL2 = pya.Polygon([
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 - MMI_w/4 + w/2),
-                pya.Point(x1 - MMI_L2/2, y1 - MMI_w/4 + tap_w/2),
-                pya.Point(x1 - MMI_L2/2, y1 - MMI_w/4 - tap_w/2),
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 - MMI_w/4 - w/2),
-        ])
-        taperTR2 = pya.Polygon([
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 + MMI_w/4 + w/2),
-                pya.Point(x1 + MMI_L2/2, y1 + MMI_w/4 + tap_w/2),
-                pya.Point(x1 + MMI_L2/2, y1 + MMI_w/4 - tap_w/2),
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 + MMI_w/4 - w/2),
-        ])
-        taperBR2 = pya.Polygon([
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 - MMI_w/4 + w/2),
-                pya.Point(x1 + MMI_L2/2, y1 - MMI_w/4 + tap_w/2),
-                pya.Point(x1 + MMI_L2/2, y1 - MMI_w/4 - tap_w/2),
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 - MMI_w/4 - w/2),
-        ])
-
-        shapes(LayerSiN).insert(taperTL2)
-        shapes(LayerSiN).insert(taperBL2)
-        shapes(LayerSiN).insert(taperTR2)
-        shapes(LayerSiN).insert(taperBR2)
-
-        arcR2 = pya.Polygon(arc_wg_xy(
-                x1 + MMI_L/2 + tap_ls ,
-                y1 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                -90, 90
-        ))
-        arcL2 = pya.Polygon(arc_wg_xy(
-                x1 - MMI_L/2 - tap_ls ,
-                y1 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                90, -90
-        ))
-        shapes(LayerSiN).insert(arcR2)
-        shapes(LayerSiN).insert(arcL2)
-
-        wg_T = pya.Box(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/2 + 2*self.r/dbu - self.w/2/dbu,
-                      x1 + MMI_L/2 + tap_ls, y1 + MMI_w/2 + 2*self.r/dbu - 3*self.w/2/dbu
-        )
-        shapes(LayerSiN).insert(wg_T)
-
-        # Heater arcs
-
-        arcR = pya.Polygon(arc_wg_xy(
-                x0 + MMI_L/2 + tap_ls + w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                -90, 90
-        ))
-        arcL = pya.Polygon(arc_wg_xy(
-                x0 - MMI_L/2 - tap_ls - w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                90, -90
-        ))
-        shapes(LayermhN).insert(arcR)
-        shapes(LayermhN).insert(arcL)
-        arcR2 = pya.Polygon(arc_wg_xy(
-                x1 + MMI_L/2 + tap_ls + w_mh/2,
-                y1 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                -90, 90
-        ))
-        arcL2 = pya.Polygon(arc_wg_xy(
-                x1 - MMI_L/2 - tap_ls - w_mh/2,
-                y1 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                90, -90
-        ))
-        shapes(LayermhN).insert(arcR2)
-        shapes(LayermhN).insert(arcL2)
-
-        # Connecting heater metal between arcs
-
-        shapes(LayermhN).insert(pya.Box(
-            x0 - MMI_L/2 - tap_ls - w_mh_min,
-            y0 + 2*self.r/dbu + MMI_w/4 - 2.5/dbu,
-            x0 - MMI_L/2 - tap_ls - 0/dbu,
-            y0 + 2*self.r/dbu + MMI_w/4 + 3.5/dbu,
-        ))
-        shapes(LayermhN).insert(pya.Box(
-            x0 + MMI_L/2 + tap_ls + w_mh_min,
-            y0 + 2*self.r/dbu + MMI_w/4 - 2.5/dbu,
-            x0 + MMI_L/2 + tap_ls - 0/dbu,
-            y0 + 2*self.r/dbu + MMI_w/4 + 3.5/dbu,
-        ))
-
-        # Vias for arc arc heaters connection
-
-        vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 - w)
-        vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 - w)
-
-        # Common ground for arc heater
-
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0)], 4/dbu
-        ))
-
-        # MMI 2 heater
-
-        shapes(LayermhN).insert(
-            pya.Box(
-                x0 - MMI_L/2, y0 + MMI_w/2 + 2*r + w_mh/2,
-                x0 + MMI_L/2, y0 + MMI_w/2 + 2*r - w_mh/2
-            )
-        )
-        # Vias for MMI 2 heater
-
-        vias(x0 - MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
-        vias(x0 + MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
-
-
-        vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 - w + 4*r + 4*w)
-        vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 - w + 4*r + 4*w)
-
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0 + 4*r + 6*w),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0 + 4*r + 6*w)], 4/dbu
-        ))
+        place_ring_block(self.cell, shapes, (LayerSiN, LayervlN, LayermlN, LayermhN, LayerPinRecN),
+                RingDims(MMI_L, MMI_L2, MMI_w, tap_ls, tap_l, tap_w, w, r, w_mh, dbu), x0, y0)
 
         # Y-Branches
+        trace("Y-Branches")
 
-        t = pya.Trans(pya.Trans.R180,
+        t = grid.trans(pya.Trans.R180,
                     x0 + MMI_L/2 + tap_l + yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
-        t = pya.Trans(pya.Trans.R0,
+        t = grid.trans(pya.Trans.R0,
                     x0 - MMI_L/2 - tap_l - yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
         # Input waveguide
+        trace("Input waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l - yb_l, y0 - yb_w/2,
             x_start, y0 - yb_w/2 - w
         ))
 
         # Spiral
+        trace("Spiral")
 
-        Dy = 30/dbu
-        t = pya.Trans(pya.Trans.R90,
+        Dy = to_itype(30, dbu)
+        t = grid.trans(pya.Trans.R90,
             x0 - MMI_L/2 - tap_l + Spiral_Dx,
             y0 - MMI_w/2 - yb_w - Dy,
         )
-        pcell = ly.create_cell("Spiral", "EBeam-dev",{
-            "length": 200,
-            "wg_width": 0.5,
-            "min_radius": 5,
-            "wg_spacing": 8,
-            "spiral_ports": 1,
-            "layer": LayerSi
-        })
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(),t))
+        spiral = spiral_cell(ly, (LayerSiN, LayerPinRecN, LayerDevRecN), length=200, wg_width=0.5,
+            min_radius=5, wg_spacing=8, spiral_ports=1)
+        self.cell.insert(pya.CellInstArray(spiral.cell_index(), t))
 
         # Horizontal waveguide to match central position of the spiral with connecting arc
+        trace("Horizontal waveguide to the spiral")
 
-        wg = pya.Box(
+        wg = grid.box(
         x0 - MMI_L/2 - tap_l, y0 - MMI_w/2 - yb_w + 3*w/2,
         x0 - MMI_L/2 - tap_l + Spiral_Dx, y0 - MMI_w/2 - yb_w + 5*w/2
         )
         shapes(LayerSiN).insert(wg)
 
         # Connecting arc between input y-branch and spiral
+        trace("Connecting arc between input y-branch and spiral")
 
-        Dy = 58/dbu
+        Dy = to_itype(58, dbu)
         #
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
 
-        arcS1 = pya.Polygon(arc_wg_xy(
+        arcS1 = pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -423,11 +1136,12 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
         shapes(LayerSiN).insert(arcS1)
 
         # Connecting waveguides between spiral and output y-branch
+        trace("Connecting waveguides between spiral and output y-branch")
 
-        Dy = 66.5/dbu
+        Dy = to_itype(66.5, dbu)
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
-        arcS2 = pya.Polygon(arc_wg_xy(
+        arcS2 = pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -435,11 +1149,11 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
                 -90, 0
         ))
         shapes(LayerSiN).insert(arcS2)
-        Dx1 = (32.9 + 0.85 - Spiral_Dx*dbu)/dbu
-        Dy = 33.25/dbu
+        Dx1 = to_itype(32.9 + 0.85, dbu) - Spiral_Dx
+        Dy = to_itype(33.25, dbu)
         coupler_l = MMI_L + 2*tap_l
         Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-        arcS3 = pya.Polygon(arc_wg_xy(
+        arcS3 = pya.Polygon(grid.arc(
                 x1 + coupler_l,
                 y1 + Dy - Dx2,
                 Dx2,
@@ -448,24 +1162,25 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
         ))
 
         shapes(LayerSiN).insert(arcS3)
-        wg = pya.Box(
+        wg = grid.box(
         x1 + 2*Spiral_Dx + Dx1 - 3*w/2, y1 + Dy - Dx2,
         x1 + 2*Spiral_Dx + Dx1 - w/2, y1
         )
         shapes(LayerSiN).insert(wg)
 
         # MZI phase tuning heater
+        trace("MZI phase tuning heater")
 
-        vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + 4.75/dbu, y1 + Dy - Dx2 - w_mh)
-        Dy = 66.5/dbu
-        Spiral_Dx = 5/dbu
-        vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - 4.5/dbu)
+        vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + to_itype(4.75, dbu), y1 + Dy - Dx2 - w_mh)
+        Dy = to_itype(66.5, dbu)
+        Spiral_Dx = to_itype(5, dbu)
+        vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - to_itype(4.5, dbu))
         shapes(LayermhN).insert(
-            pya.Box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
+            grid.box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
                 x1 + Spiral_Dx - 2*w_mh, y1 - Dy/2 - w_mh/2
             ))
         shapes(LayermhN).insert(
-            pya.Polygon(arc_wg_xy(
+            pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -474,55 +1189,69 @@ class Db_MMI_RR(pya.PCellDeclarationHelper):
             ))
         )
 
-        Dx1 = 33.75/dbu - Spiral_Dx
+        Dx1 = to_itype(33.75, dbu) - Spiral_Dx
         Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-        Dy = 33.25/dbu
-        shapes(LayermhN).insert(pya.Box(
+        Dy = to_itype(33.25, dbu)
+        shapes(LayermhN).insert(grid.box(
             x1 + 2*Spiral_Dx + Dx1 - w - w_mh/2, y1 + Dy - Dx2,
             x1 + 2*Spiral_Dx + Dx1 - w + w_mh/2, y1
         ))
 
         # Create the pins, as short paths:
+        trace("Pins")
         from SiEPIC._globals import PIN_LENGTH as pin_length
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(x_start + pin_length/2, y0 - yb_w/2 - w/2),
-            pya.Point(x_start - pin_length/2, y0 - yb_w/2 - w/2)
+        shapes(LayerPinRecN).insert(grid.path([
+            (x_start + pin_length/2, y0 - yb_w/2 - w/2),
+            (x_start - pin_length/2, y0 - yb_w/2 - w/2)
             ], w
         ))
         #
         #
 
         #
-        shapes(LayerPinRecN).insert(pya.Text("opt1", pya.Trans(pya.Trans.R0,
+        shapes(LayerPinRecN).insert(pya.Text("opt1", grid.trans(pya.Trans.R0,
             x_start, y0 - yb_w/2 - w/2))).text_size = 0.5 / dbu
         #
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+        shapes(LayerPinRecN).insert(grid.path([
+            (
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             ),
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+            (
+                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             )],
         w))
         shapes(LayerSiN).insert(
-            pya.Box(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.15/dbu, y0 - yb_w/2,
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - 0.05/dbu, y0 - yb_w/2 - w
+            grid.box(
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.15, dbu), y0 - yb_w/2,
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - to_itype(0.05, dbu), y0 - yb_w/2 - w
             )
         )
 
-        shapes(LayerPinRecN).insert(pya.Text("opt2", pya.Trans(
+        shapes(LayerPinRecN).insert(pya.Text("opt2", grid.trans(
             pya.Trans.R0,
                 x_end, y0 - yb_w/2 - w/2
             ))).text_size = 0.5 / dbu
+        ports = {
+            "opt1": (x_start, y0 - yb_w/2 - w/2, 180, w),
+            "opt2": (x_end, y0 - yb_w/2 - w/2, 0, w),
+        }
+        ports.update(via_ports(self.cell, via))
+        port_table(self.cell, dbu, ports, grid)
+        device_info(self)
 
         # Create the device recognition layer
-        shapes(LayerDevRecN).insert(pya.Box(
+        trace("DevRec")
+        shapes(LayerDevRecN).insert(grid.box(
             x_start, y0 + 4*r + 2*MMI_w + 2*w,
-            x_end, y0 - 80/dbu
+            x_end, y0 - to_itype(80, dbu)
         ))
 
+        trace("Merge")
+        shapes.flush()
+        trace.done()
+
+
 class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
     """
     The PCell declaration for thermally tunable ring filter.
@@ -557,6 +1286,7 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
     def can_create_from_shape_impl(self):
         return False
 
+    @disk_cached
     def produce_impl(self):
         # This is the main part of the implementation: create the layout
         from math import pi, cos, sin
@@ -566,7 +1296,6 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
     #    TECHNOLOGY = get_technology_by_name('GSiP')
         dbu = self.layout.dbu
         ly = self.layout
-        shapes = self.cell.shapes
 
         LayerSi = self.silayer
         LayerSi3 = ly.layer(self.si3layer)
@@ -578,6 +1307,10 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
         LayerPinRecN = ly.layer(self.pinrec)
         LayerDevRecN = ly.layer(self.devrec)
 
+        # Silicon and heater polygons are collected and inserted merged by flush()
+        shapes = ShapeBatch(self.cell, (LayerSiN, LayermhN))
+        trace = PROFILER.trace(self, shapes)
+
         # Define variables for the Modulator
         # Variables for the Si waveguide
         w = to_itype(self.w, dbu)
@@ -585,309 +1318,101 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
 
         # Variables for the MH layer
         w_mh = to_itype(self.w_mh, dbu)
-        w_mh_min = 2.0/dbu
+        w_mh_min = to_itype(2.0, dbu)
 
-        # Define Ring centre
-        x0 = r + w / 2
+        # Define Ring centre, the integer anchor of the device grid
+        x0 = snap_coord(r + w/2)
         y0 = r + w
+        grid = Grid(x0, y0)
 
-        MMI_L = self.MMI_L/dbu
-        MMI_w = self.MMI_w/dbu
-        yb_l = 15/dbu
-        yb_w = 6/dbu
-        tap_w = 0.8 / dbu
-        tap_ls = self.tap_ls/dbu
+        MMI_L = to_itype(self.MMI_L, dbu)
+        MMI_w = to_itype(self.MMI_w, dbu)
+        yb_l = to_itype(15, dbu)
+        yb_w = to_itype(6, dbu)
+        tap_w = to_itype(0.8, dbu)
+        tap_ls = to_itype(self.tap_ls, dbu)
 
-        if tap_ls >= 14/dbu:
+        if tap_ls >= to_itype(14, dbu):
             tap_l = tap_ls
         else:
-            tap_l = 14/dbu
+            tap_l = to_itype(14, dbu)
 
-        Spiral_Dx = 5/dbu
+        Spiral_Dx = to_itype(5, dbu)
 
-        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - 25.5/dbu
-        x_end = x0 + MMI_L/2 + tap_l + yb_l + 0.2/dbu
+        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - to_itype(25.5, dbu)
+        x_end = x0 + MMI_L/2 + tap_l + yb_l + to_itype(0.2, dbu)
+
+        via = via_stack_cell(ly, LayervlN, LayermhN, LayermlN, LayerPinRecN)
 
         def vias(x_v, y_v):
-            sq_s = 3.0/2
-            sq_L = 6.0/2
-            boxVL3 = pya.Box(x_v - sq_s / dbu, y_v - sq_s / dbu,
-                    x_v + sq_s / dbu, y_v + sq_s / dbu)
-            boxMH1 = pya.Box(x_v - sq_L / dbu, y_v - sq_L / dbu,
-                x_v + sq_L / dbu, y_v + sq_L / dbu)
-            shapes(LayervlN).insert(boxVL3)
-            shapes(LayermhN).insert(boxMH1)
-            shapes(LayermlN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(
-                pya.Text("elec2h2", pya.Trans(pya.Trans.R0, x_v, y_v))
-            ).text_size = 0.5 / dbu
+            self.cell.insert(pya.CellInstArray(via.cell_index(),
+                grid.trans(pya.Trans.R0, x_v, y_v)))
 
         #####################
         # Generate the layout:
-        # MMI 1
-
-
-        mmi = pya.Box(x0 - MMI_L/2, y0 + MMI_w / 2,
-                      x0 + MMI_L/2, y0 - MMI_w / 2)
-        shapes(LayerSiN).insert(mmi)
-
-        # Tapers for MMI 1
-
-        taperTL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 - w/2),
-        ])
-        taperTR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 - w/2),
-        ])
-        shapes(LayerSiN).insert(taperTL)
-        shapes(LayerSiN).insert(taperBL)
-        shapes(LayerSiN).insert(taperTR)
-        shapes(LayerSiN).insert(taperBR)
-
-        from SiEPIC.utils import arc_wg_xy
-        # def arc_wg_xy(x, y, r, w, theta_start, theta_stop, DevRec=None):
-
-        # Connecting arcs - MMI 1 to MMI 2
-
-        arcR = pya.Polygon(arc_wg_xy(
-                x0 + MMI_L/2 + tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                -90, 90
-        ))
-        arcL = pya.Polygon(arc_wg_xy(
-                x0 - MMI_L/2 - tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                90, -90
-        ))
-        shapes(LayerSiN).insert(arcR)
-        shapes(LayerSiN).insert(arcL)
-
-        # MMI 2, tapers and ring
-
-        x1 = x0
-        y1 = y0 + MMI_w/2 + 2*self.r/dbu
+        # Double MMI ring block with its heaters, vias and ground lines, shared
+        # by every device with the same ring
+        trace("Ring block")
 
         MMI_L2 = to_itype(self.MMI_L2, dbu)
-
-        mmi2 = pya.Box(x1 - MMI_L2/2, y1 + MMI_w / 2,
-                      x1 + MMI_L2/2, y1 - MMI_w / 2)
-        shapes(LayerSiN).insert(mmi2)
-
-        taperTL2 = pya.Polygon([
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/4 + w/2),
-                pya.Point(x1 - MMI_L2/2, y1 + MMI_w/4 + tap_w/2),
-                pya.Point(x1 - MMI_L2/2, y1 + MMI_w/4 - tap_w/2),
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/4 - w/2),
-        ])
-        taperBL2 = pya.Polygon([
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 - MMI_w/4 + w/2),
-                pya.Point(x1 - MMI_L2/2, y1 - MMI_w/4 + tap_w/2),
-                pya.Point(x1 - MMI_L2/2, y1 - MMI_w/4 - tap_w/2),
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 - MMI_w/4 - w/2),
-        ])
-        taperTR2 = pya.Polygon([
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 + MMI_w/4 + w/2),
-                pya.Point(x1 + MMI_L2/2, y1 + MMI_w/4 + tap_w/2),
-                pya.Point(x1 + MMI_L2/2, y1 + MMI_w/4 - tap_w/2),
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 + MMI_w/4 - w/2),
-        ])
-        taperBR2 = pya.Polygon([
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 - MMI_w/4 + w/2),
-                pya.Point(x1 + MMI_L2/2, y1 - MMI_w/4 + tap_w/2),
-                pya.Point(x1 + MMI_L2/2, y1 - MMI_w/4 - tap_w/2),
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 - MMI_w/4 - w/2),
-        ])
-
-        shapes(LayerSiN).insert(taperTL2)
-        shapes(LayerSiN).insert(taperBL2)
-        shapes(LayerSiN).insert(taperTR2)
-        shapes(LayerSiN).insert(taperBR2)
-
-        arcR2 = pya.Polygon(arc_wg_xy(
-                x1 + MMI_L/2 + tap_ls ,
-                y1 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                -90, 90
-        ))
-        arcL2 = pya.Polygon(arc_wg_xy(
-                x1 - MMI_L/2 - tap_ls ,
-                y1 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                90, -90
-        ))
-        shapes(LayerSiN).insert(arcR2)
-        shapes(LayerSiN).insert(arcL2)
-
-        wg_T = pya.Box(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/2 + 2*self.r/dbu - self.w/2/dbu,
-                      x1 + MMI_L/2 + tap_ls, y1 + MMI_w/2 + 2*self.r/dbu - 3*self.w/2/dbu
-        )
-        shapes(LayerSiN).insert(wg_T)
-
-        # Heater arcs
-
-        arcR = pya.Polygon(arc_wg_xy(
-                x0 + MMI_L/2 + tap_ls + w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                -90, 90
-        ))
-        arcL = pya.Polygon(arc_wg_xy(
-                x0 - MMI_L/2 - tap_ls - w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                90, -90
-        ))
-        shapes(LayermhN).insert(arcR)
-        shapes(LayermhN).insert(arcL)
-        arcR2 = pya.Polygon(arc_wg_xy(
-                x1 + MMI_L/2 + tap_ls + w_mh/2,
-                y1 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                -90, 90
-        ))
-        arcL2 = pya.Polygon(arc_wg_xy(
-                x1 - MMI_L/2 - tap_ls - w_mh/2,
-                y1 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                90, -90
-        ))
-        shapes(LayermhN).insert(arcR2)
-        shapes(LayermhN).insert(arcL2)
-
-        # Connecting heater metal between arcs
-
-        shapes(LayermhN).insert(pya.Box(
-            x0 - MMI_L/2 - tap_ls - w_mh_min,
-            y0 + 2*self.r/dbu + MMI_w/4 - 2.5/dbu,
-            x0 - MMI_L/2 - tap_ls - 0/dbu,
-            y0 + 2*self.r/dbu + MMI_w/4 + 3.5/dbu,
-        ))
-        shapes(LayermhN).insert(pya.Box(
-            x0 + MMI_L/2 + tap_ls + w_mh_min,
-            y0 + 2*self.r/dbu + MMI_w/4 - 2.5/dbu,
-            x0 + MMI_L/2 + tap_ls - 0/dbu,
-            y0 + 2*self.r/dbu + MMI_w/4 + 3.5/dbu,
-        ))
-
-        # Vias for arc arc heaters connection
-
-        vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 - w)
-        vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 - w)
-
-        # Common ground for arc heater
-
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0)], 4/dbu
-        ))
-
-        # MMI 2 heater
-
-        shapes(LayermhN).insert(
-            pya.Box(
-                x0 - MMI_L/2, y0 + MMI_w/2 + 2*r + w_mh/2,
-                x0 + MMI_L/2, y0 + MMI_w/2 + 2*r - w_mh/2
-            )
-        )
-        # Vias for MMI 2 heater
-
-        vias(x0 - MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
-        vias(x0 + MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
-
-
-        vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 - w + 4*r + 4*w)
-        vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 - w + 4*r + 4*w)
-
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0 + 4*r + 6*w),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0 + 4*r + 6*w)], 4/dbu
-        ))
+        place_ring_block(self.cell, shapes, (LayerSiN, LayervlN, LayermlN, LayermhN, LayerPinRecN),
+                RingDims(MMI_L, MMI_L2, MMI_w, tap_ls, tap_l, tap_w, w, r, w_mh, dbu), x0, y0)
 
         # Y-Branches
+        trace("Y-Branches")
 
-        t = pya.Trans(pya.Trans.R180,
+        t = grid.trans(pya.Trans.R180,
                     x0 + MMI_L/2 + tap_l + yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
-        t = pya.Trans(pya.Trans.R0,
+        t = grid.trans(pya.Trans.R0,
                     x0 - MMI_L/2 - tap_l - yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
         # Input waveguide
+        trace("Input waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l - yb_l, y0 - yb_w/2,
             x_start, y0 - yb_w/2 - w
         ))
 
         # Spiral
+        trace("Spiral")
 
-        Dy = 25/dbu
-        t = pya.Trans(pya.Trans.R90,
+        Dy = to_itype(25, dbu)
+        t = grid.trans(pya.Trans.R90,
             x0 - MMI_L/2 - tap_l + Spiral_Dx,
             y0 - MMI_w/2 - yb_w - Dy,
         )
-        pcell = ly.create_cell("Spiral", "EBeam-dev",{
-            "length": 10,
-            "wg_width": 0.5,
-            "min_radius": 5,
-            "wg_spacing": 4,
-            "spiral_ports": 1,
-            "layer": LayerSi
-        })
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(),t))
+        spiral = spiral_cell(ly, (LayerSiN, LayerPinRecN, LayerDevRecN), length=10, wg_width=0.5,
+            min_radius=5, wg_spacing=4, spiral_ports=1)
+        self.cell.insert(pya.CellInstArray(spiral.cell_index(), t))
 
         # Horizontal waveguide to match central position of the spiral with connecting arc
+        trace("Horizontal waveguide to the spiral")
 
-        wg = pya.Box(
+        wg = grid.box(
             x0 - MMI_L/2 - tap_l, y0 - MMI_w/2 - yb_w + 3*w/2,
             x0 - MMI_L/2 - tap_l + Spiral_Dx, y0 - MMI_w/2 - yb_w + 5*w/2
         )
         shapes(LayerSiN).insert(wg)
 
         # Connecting arc between input y-branch and spiral
+        trace("Connecting arc between input y-branch and spiral")
 
-        Dy = 45.0/dbu
+        Dy = to_itype(45.0, dbu)
         Dx = 2*tap_l + MMI_L - Spiral_Dx
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
 
-        arcS1 = pya.Polygon(arc_wg_xy(
+        arcS1 = pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -897,13 +1422,14 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
         shapes(LayerSiN).insert(arcS1)
 
         # Connecting waveguides between spiral and output y-branch
-        Dy = 49.5/dbu
+        trace("Connecting waveguides between spiral and output y-branch")
+        Dy = to_itype(49.5, dbu)
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
         coupler_l = MMI_L + 2*tap_l
         if Dy > Dx:
 
-            arcS2 = pya.Polygon(arc_wg_xy(
+            arcS2 = pya.Polygon(grid.arc(
                     x1 + Spiral_Dx,
                     y1,
                     Dy/2,
@@ -911,9 +1437,9 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
                     -90, 0
             ))
             shapes(LayerSiN).insert(arcS2)
-            Dx1 = 33.75/dbu - Spiral_Dx
+            Dx1 = to_itype(33.75, dbu) - Spiral_Dx
             Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-            arcS3 = pya.Polygon(arc_wg_xy(
+            arcS3 = pya.Polygon(grid.arc(
                     x1 + coupler_l,
                     y1 + Dy/2 - Dx2,
                     Dx2,
@@ -922,22 +1448,22 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
             ))
 
             shapes(LayerSiN).insert(arcS3)
-            wg = pya.Box(
+            wg = grid.box(
             x1 + 2*Spiral_Dx + Dx1 - 3*w/2, y1 + Dy/2 - Dx2,
             x1 + 2*Spiral_Dx + Dx1 - w/2, y1
             )
             shapes(LayerSiN).insert(wg)
 
-            vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + 4.75/dbu, y1 + Dy - Dx2 - w_mh)
-            Dy = 66.5/dbu
-            Spiral_Dx = 5/dbu
-            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - 4.5/dbu)
+            vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + to_itype(4.75, dbu), y1 + Dy - Dx2 - w_mh)
+            Dy = to_itype(66.5, dbu)
+            Spiral_Dx = to_itype(5, dbu)
+            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - to_itype(4.5, dbu))
             shapes(LayermhN).insert(
-                pya.Box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
+                grid.box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
                     x1 + Spiral_Dx - 2*w_mh, y1 - Dy/2 - w_mh/2
                 ))
             shapes(LayermhN).insert(
-                pya.Polygon(arc_wg_xy(
+                pya.Polygon(grid.arc(
                     x1 + Spiral_Dx,
                     y1,
                     Dy/2,
@@ -946,28 +1472,28 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
                 ))
             )
 
-            Dx1 = 33.75/dbu - Spiral_Dx
+            Dx1 = to_itype(33.75, dbu) - Spiral_Dx
             Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-            Dy = 33.25/dbu
-            shapes(LayermhN).insert(pya.Box(
+            Dy = to_itype(33.25, dbu)
+            shapes(LayermhN).insert(grid.box(
                 x1 + 2*Spiral_Dx + Dx1 - w - w_mh/2, y1 + Dy - Dx2,
                 x1 + 2*Spiral_Dx + Dx1 - w + w_mh/2, y1
             ))
 
         if Dx >= Dy:
             wg_l = Dx - Dy
-            shapes(LayerSiN).insert(pya.Box(
+            shapes(LayerSiN).insert(grid.box(
                 x1 + Spiral_Dx, y1 - Dy/2 -w/2,
                 x1 + Spiral_Dx + wg_l, y1 - Dy/2 + w/2
             ))
-            shapes(LayerSiN).insert(pya.Polygon(arc_wg_xy(
+            shapes(LayerSiN).insert(pya.Polygon(grid.arc(
                     x1 + Spiral_Dx + wg_l,
                     y1,
                     Dy/2,
                     w,
                     -90, 0
             )))
-            arcS3 = pya.Polygon(arc_wg_xy(
+            arcS3 = pya.Polygon(grid.arc(
                     x1 + coupler_l,
                     y1,
                     Dy/2,
@@ -978,12 +1504,12 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
 
 
             shapes(LayermhN).insert(
-                pya.Box(x1 + Spiral_Dx + wg_l, y1 - Dy/2 + w_mh/2,
+                grid.box(x1 + Spiral_Dx + wg_l, y1 - Dy/2 + w_mh/2,
                     x1 + Spiral_Dx - 2*w_mh, y1 - Dy/2 - w_mh/2
                 ))
-            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - 4.5/dbu)
+            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - to_itype(4.5, dbu))
             shapes(LayermhN).insert(
-                pya.Polygon(arc_wg_xy(
+                pya.Polygon(grid.arc(
                     x1 + Spiral_Dx + wg_l,
                     y1,
                     Dy/2,
@@ -992,52 +1518,66 @@ class DbRR_MZI_sSpiral(pya.PCellDeclarationHelper):
                 ))
             )
 
-            shapes(LayermhN).insert(pya.Box(
+            shapes(LayermhN).insert(grid.box(
                 x1 + Spiral_Dx + wg_l + Dy/2 - w_mh/2, y1,
                 x1 + Spiral_Dx + wg_l + Dy/2 + w_mh/2, y1 + 2*w_mh
             ))
-            vias(x1 + Spiral_Dx + wg_l + Dy/2 + 4.5/dbu, y1 + w_mh)
+            vias(x1 + Spiral_Dx + wg_l + Dy/2 + to_itype(4.5, dbu), y1 + w_mh)
 
 
 
         # Create the pins, as short paths:
+        trace("Pins")
         from SiEPIC._globals import PIN_LENGTH as pin_length
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(x_start + pin_length/2, y0 - yb_w/2 - w/2),
-            pya.Point(x_start - pin_length/2, y0 - yb_w/2 - w/2)
+        shapes(LayerPinRecN).insert(grid.path([
+            (x_start + pin_length/2, y0 - yb_w/2 - w/2),
+            (x_start - pin_length/2, y0 - yb_w/2 - w/2)
             ], w
         ))
 
-        shapes(LayerPinRecN).insert(pya.Text("opt1", pya.Trans(pya.Trans.R0,
+        shapes(LayerPinRecN).insert(pya.Text("opt1", grid.trans(pya.Trans.R0,
             x_start, y0 - yb_w/2 - w/2))).text_size = 0.5 / dbu
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+        shapes(LayerPinRecN).insert(grid.path([
+            (
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             ),
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+            (
+                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             )],
         w))
         shapes(LayerSiN).insert(
-            pya.Box(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.15/dbu, y0 - yb_w/2,
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - 0.05/dbu, y0 - yb_w/2 - w
+            grid.box(
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.15, dbu), y0 - yb_w/2,
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - to_itype(0.05, dbu), y0 - yb_w/2 - w
             )
         )
 
-        shapes(LayerPinRecN).insert(pya.Text("opt2", pya.Trans(
+        shapes(LayerPinRecN).insert(pya.Text("opt2", grid.trans(
             pya.Trans.R0,
                 x_end, y0 - yb_w/2 - w/2
             ))).text_size = 0.5 / dbu
+        ports = {
+            "opt1": (x_start, y0 - yb_w/2 - w/2, 180, w),
+            "opt2": (x_end, y0 - yb_w/2 - w/2, 0, w),
+        }
+        ports.update(via_ports(self.cell, via))
+        port_table(self.cell, dbu, ports, grid)
+        device_info(self)
 
         # Create the device recognition layer
-        shapes(LayerDevRecN).insert(pya.Box(
+        trace("DevRec")
+        shapes(LayerDevRecN).insert(grid.box(
             x_start, y0 + 4*r + 2*MMI_w + 2*w,
             x_end, y0 - MMI_w/2 - yb_w - w - Dy - 2*w_mh
         ))
 
+        trace("Merge")
+        shapes.flush()
+        trace.done()
+
+
 class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
     """
     The PCell declaration for thermally tunable ring filter.
@@ -1070,17 +1610,16 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
     def can_create_from_shape_impl(self):
         return False
 
+    @disk_cached
     def produce_impl(self):
         # This is the main part of the implementation: create the layout
         from math import pi, cos, sin
         from SiEPIC.extend import to_itype
-        from SiEPIC.utils import arc_wg_xy
 
         # fetch the parameters
     #    TECHNOLOGY = get_technology_by_name('GSiP')
         dbu = self.layout.dbu
         ly = self.layout
-        shapes = self.cell.shapes
 
         LayerSi = self.silayer
         LayerSi3 = ly.layer(self.si3layer)
@@ -1092,6 +1631,10 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
         LayerPinRecN = ly.layer(self.pinrec)
         LayerDevRecN = ly.layer(self.devrec)
 
+        # Silicon and heater polygons are collected and inserted merged by flush()
+        shapes = ShapeBatch(self.cell, (LayerSiN, LayermhN))
+        trace = PROFILER.trace(self, shapes)
+
         # Define variables for the Modulator
         # Variables for the Si waveguide
         w = to_itype(self.w, dbu)
@@ -1099,107 +1642,98 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
         # Variables for the MH layer
         w_mh = to_itype(self.w_mh, dbu)
 
-        # Define Ring centre
-        x0 = w / 2
+        # Define Ring centre, the integer anchor of the device grid
+        x0 = snap_coord(w/2)
         y0 = w
+        grid = Grid(x0, y0)
 
-        MMI_L = self.MMI_L/dbu
-        MMI_w = self.MMI_w/dbu
-        yb_l = 15/dbu
-        yb_w = 6/dbu
-        tap_w = 0.8 / dbu
-        tap_ls = self.tap_ls/dbu
+        MMI_L = to_itype(self.MMI_L, dbu)
+        MMI_w = to_itype(self.MMI_w, dbu)
+        yb_l = to_itype(15, dbu)
+        yb_w = to_itype(6, dbu)
+        tap_w = to_itype(0.8, dbu)
+        tap_ls = to_itype(self.tap_ls, dbu)
 
-        if tap_ls >= 14/dbu:
+        if tap_ls >= to_itype(14, dbu):
             tap_l = tap_ls
         else:
-            tap_l = 14/dbu
+            tap_l = to_itype(14, dbu)
+
+        Spiral_Dx = to_itype(5, dbu)
 
-        Spiral_Dx = 5/dbu
+        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - to_itype(25.5, dbu)
+        x_end = x0 + MMI_L/2 + tap_l + yb_l + to_itype(0.2, dbu)
 
-        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - 25.5/dbu
-        x_end = x0 + MMI_L/2 + tap_l + yb_l + 0.2/dbu
+        via = via_stack_cell(ly, LayervlN, LayermhN, LayermlN, LayerPinRecN)
 
         def vias(x_v, y_v):
-            sq_s = 3.0/2
-            sq_L = 6.0/2
-            boxVL3 = pya.Box(x_v - sq_s / dbu, y_v - sq_s / dbu,
-                    x_v + sq_s / dbu, y_v + sq_s / dbu)
-            boxMH1 = pya.Box(x_v - sq_L / dbu, y_v - sq_L / dbu,
-                x_v + sq_L / dbu, y_v + sq_L / dbu)
-            shapes(LayervlN).insert(boxVL3)
-            shapes(LayermhN).insert(boxMH1)
-            shapes(LayermlN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(
-                pya.Text("elec2h2", pya.Trans(pya.Trans.R0, x_v, y_v))
-            ).text_size = 0.5 / dbu
+            self.cell.insert(pya.CellInstArray(via.cell_index(),
+                grid.trans(pya.Trans.R0, x_v, y_v)))
 
 
 
         # Y-Branches
+        trace("Y-Branches")
 
-        t = pya.Trans(pya.Trans.R180,
+        t = grid.trans(pya.Trans.R180,
                     x0 + MMI_L/2 + tap_l + yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
-        t = pya.Trans(pya.Trans.R0,
+        t = grid.trans(pya.Trans.R0,
                     x0 - MMI_L/2 - tap_l - yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
         # Input waveguide
+        trace("Input waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l - yb_l, y0 - yb_w/2,
             x_start, y0 - yb_w/2 - w
         ))
 
         # short MZI Branch
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l, y0 - MMI_w/2 + 3*w/2,
             x0 + MMI_L/2 + tap_l, y0 - MMI_w/2 + w/2
         ))
 
         # Spiral
+        trace("Spiral")
 
-        Dy = 25/dbu
-        t = pya.Trans(pya.Trans.R90,
+        Dy = to_itype(25, dbu)
+        t = grid.trans(pya.Trans.R90,
             x0 - MMI_L/2 - tap_l + Spiral_Dx,
             y0 - MMI_w/2 - yb_w - Dy,
         )
-        pcell = ly.create_cell("Spiral", "EBeam-dev",{
-            "length": 10,
-            "wg_width": 0.5,
-            "min_radius": 5,
-            "wg_spacing": 4,
-            "spiral_ports": 1,
-            "layer": LayerSi
-        })
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(),t))
+        spiral = spiral_cell(ly, (LayerSiN, LayerPinRecN, LayerDevRecN), length=10, wg_width=0.5,
+            min_radius=5, wg_spacing=4, spiral_ports=1)
+        self.cell.insert(pya.CellInstArray(spiral.cell_index(), t))
 
         # Horizontal waveguide to match central position of the spiral with connecting arc
+        trace("Horizontal waveguide to the spiral")
 
-        wg = pya.Box(
+        wg = grid.box(
             x0 - MMI_L/2 - tap_l, y0 - MMI_w/2 - yb_w + 3*w/2,
             x0 - MMI_L/2 - tap_l + Spiral_Dx, y0 - MMI_w/2 - yb_w + 5*w/2
         )
         shapes(LayerSiN).insert(wg)
 
         # Connecting arc between input y-branch and spiral
+        trace("Connecting arc between input y-branch and spiral")
 
-        Dy = 45.0/dbu
+        Dy = to_itype(45.0, dbu)
         Dx = 2*tap_l + MMI_L - Spiral_Dx
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
 
-        arcS1 = pya.Polygon(arc_wg_xy(
+        arcS1 = pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -1209,13 +1743,14 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
         shapes(LayerSiN).insert(arcS1)
 
         # Connecting waveguides between spiral and output y-branch
-        Dy = 49.5/dbu
+        trace("Connecting waveguides between spiral and output y-branch")
+        Dy = to_itype(49.5, dbu)
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
         coupler_l = MMI_L + 2*tap_l
         if Dy > Dx:
 
-            arcS2 = pya.Polygon(arc_wg_xy(
+            arcS2 = pya.Polygon(grid.arc(
                     x1 + Spiral_Dx,
                     y1,
                     Dy/2,
@@ -1223,9 +1758,9 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
                     -90, 0
             ))
             shapes(LayerSiN).insert(arcS2)
-            Dx1 = 33.75/dbu - Spiral_Dx
+            Dx1 = to_itype(33.75, dbu) - Spiral_Dx
             Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-            arcS3 = pya.Polygon(arc_wg_xy(
+            arcS3 = pya.Polygon(grid.arc(
                     x1 + coupler_l,
                     y1 + Dy/2 - Dx2,
                     Dx2,
@@ -1234,22 +1769,22 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
             ))
 
             shapes(LayerSiN).insert(arcS3)
-            wg = pya.Box(
+            wg = grid.box(
             x1 + 2*Spiral_Dx + Dx1 - 3*w/2, y1 + Dy/2 - Dx2,
             x1 + 2*Spiral_Dx + Dx1 - w/2, y1
             )
             shapes(LayerSiN).insert(wg)
 
-            vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + 4.75/dbu, y1 + Dy - Dx2 - w_mh)
-            Dy = 66.5/dbu
-            Spiral_Dx = 5/dbu
-            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - 4.5/dbu)
+            vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + to_itype(4.75, dbu), y1 + Dy - Dx2 - w_mh)
+            Dy = to_itype(66.5, dbu)
+            Spiral_Dx = to_itype(5, dbu)
+            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - to_itype(4.5, dbu))
             shapes(LayermhN).insert(
-                pya.Box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
+                grid.box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
                     x1 + Spiral_Dx - 2*w_mh, y1 - Dy/2 - w_mh/2
                 ))
             shapes(LayermhN).insert(
-                pya.Polygon(arc_wg_xy(
+                pya.Polygon(grid.arc(
                     x1 + Spiral_Dx,
                     y1,
                     Dy/2,
@@ -1258,28 +1793,28 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
                 ))
             )
 
-            Dx1 = 33.75/dbu - Spiral_Dx
+            Dx1 = to_itype(33.75, dbu) - Spiral_Dx
             Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-            Dy = 33.25/dbu
-            shapes(LayermhN).insert(pya.Box(
+            Dy = to_itype(33.25, dbu)
+            shapes(LayermhN).insert(grid.box(
                 x1 + 2*Spiral_Dx + Dx1 - w - w_mh/2, y1 + Dy - Dx2,
                 x1 + 2*Spiral_Dx + Dx1 - w + w_mh/2, y1
             ))
 
         if Dx >= Dy:
             wg_l = Dx - Dy
-            shapes(LayerSiN).insert(pya.Box(
+            shapes(LayerSiN).insert(grid.box(
                 x1 + Spiral_Dx, y1 - Dy/2 -w/2,
                 x1 + Spiral_Dx + wg_l, y1 - Dy/2 + w/2
             ))
-            shapes(LayerSiN).insert(pya.Polygon(arc_wg_xy(
+            shapes(LayerSiN).insert(pya.Polygon(grid.arc(
                     x1 + Spiral_Dx + wg_l,
                     y1,
                     Dy/2,
                     w,
                     -90, 0
             )))
-            arcS3 = pya.Polygon(arc_wg_xy(
+            arcS3 = pya.Polygon(grid.arc(
                     x1 + coupler_l,
                     y1,
                     Dy/2,
@@ -1290,12 +1825,12 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
 
 
             shapes(LayermhN).insert(
-                pya.Box(x1 + Spiral_Dx + wg_l, y1 - Dy/2 + w_mh/2,
+                grid.box(x1 + Spiral_Dx + wg_l, y1 - Dy/2 + w_mh/2,
                     x1 + Spiral_Dx - 2*w_mh, y1 - Dy/2 - w_mh/2
                 ))
-            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - 4.5/dbu)
+            vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - to_itype(4.5, dbu))
             shapes(LayermhN).insert(
-                pya.Polygon(arc_wg_xy(
+                pya.Polygon(grid.arc(
                     x1 + Spiral_Dx + wg_l,
                     y1,
                     Dy/2,
@@ -1304,52 +1839,66 @@ class MZI_isolated_sSpiral(pya.PCellDeclarationHelper):
                 ))
             )
 
-            shapes(LayermhN).insert(pya.Box(
+            shapes(LayermhN).insert(grid.box(
                 x1 + Spiral_Dx + wg_l + Dy/2 - w_mh/2, y1,
                 x1 + Spiral_Dx + wg_l + Dy/2 + w_mh/2, y1 + 2*w_mh
             ))
-            vias(x1 + Spiral_Dx + wg_l + Dy/2 + 4.5/dbu, y1 + w_mh)
+            vias(x1 + Spiral_Dx + wg_l + Dy/2 + to_itype(4.5, dbu), y1 + w_mh)
 
 
 
         # Create the pins, as short paths:
+        trace("Pins")
         from SiEPIC._globals import PIN_LENGTH as pin_length
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(x_start + pin_length/2, y0 - yb_w/2 - w/2),
-            pya.Point(x_start - pin_length/2, y0 - yb_w/2 - w/2)
+        shapes(LayerPinRecN).insert(grid.path([
+            (x_start + pin_length/2, y0 - yb_w/2 - w/2),
+            (x_start - pin_length/2, y0 - yb_w/2 - w/2)
             ], w
         ))
 
-        shapes(LayerPinRecN).insert(pya.Text("opt1", pya.Trans(pya.Trans.R0,
+        shapes(LayerPinRecN).insert(pya.Text("opt1", grid.trans(pya.Trans.R0,
             x_start, y0 - yb_w/2 - w/2))).text_size = 0.5 / dbu
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+        shapes(LayerPinRecN).insert(grid.path([
+            (
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             ),
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+            (
+                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             )],
         w))
         shapes(LayerSiN).insert(
-            pya.Box(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.15/dbu, y0 - yb_w/2,
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - 0.05/dbu, y0 - yb_w/2 - w
+            grid.box(
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.15, dbu), y0 - yb_w/2,
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - to_itype(0.05, dbu), y0 - yb_w/2 - w
             )
         )
 
-        shapes(LayerPinRecN).insert(pya.Text("opt2", pya.Trans(
+        shapes(LayerPinRecN).insert(pya.Text("opt2", grid.trans(
             pya.Trans.R0,
                 x_end, y0 - yb_w/2 - w/2
             ))).text_size = 0.5 / dbu
+        ports = {
+            "opt1": (x_start, y0 - yb_w/2 - w/2, 180, w),
+            "opt2": (x_end, y0 - yb_w/2 - w/2, 0, w),
+        }
+        ports.update(via_ports(self.cell, via))
+        port_table(self.cell, dbu, ports, grid)
+        device_info(self)
 
         # Create the device recognition layer
-        shapes(LayerDevRecN).insert(pya.Box(
+        trace("DevRec")
+        shapes(LayerDevRecN).insert(grid.box(
             x_start, y0 + w/2,
             x_end, y0 - MMI_w/2 - yb_w - w - Dy - 2*w_mh
         ))
 
+        trace("Merge")
+        shapes.flush()
+        trace.done()
+
+
 class MZI_isolated(pya.PCellDeclarationHelper):
     """
     The PCell declaration for thermally tunable ring filter.
@@ -1382,17 +1931,16 @@ class MZI_isolated(pya.PCellDeclarationHelper):
     def can_create_from_shape_impl(self):
         return False
 
+    @disk_cached
     def produce_impl(self):
         # This is the main part of the implementation: create the layout
         from math import pi, cos, sin
         from SiEPIC.extend import to_itype
-        from SiEPIC.utils import arc_wg_xy
 
         # fetch the parameters
     #    TECHNOLOGY = get_technology_by_name('GSiP')
         dbu = self.layout.dbu
         ly = self.layout
-        shapes = self.cell.shapes
 
         LayerSi = self.silayer
         LayerSi3 = ly.layer(self.si3layer)
@@ -1404,6 +1952,10 @@ class MZI_isolated(pya.PCellDeclarationHelper):
         LayerPinRecN = ly.layer(self.pinrec)
         LayerDevRecN = ly.layer(self.devrec)
 
+        # Silicon and heater polygons are collected and inserted merged by flush()
+        shapes = ShapeBatch(self.cell, (LayerSiN, LayermhN))
+        trace = PROFILER.trace(self, shapes)
+
         # Define variables for the Modulator
         # Variables for the Si waveguide
         w = to_itype(self.w, dbu)
@@ -1411,105 +1963,96 @@ class MZI_isolated(pya.PCellDeclarationHelper):
         # Variables for the MH layer
         w_mh = to_itype(self.w_mh, dbu)
 
-        # Define Ring centre
-        x0 = w / 2
+        # Define Ring centre, the integer anchor of the device grid
+        x0 = snap_coord(w/2)
         y0 = w
+        grid = Grid(x0, y0)
 
-        MMI_L = self.MMI_L/dbu
-        MMI_w = self.MMI_w/dbu
-        yb_l = 15/dbu
-        yb_w = 6/dbu
-        tap_w = 0.8 / dbu
-        tap_ls = self.tap_ls/dbu
+        MMI_L = to_itype(self.MMI_L, dbu)
+        MMI_w = to_itype(self.MMI_w, dbu)
+        yb_l = to_itype(15, dbu)
+        yb_w = to_itype(6, dbu)
+        tap_w = to_itype(0.8, dbu)
+        tap_ls = to_itype(self.tap_ls, dbu)
 
-        if tap_ls >= 14/dbu:
+        if tap_ls >= to_itype(14, dbu):
             tap_l = tap_ls
         else:
-            tap_l = 14/dbu
+            tap_l = to_itype(14, dbu)
+
+        Spiral_Dx = to_itype(5, dbu)
 
-        Spiral_Dx = 5/dbu
+        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - to_itype(36.5, dbu)
+        x_end = x0 + MMI_L/2 + tap_l + yb_l + to_itype(0.2, dbu)
 
-        x_start = x0 - MMI_L/2 - tap_l + Spiral_Dx - 36.5/dbu
-        x_end = x0 + MMI_L/2 + tap_l + yb_l + 0.2/dbu
+        via = via_stack_cell(ly, LayervlN, LayermhN, LayermlN, LayerPinRecN)
 
         def vias(x_v, y_v):
-            sq_s = 3.0/2
-            sq_L = 6.0/2
-            boxVL3 = pya.Box(x_v - sq_s / dbu, y_v - sq_s / dbu,
-                    x_v + sq_s / dbu, y_v + sq_s / dbu)
-            boxMH1 = pya.Box(x_v - sq_L / dbu, y_v - sq_L / dbu,
-                x_v + sq_L / dbu, y_v + sq_L / dbu)
-            shapes(LayervlN).insert(boxVL3)
-            shapes(LayermhN).insert(boxMH1)
-            shapes(LayermlN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(
-                pya.Text("elec2h2", pya.Trans(pya.Trans.R0, x_v, y_v))
-            ).text_size = 0.5 / dbu
+            self.cell.insert(pya.CellInstArray(via.cell_index(),
+                grid.trans(pya.Trans.R0, x_v, y_v)))
 
         # short MZI Branch
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l, y0 - MMI_w/2 + 3*w/2,
             x0 + MMI_L/2 + tap_l, y0 - MMI_w/2 + w/2
         ))
 
         # Y-Branches
+        trace("Y-Branches")
 
-        t = pya.Trans(pya.Trans.R180,
+        t = grid.trans(pya.Trans.R180,
                     x0 + MMI_L/2 + tap_l + yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
-        t = pya.Trans(pya.Trans.R0,
+        t = grid.trans(pya.Trans.R0,
                     x0 - MMI_L/2 - tap_l - yb_l,
                     y0 - yb_w/2 - w/2
         )
-        pcell = ly.create_cell("amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(), t))
+        ybranch = LIBRARY_CELLS.cell_index(ly, "amf_YBranch_TE_1550", "SiEPIC_AMF_Library")
+        self.cell.insert(pya.CellInstArray(ybranch, t))
 
         # Input waveguide
+        trace("Input waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l - yb_l, y0 - yb_w/2,
             x_start, y0 - yb_w/2 - w
         ))
 
         # Spiral
+        trace("Spiral")
 
-        Dy = 30/dbu
-        t = pya.Trans(pya.Trans.R90,
+        Dy = to_itype(30, dbu)
+        t = grid.trans(pya.Trans.R90,
             x0 - MMI_L/2 - tap_l + Spiral_Dx,
             y0 - MMI_w/2 - yb_w - Dy,
         )
-        pcell = ly.create_cell("Spiral", "EBeam-dev",{
-            "length": 200,
-            "wg_width": 0.5,
-            "min_radius": 5,
-            "wg_spacing": 8,
-            "spiral_ports": 1,
-            "layer": LayerSi
-        })
-        self.cell.insert(pya.CellInstArray(pcell.cell_index(),t))
+        spiral = spiral_cell(ly, (LayerSiN, LayerPinRecN, LayerDevRecN), length=200, wg_width=0.5,
+            min_radius=5, wg_spacing=8, spiral_ports=1)
+        self.cell.insert(pya.CellInstArray(spiral.cell_index(), t))
 
         # Horizontal waveguide to match central position of the spiral with connecting arc
+        trace("Horizontal waveguide to the spiral")
 
-        wg = pya.Box(
+        wg = grid.box(
         x0 - MMI_L/2 - tap_l, y0 - MMI_w/2 - yb_w + 3*w/2,
         x0 - MMI_L/2 - tap_l + Spiral_Dx, y0 - MMI_w/2 - yb_w + 5*w/2
         )
         shapes(LayerSiN).insert(wg)
 
         # Connecting arc between input y-branch and spiral
+        trace("Connecting arc between input y-branch and spiral")
 
-        Dy = 58/dbu
+        Dy = to_itype(58, dbu)
         #
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
 
-        arcS1 = pya.Polygon(arc_wg_xy(
+        arcS1 = pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -1519,11 +2062,12 @@ class MZI_isolated(pya.PCellDeclarationHelper):
         shapes(LayerSiN).insert(arcS1)
 
         # Connecting waveguides between spiral and output y-branch
+        trace("Connecting waveguides between spiral and output y-branch")
 
-        Dy = 66.5/dbu
+        Dy = to_itype(66.5, dbu)
         x1 = x0 - MMI_L/2 - tap_l
         y1 = y0 - MMI_w/2 - yb_w - Dy/2 + 2*w
-        arcS2 = pya.Polygon(arc_wg_xy(
+        arcS2 = pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -1531,11 +2075,11 @@ class MZI_isolated(pya.PCellDeclarationHelper):
                 -90, 0
         ))
         shapes(LayerSiN).insert(arcS2)
-        Dx1 = (32.9 + 0.85 - Spiral_Dx*dbu)/dbu
-        Dy = 33.25/dbu
+        Dx1 = to_itype(32.9 + 0.85, dbu) - Spiral_Dx
+        Dy = to_itype(33.25, dbu)
         coupler_l = MMI_L + 2*tap_l
         Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-        arcS3 = pya.Polygon(arc_wg_xy(
+        arcS3 = pya.Polygon(grid.arc(
                 x1 + coupler_l,
                 y1 + Dy - Dx2,
                 Dx2,
@@ -1544,24 +2088,25 @@ class MZI_isolated(pya.PCellDeclarationHelper):
         ))
 
         shapes(LayerSiN).insert(arcS3)
-        wg = pya.Box(
+        wg = grid.box(
         x1 + 2*Spiral_Dx + Dx1 - 3*w/2, y1 + Dy - Dx2,
         x1 + 2*Spiral_Dx + Dx1 - w/2, y1
         )
         shapes(LayerSiN).insert(wg)
 
         # MZI phase tuning heater
+        trace("MZI phase tuning heater")
 
-        vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + 4.75/dbu, y1 + Dy - Dx2 - w_mh)
-        Dy = 66.5/dbu
-        Spiral_Dx = 5/dbu
-        vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - 4.5/dbu)
+        vias(x1 + 2*Spiral_Dx + Dx1 - 3*w/2 + to_itype(4.75, dbu), y1 + Dy - Dx2 - w_mh)
+        Dy = to_itype(66.5, dbu)
+        Spiral_Dx = to_itype(5, dbu)
+        vias(x1 + Spiral_Dx - w_mh, y1 - Dy/2 - to_itype(4.5, dbu))
         shapes(LayermhN).insert(
-            pya.Box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
+            grid.box(x1 + Spiral_Dx, y1 - Dy/2 + w_mh/2,
                 x1 + Spiral_Dx - 2*w_mh, y1 - Dy/2 - w_mh/2
             ))
         shapes(LayermhN).insert(
-            pya.Polygon(arc_wg_xy(
+            pya.Polygon(grid.arc(
                 x1 + Spiral_Dx,
                 y1,
                 Dy/2,
@@ -1570,52 +2115,66 @@ class MZI_isolated(pya.PCellDeclarationHelper):
             ))
         )
 
-        Dx1 = 33.75/dbu - Spiral_Dx
+        Dx1 = to_itype(33.75, dbu) - Spiral_Dx
         Dx2 = coupler_l - Dx1 - 2*Spiral_Dx + w
-        Dy = 33.25/dbu
-        shapes(LayermhN).insert(pya.Box(
+        Dy = to_itype(33.25, dbu)
+        shapes(LayermhN).insert(grid.box(
             x1 + 2*Spiral_Dx + Dx1 - w - w_mh/2, y1 + Dy - Dx2,
             x1 + 2*Spiral_Dx + Dx1 - w + w_mh/2, y1
         ))
 
         # Create the pins, as short paths:
+        trace("Pins")
         from SiEPIC._globals import PIN_LENGTH as pin_length
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(x_start + pin_length/2, y0 - yb_w/2 - w/2),
-            pya.Point(x_start - pin_length/2, y0 - yb_w/2 - w/2)
+        shapes(LayerPinRecN).insert(grid.path([
+            (x_start + pin_length/2, y0 - yb_w/2 - w/2),
+            (x_start - pin_length/2, y0 - yb_w/2 - w/2)
             ], w
         ))
 
-        shapes(LayerPinRecN).insert(pya.Text("opt1", pya.Trans(pya.Trans.R0,
+        shapes(LayerPinRecN).insert(pya.Text("opt1", grid.trans(pya.Trans.R0,
             x_start, y0 - yb_w/2 - w/2))).text_size = 0.5 / dbu
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+        shapes(LayerPinRecN).insert(grid.path([
+            (
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             ),
-            pya.Point(
-                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + 0.2/dbu, y0 - yb_w/2 - w/2
+            (
+                x0 + MMI_L/2 + tap_l + yb_l - pin_length / 2 + to_itype(0.2, dbu), y0 - yb_w/2 - w/2
             )],
         w))
         shapes(LayerSiN).insert(
-            pya.Box(
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + 0.15/dbu, y0 - yb_w/2,
-                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - 0.05/dbu, y0 - yb_w/2 - w
+            grid.box(
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 + to_itype(0.15, dbu), y0 - yb_w/2,
+                x0 + MMI_L/2 + tap_l + yb_l + pin_length / 2 - to_itype(0.05, dbu), y0 - yb_w/2 - w
             )
         )
 
-        shapes(LayerPinRecN).insert(pya.Text("opt2", pya.Trans(
+        shapes(LayerPinRecN).insert(pya.Text("opt2", grid.trans(
             pya.Trans.R0,
                 x_end, y0 - yb_w/2 - w/2
             ))).text_size = 0.5 / dbu
+        ports = {
+            "opt1": (x_start, y0 - yb_w/2 - w/2, 180, w),
+            "opt2": (x_end, y0 - yb_w/2 - w/2, 0, w),
+        }
+        ports.update(via_ports(self.cell, via))
+        port_table(self.cell, dbu, ports, grid)
+        device_info(self)
 
         # Create the device recognition layer
-        shapes(LayerDevRecN).insert(pya.Box(
+        trace("DevRec")
+        shapes(LayerDevRecN).insert(grid.box(
             x_start, y0 + w/2,
             x_end, y0 - MMI_w/2 - yb_w - w - 2*Dy - 2*w_mh
         ))
 
+        trace("Merge")
+        shapes.flush()
+        trace.done()
+
+
 class DbRR_Isolated(pya.PCellDeclarationHelper):
     """
     The PCell declaration for thermally tunable ring filter.
@@ -1650,6 +2209,7 @@ class DbRR_Isolated(pya.PCellDeclarationHelper):
     def can_create_from_shape_impl(self):
         return False
 
+    @disk_cached
     def produce_impl(self):
         # This is the main part of the implementation: create the layout
         from math import pi, cos, sin
@@ -1659,7 +2219,6 @@ class DbRR_Isolated(pya.PCellDeclarationHelper):
     #    TECHNOLOGY = get_technology_by_name('GSiP')
         dbu = self.layout.dbu
         ly = self.layout
-        shapes = self.cell.shapes
 
         LayerSi = self.silayer
         LayerSi3 = ly.layer(self.si3layer)
@@ -1671,6 +2230,10 @@ class DbRR_Isolated(pya.PCellDeclarationHelper):
         LayerPinRecN = ly.layer(self.pinrec)
         LayerDevRecN = ly.layer(self.devrec)
 
+        # Silicon and heater polygons are collected and inserted merged by flush()
+        shapes = ShapeBatch(self.cell, (LayerSiN, LayermhN))
+        trace = PROFILER.trace(self, shapes)
+
         # Define variables for the Modulator
         # Variables for the Si waveguide
         w = to_itype(self.w, dbu)
@@ -1678,301 +2241,103 @@ class DbRR_Isolated(pya.PCellDeclarationHelper):
 
         # Variables for the MH layer
         w_mh = to_itype(self.w_mh, dbu)
-        w_mh_min = 2.0/dbu
+        w_mh_min = to_itype(2.0, dbu)
 
-        # Define Ring centre
-        x0 = r + w / 2
+        # Define Ring centre, the integer anchor of the device grid
+        x0 = snap_coord(r + w/2)
         y0 = r + w
+        grid = Grid(x0, y0)
 
-        MMI_L = self.MMI_L/dbu
-        MMI_w = self.MMI_w/dbu
-        yb_l = 15/dbu
-        yb_w = 6/dbu
-        tap_w = 0.8 / dbu
-        tap_ls = self.tap_ls/dbu
+        MMI_L = to_itype(self.MMI_L, dbu)
+        MMI_w = to_itype(self.MMI_w, dbu)
+        yb_l = to_itype(15, dbu)
+        yb_w = to_itype(6, dbu)
+        tap_w = to_itype(0.8, dbu)
+        tap_ls = to_itype(self.tap_ls, dbu)
 
-        if tap_ls >= 14/dbu:
+        if tap_ls >= to_itype(14, dbu):
             tap_l = tap_ls
         else:
-            tap_l = 14/dbu
+            tap_l = to_itype(14, dbu)
 
-        Spiral_Dx = 5/dbu
+        Spiral_Dx = to_itype(5, dbu)
 
-        x_start = x0 - MMI_L/2 - tap_l - 5.5/dbu
-        x_end = x0 + MMI_L/2 + tap_l + 5.5/dbu
-
-        def vias(x_v, y_v):
-            sq_s = 3.0/2
-            sq_L = 6.0/2
-            boxVL3 = pya.Box(x_v - sq_s / dbu, y_v - sq_s / dbu,
-                    x_v + sq_s / dbu, y_v + sq_s / dbu)
-            boxMH1 = pya.Box(x_v - sq_L / dbu, y_v - sq_L / dbu,
-                x_v + sq_L / dbu, y_v + sq_L / dbu)
-            shapes(LayervlN).insert(boxVL3)
-            shapes(LayermhN).insert(boxMH1)
-            shapes(LayermlN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(
-                pya.Text("elec2h2", pya.Trans(pya.Trans.R0, x_v, y_v))
-            ).text_size = 0.5 / dbu
+        x_start = x0 - MMI_L/2 - tap_l - to_itype(5.5, dbu)
+        x_end = x0 + MMI_L/2 + tap_l + to_itype(5.5, dbu)
 
         #####################
         # Generate the layout:
-        # MMI 1
+        # Double MMI ring block with its heaters, vias and ground lines, shared
+        # by every device with the same ring
+        trace("Ring block")
 
-
-        mmi = pya.Box(x0 - MMI_L/2, y0 + MMI_w / 2,
-                      x0 + MMI_L/2, y0 - MMI_w / 2)
-        shapes(LayerSiN).insert(mmi)
-
-
-
-        # Tapers for MMI 1
-
-        taperTL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 - w/2),
-        ])
-        taperTR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 - w/2),
-        ])
-        shapes(LayerSiN).insert(taperTL)
-        shapes(LayerSiN).insert(taperBL)
-        shapes(LayerSiN).insert(taperTR)
-        shapes(LayerSiN).insert(taperBR)
+        MMI_L2 = to_itype(self.MMI_L2, dbu)
+        place_ring_block(self.cell, shapes, (LayerSiN, LayervlN, LayermlN, LayermhN, LayerPinRecN),
+                RingDims(MMI_L, MMI_L2, MMI_w, tap_ls, tap_l, tap_w, w, r, w_mh, dbu), x0, y0)
+        via = via_stack_cell(ly, LayervlN, LayermhN, LayermlN, LayerPinRecN)
 
         # Input waveguide
+        trace("Input waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 + w/2,
             x_start, y0 - MMI_w/4 - w/2
         ))
 
         # Output waveguide
+        trace("Output waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 + w/2,
             x_end, y0 - MMI_w/4 - w/2
         ))
 
-        from SiEPIC.utils import arc_wg_xy
-        # def arc_wg_xy(x, y, r, w, theta_start, theta_stop, DevRec=None):
-
-        # Connecting arcs - MMI 1 to MMI 2
-
-        arcR = pya.Polygon(arc_wg_xy(
-                x0 + MMI_L/2 + tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                -90, 90
-        ))
-        arcL = pya.Polygon(arc_wg_xy(
-                x0 - MMI_L/2 - tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                90, -90
-        ))
-        shapes(LayerSiN).insert(arcR)
-        shapes(LayerSiN).insert(arcL)
-
-        # MMI 2, tapers and ring
-
-        x1 = x0
-        y1 = y0 + MMI_w/2 + 2*self.r/dbu
-
-        MMI_L2 = to_itype(self.MMI_L2, dbu)
-
-        mmi2 = pya.Box(x1 - MMI_L2/2, y1 + MMI_w / 2,
-                      x1 + MMI_L2/2, y1 - MMI_w / 2)
-        shapes(LayerSiN).insert(mmi2)
-
-        taperTL2 = pya.Polygon([
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/4 + w/2),
-                pya.Point(x1 - MMI_L2/2, y1 + MMI_w/4 + tap_w/2),
-                pya.Point(x1 - MMI_L2/2, y1 + MMI_w/4 - tap_w/2),
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/4 - w/2),
-        ])
-        taperBL2 = pya.Polygon([
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 - MMI_w/4 + w/2),
-                pya.Point(x1 - MMI_L2/2, y1 - MMI_w/4 + tap_w/2),
-                pya.Point(x1 - MMI_L2/2, y1 - MMI_w/4 - tap_w/2),
-                pya.Point(x1 - MMI_L/2 - tap_ls, y1 - MMI_w/4 - w/2),
-        ])
-        taperTR2 = pya.Polygon([
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 + MMI_w/4 + w/2),
-                pya.Point(x1 + MMI_L2/2, y1 + MMI_w/4 + tap_w/2),
-                pya.Point(x1 + MMI_L2/2, y1 + MMI_w/4 - tap_w/2),
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 + MMI_w/4 - w/2),
-        ])
-        taperBR2 = pya.Polygon([
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 - MMI_w/4 + w/2),
-                pya.Point(x1 + MMI_L2/2, y1 - MMI_w/4 + tap_w/2),
-                pya.Point(x1 + MMI_L2/2, y1 - MMI_w/4 - tap_w/2),
-                pya.Point(x1 + MMI_L/2 + tap_ls, y1 - MMI_w/4 - w/2),
-        ])
-
-        shapes(LayerSiN).insert(taperTL2)
-        shapes(LayerSiN).insert(taperBL2)
-        shapes(LayerSiN).insert(taperTR2)
-        shapes(LayerSiN).insert(taperBR2)
-
-        arcR2 = pya.Polygon(arc_wg_xy(
-                x1 + MMI_L/2 + tap_ls ,
-                y1 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                -90, 90
-        ))
-        arcL2 = pya.Polygon(arc_wg_xy(
-                x1 - MMI_L/2 - tap_ls ,
-                y1 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
-                90, -90
-        ))
-        shapes(LayerSiN).insert(arcR2)
-        shapes(LayerSiN).insert(arcL2)
-
-        wg_T = pya.Box(x1 - MMI_L/2 - tap_ls, y1 + MMI_w/2 + 2*self.r/dbu - self.w/2/dbu,
-                      x1 + MMI_L/2 + tap_ls, y1 + MMI_w/2 + 2*self.r/dbu - 3*self.w/2/dbu
-        )
-        shapes(LayerSiN).insert(wg_T)
-
-        # Heater arcs
-
-        arcR = pya.Polygon(arc_wg_xy(
-                x0 + MMI_L/2 + tap_ls + w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                -90, 90
-        ))
-        arcL = pya.Polygon(arc_wg_xy(
-                x0 - MMI_L/2 - tap_ls - w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                90, -90
-        ))
-        shapes(LayermhN).insert(arcR)
-        shapes(LayermhN).insert(arcL)
-        arcR2 = pya.Polygon(arc_wg_xy(
-                x1 + MMI_L/2 + tap_ls + w_mh/2,
-                y1 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                -90, 90
-        ))
-        arcL2 = pya.Polygon(arc_wg_xy(
-                x1 - MMI_L/2 - tap_ls - w_mh/2,
-                y1 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
-                90, -90
-        ))
-        shapes(LayermhN).insert(arcR2)
-        shapes(LayermhN).insert(arcL2)
-
-        # Connecting heater metal between arcs
-
-        shapes(LayermhN).insert(pya.Box(
-            x0 - MMI_L/2 - tap_ls - w_mh_min,
-            y0 + 2*self.r/dbu + MMI_w/4 - 2.5/dbu,
-            x0 - MMI_L/2 - tap_ls - 0/dbu,
-            y0 + 2*self.r/dbu + MMI_w/4 + 3.5/dbu,
-        ))
-        shapes(LayermhN).insert(pya.Box(
-            x0 + MMI_L/2 + tap_ls + w_mh_min,
-            y0 + 2*self.r/dbu + MMI_w/4 - 2.5/dbu,
-            x0 + MMI_L/2 + tap_ls - 0/dbu,
-            y0 + 2*self.r/dbu + MMI_w/4 + 3.5/dbu,
-        ))
-
-        # Vias for arc arc heaters connection
-
-        vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 - w)
-        vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 - w)
-
-        # Common ground for arc heater
-
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0)], 4/dbu
-        ))
-
-        # MMI 2 heater
-
-        shapes(LayermhN).insert(
-            pya.Box(
-                x0 - MMI_L/2, y0 + MMI_w/2 + 2*r + w_mh/2,
-                x0 + MMI_L/2, y0 + MMI_w/2 + 2*r - w_mh/2
-            )
-        )
-        # Vias for MMI 2 heater
-
-        vias(x0 - MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
-        vias(x0 + MMI_L/2, y0 + 2*r + MMI_w/2 + w_mh/2 + w_mh)
-
-
-        vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 - w + 4*r + 4*w)
-        vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 - w + 4*r + 4*w)
-
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0 + 4*r + 6*w),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0 + 4*r + 6*w)], 4/dbu
-        ))
-
         # Create the pins, as short paths:
+        trace("Pins")
         from SiEPIC._globals import PIN_LENGTH as pin_length
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(x_start + pin_length/2, y0 - w),
-            pya.Point(x_start - pin_length/2, y0 - w)
+        shapes(LayerPinRecN).insert(grid.path([
+            (x_start + pin_length/2, y0 - w),
+            (x_start - pin_length/2, y0 - w)
             ], w
         ))
 
-        shapes(LayerPinRecN).insert(pya.Text("opt1", pya.Trans(pya.Trans.R0,
+        shapes(LayerPinRecN).insert(pya.Text("opt1", grid.trans(pya.Trans.R0,
             x_start, y0 - w))).text_size = 0.5 / dbu
 
-        shapes(LayerPinRecN).insert(pya.Path([
-            pya.Point(
+        shapes(LayerPinRecN).insert(grid.path([
+            (
                 x_end - pin_length/2, y0 - w
             ),
-            pya.Point(
+            (
                 x_end + pin_length/2, y0 - w
             )],
         w))
 
-        shapes(LayerPinRecN).insert(pya.Text("opt2", pya.Trans(
+        shapes(LayerPinRecN).insert(pya.Text("opt2", grid.trans(
             pya.Trans.R0,
                 x_end, y0 - w
             ))).text_size = 0.5 / dbu
+        ports = {
+            "opt1": (x_start, y0 - w, 180, w),
+            "opt2": (x_end, y0 - w, 0, w),
+        }
+        ports.update(via_ports(self.cell, via))
+        port_table(self.cell, dbu, ports, grid)
+        device_info(self)
 
         # Create the device recognition layer
-        shapes(LayerDevRecN).insert(pya.Box(
+        trace("DevRec")
+        shapes(LayerDevRecN).insert(grid.box(
             x_start, y0 + 4*r + 2*MMI_w + 2*w,
             x_end, y0 - MMI_w/2 - w - 2*w_mh
         ))
 
+        trace("Merge")
+        shapes.flush()
+        trace.done()
+
+
 class RR_Isolated(pya.PCellDeclarationHelper):
     """
     The PCell declaration for thermally tunable ring filter.
@@ -2007,6 +2372,7 @@ class RR_Isolated(pya.PCellDeclarationHelper):
     def can_create_from_shape_impl(self):
         return False
 
+    @disk_cached
     def produce_impl(self):
         # This is the main part of the implementation: create the layout
         from math import pi, cos, sin
@@ -2016,7 +2382,6 @@ class RR_Isolated(pya.PCellDeclarationHelper):
     #    TECHNOLOGY = get_technology_by_name('GSiP')
         dbu = self.layout.dbu
         ly = self.layout
-        shapes = self.cell.shapes
 
         LayerSi = self.silayer
         LayerSi3 = ly.layer(self.si3layer)
@@ -2028,6 +2393,10 @@ class RR_Isolated(pya.PCellDeclarationHelper):
         LayerPinRecN = ly.layer(self.pinrec)
         LayerDevRecN = ly.layer(self.devrec)
 
+        # Silicon and heater polygons are collected and inserted merged by flush()
+        shapes = ShapeBatch(self.cell, (LayerSiN, LayermhN))
+        trace = PROFILER.trace(self, shapes)
+
         # Define variables for the Modulator
         # Variables for the Si waveguide
         w = to_itype(self.w, dbu)
@@ -2036,165 +2405,161 @@ class RR_Isolated(pya.PCellDeclarationHelper):
         # Variables for the MH layer
         w_mh = to_itype(self.w_mh, dbu)
 
-        # Define Ring centre
-        x0 = r + w / 2
+        # Define Ring centre, the integer anchor of the device grid
+        x0 = snap_coord(r + w/2)
         y0 = r + w
+        grid = Grid(x0, y0)
 
-        MMI_L = self.MMI_L/dbu
-        MMI_w = self.MMI_w/dbu
-        yb_l = 15/dbu
-        yb_w = 6/dbu
-        tap_w = 0.8 / dbu
-        tap_ls = self.tap_ls/dbu
+        MMI_L = to_itype(self.MMI_L, dbu)
+        MMI_w = to_itype(self.MMI_w, dbu)
+        yb_l = to_itype(15, dbu)
+        yb_w = to_itype(6, dbu)
+        tap_w = to_itype(0.8, dbu)
+        tap_ls = to_itype(self.tap_ls, dbu)
 
-        if tap_ls >= 14/dbu:
+        if tap_ls >= to_itype(14, dbu):
             tap_l = tap_ls
         else:
-            tap_l = 14/dbu
+            tap_l = to_itype(14, dbu)
+
+        Spiral_Dx = to_itype(5, dbu)
 
-        Spiral_Dx = 5/dbu
+        x_start = x0 - MMI_L/2 - tap_l - to_itype(5.5, dbu)
+        x_end = x0 + MMI_L/2 + tap_l + to_itype(5.5, dbu)
 
-        x_start = x0 - MMI_L/2 - tap_l - 5.5/dbu
-        x_end = x0 + MMI_L/2 + tap_l + 5.5/dbu
+        via = via_stack_cell(ly, LayervlN, LayermhN, LayermlN, LayerPinRecN)
 
         def vias(x_v, y_v):
-            sq_s = 3.0/2
-            sq_L = 6.0/2
-            boxVL3 = pya.Box(x_v - sq_s / dbu, y_v - sq_s / dbu,
-                    x_v + sq_s / dbu, y_v + sq_s / dbu)
-            boxMH1 = pya.Box(x_v - sq_L / dbu, y_v - sq_L / dbu,
-                x_v + sq_L / dbu, y_v + sq_L / dbu)
-            shapes(LayervlN).insert(boxVL3)
-            shapes(LayermhN).insert(boxMH1)
-            shapes(LayermlN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(boxMH1)
-            shapes(LayerPinRecN).insert(
-                pya.Text("elec2h2", pya.Trans(pya.Trans.R0, x_v, y_v))
-            ).text_size = 0.5 / dbu
+            self.cell.insert(pya.CellInstArray(via.cell_index(),
+                grid.trans(pya.Trans.R0, x_v, y_v)))
 
         #####################
         # Generate the layout:
         # MMI 1
+        trace("MMI 1")
 
 
-        mmi = pya.Box(x0 - MMI_L/2, y0 + MMI_w / 2,
+        mmi = grid.box(x0 - MMI_L/2, y0 + MMI_w / 2,
                       x0 + MMI_L/2, y0 - MMI_w / 2)
         shapes(LayerSiN).insert(mmi)
 
 
 
         # Tapers for MMI 1
+        trace("Tapers for MMI 1")
 
-        taperTL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBL = pya.Polygon([
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 - MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 - w/2),
-        ])
-        taperTR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 + MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 - w/2),
-        ])
-        taperBR = pya.Polygon([
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 + w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 + tap_w/2),
-                pya.Point(x0 + MMI_L/2, y0 - MMI_w/4 - tap_w/2),
-                pya.Point(x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 - w/2),
-        ])
+        left = taper_xy(x0 - MMI_L/2 - np.array([tap_ls, tap_l]), x0 - MMI_L/2,
+                        y0 + np.array([MMI_w/4, -MMI_w/4]), w, tap_w)
+        taperTL, taperBL, taperTR, taperBR = grid.polygons(
+                np.concatenate([left, mirror_x(left, x0)]))
         shapes(LayerSiN).insert(taperTL)
         shapes(LayerSiN).insert(taperBL)
         shapes(LayerSiN).insert(taperTR)
         shapes(LayerSiN).insert(taperBR)
 
         # Input waveguide
+        trace("Input waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_l, y0 - MMI_w/4 + w/2,
             x_start, y0 - MMI_w/4 - w/2
         ))
 
         # Output waveguide
+        trace("Output waveguide")
 
-        shapes(LayerSiN).insert(pya.Box(
+        shapes(LayerSiN).insert(grid.box(
             x0 + MMI_L/2 + tap_l, y0 - MMI_w/4 + w/2,
             x_end, y0 - MMI_w/4 - w/2
         ))
 
         # Ring top waveguide
-        shapes(LayerSiN).insert(pya.Box(
+        trace("Ring top waveguide")
+        shapes(LayerSiN).insert(grid.box(
             x0 - MMI_L/2 - tap_ls, y0 + MMI_w/4 + 2*r + w/2,
             x0 + MMI_L/2 + tap_ls, y0 + MMI_w/4 + 2*r - w/2,
         ))
 
-        from SiEPIC.utils import arc_wg_xy
-        # def arc_wg_xy(x, y, r, w, theta_start, theta_stop, DevRec=None):
+        # def grid.arc(x, y, r, w, theta_start, theta_stop):
 
         # Connecting arcs - MMI 1 to MMI 2
+        trace("Connecting arcs - MMI 1 to MMI 2")
 
-        arcR = pya.Polygon(arc_wg_xy(
+        arcR = pya.Polygon(grid.arc(
                 x0 + MMI_L/2 + tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
+                y0 + r + MMI_w/4,
+                r,
+                w,
                 -90, 90
         ))
-        arcL = pya.Polygon(arc_wg_xy(
+        arcL = pya.Polygon(grid.arc(
                 x0 - MMI_L/2 - tap_ls ,
-                y0 + self.r/dbu + MMI_w/4,
-                self.r / dbu,
-                self.w / dbu,
+                y0 + r + MMI_w/4,
+                r,
+                w,
                 90, -90
         ))
         shapes(LayerSiN).insert(arcR)
         shapes(LayerSiN).insert(arcL)
 
-        arcR = pya.Polygon(arc_wg_xy(
+        arcR = pya.Polygon(grid.arc(
                 x0 + MMI_L/2 + tap_ls + w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
+                y0 + r + MMI_w/4,
+                r - to_itype(1, dbu),
+                to_itype(3, dbu),
                 -90, 90
         ))
-        arcL = pya.Polygon(arc_wg_xy(
+        arcL = pya.Polygon(grid.arc(
                 x0 - MMI_L/2 - tap_ls - w_mh/2,
-                y0 + self.r/dbu + MMI_w/4,
-                (self.r - 1) / dbu,
-                3 / dbu,
+                y0 + r + MMI_w/4,
+                r - to_itype(1, dbu),
+                to_itype(3, dbu),
                 90, -90
         ))
         shapes(LayermhN).insert(arcR)
         shapes(LayermhN).insert(arcL)
 
         # Vias for arc arc heaters connection
+        trace("Vias for arc arc heaters connection")
 
         vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 - w)
         vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 - w)
 
         # Common ground for arc heater
+        trace("Common ground for arc heater")
 
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0)], 4/dbu
+        shapes(LayermlN).insert(grid.path([
+            (x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0),
+            (x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0)], to_itype(4, dbu)
         ))
 
         vias(x0 + MMI_L/2 + tap_ls + w_mh/2 - w_mh, y0 + MMI_w/4 + 2*r)
         vias(x0 - MMI_L/2 - tap_ls - w_mh/2 + w_mh, y0 + MMI_w/4 + 2*r)
 
         # Common ground for arc heater
+        trace("Common ground for arc heater")
 
-        shapes(LayermlN).insert(pya.Path([
-            pya.Point(x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0 + MMI_w/4 + 2*r),
-            pya.Point(x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0 + MMI_w/4 + 2*r)], 4/dbu
+        shapes(LayermlN).insert(grid.path([
+            (x0 + MMI_L/2 + tap_ls + w_mh/2 - 2*w_mh, y0 + MMI_w/4 + 2*r),
+            (x0 - MMI_L/2 - tap_ls - w_mh/2 + 2*w_mh, y0 + MMI_w/4 + 2*r)], to_itype(4, dbu)
         ))
 
+        # Ports at the ends of the input and output waveguides; this device
+        # draws no pins on the PinRec layer
+        trace("Ports")
+        ports = {
+            "opt1": (x_start, y0 - MMI_w/4, 180, w),
+            "opt2": (x_end, y0 - MMI_w/4, 0, w),
+        }
+        ports.update(via_ports(self.cell, via))
+        port_table(self.cell, dbu, ports, grid)
+        device_info(self)
+
+        trace("Merge")
+        shapes.flush()
+        trace.done()
+
+
 
 class Bruno_AMF_Library(pya.Library):
   """
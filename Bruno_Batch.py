@@ -0,0 +1,559 @@
+"""
+Headless batch generation of Bruno PCell variants.
+
+Builds parameter sweeps of the PCells of Bruno_AMF_Library and
+Bruno_EBeam_Library with the standalone klayout python module (no KLayout
+GUI needed) and writes one GDS or OASIS file per sweep:
+
+  python Bruno_Batch.py sweeps.json -o out --import siepic_ebeam_pdk
+
+A sweep spec is a JSON object, or a list of them:
+
+  {
+    "library": "Bruno_AMF_Library",
+    "pcell": "RR_Isolated",
+    "params": {"r": [5, 7.5, 10], "w_mh": [3, 4], "silayer": "10/0"},
+    "output": "rr_sweep.oas",
+    "spacing": 20
+  }
+
+Every list in params is a sweep axis and the variants are the cartesian
+product of all axes; other values are fixed. Layer parameters are given as
+strings ("10/0"). The variants are placed on a grid, spacing microns apart,
+under a top cell named after the sweep ("top", default <pcell>_sweep).
+
+The technologies the libraries use must be registered first, either by
+importing the PDK python module (--import) or from .lyt files (--technology).
+
+With -j N the variants are built by N worker processes, each in a private
+layout, and merged into the sweep layout as plain cells; sub-cells shared by
+the variants (Y-branches, via stacks) are stored once.
+
+With --stream each variant is written to the output as soon as it is built
+and dropped, leaf cells first and the top cell last, by workers that are
+replaced every few dozen variants, so large sweeps run in bounded memory;
+streamed output is GDS2 only.
+
+The port tables and device records the PCells publish ("ports" and "device"
+meta info) are written with the cells, so tools reading the output, like
+Bruno_Netlist.py, find the ports without the libraries.
+
+"""
+
+import argparse
+import hashlib
+import importlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import pya
+
+from Bruno_Ports import PORTS, DEVICE
+
+
+def register_technology(path):
+    """Registers the technology of the .lyt file path."""
+    tech = pya.Technology()
+    tech.load(path)
+    pya.Technology.register_technology(tech)
+    return tech.name
+
+
+def load_library(name):
+    """Imports the library module name, which registers the library, and returns it."""
+    lib = pya.Library.library_by_name(name)
+    if lib is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        if here not in sys.path:
+            sys.path.insert(0, here)
+        importlib.import_module(name)
+        lib = pya.Library.library_by_name(name)
+    if lib is None:
+        raise ValueError("Library %s is not registered by the module %s" % (name, name))
+    return lib
+
+
+def load_specs(path):
+    """List of sweep specs in the JSON file path."""
+    with open(path) as f:
+        specs = json.load(f)
+    if isinstance(specs, dict):
+        specs = specs.get("sweeps", [specs])
+    return specs
+
+
+def convert_param(decl, name, value):
+    """value of the JSON spec converted to the type of the parameter name of decl."""
+    if decl.type == pya.PCellParameterDeclaration.TypeLayer and not isinstance(value, pya.LayerInfo):
+        return pya.LayerInfo.from_string(str(value))
+    if decl.type == pya.PCellParameterDeclaration.TypeShape and isinstance(value, (list, tuple)):
+        return pya.DPoint(*value)
+    return value
+
+
+def grid_points(params):
+    """
+    List of parameter dicts, one per variant: the cartesian product of the
+    list valued entries of params, with the other entries fixed.
+    """
+    names = sorted(params)
+    axes = [params[n] if isinstance(params[n], list) else [params[n]] for n in names]
+    return [dict(zip(names, values)) for values in itertools.product(*axes)]
+
+
+def convert_params(pcell_decl, params):
+    """params of a grid point checked against pcell_decl and converted to its types."""
+    decls = dict((p.name, p) for p in pcell_decl.get_parameters())
+    unknown = sorted(set(params) - set(decls))
+    if unknown:
+        raise ValueError("Unknown parameters of %s: %s" % (pcell_decl.name(), ", ".join(unknown)))
+    return dict((n, convert_param(decls[n], n, v)) for n, v in params.items())
+
+
+def drawn_bbox(ly, cell):
+    """Bounding box of cell over the layout layers, without the PCell guiding shapes."""
+    box = pya.Box()
+    for li in ly.layer_indexes():
+        box += cell.bbox(li)
+    return box
+
+
+def grid_transforms(boxes, spacing, dbu):
+    """Trans of each of the bounding boxes on a square grid, spacing microns between them."""
+    if not boxes:
+        return []
+    columns = int(math.ceil(math.sqrt(len(boxes))))
+    pitch_x = max(b.width() for b in boxes) + int(round(spacing/dbu))
+    pitch_y = max(b.height() for b in boxes) + int(round(spacing/dbu))
+    return [pya.Trans(pya.Trans.R0, (i % columns) * pitch_x - box.left, -(i // columns) * pitch_y - box.top)
+            for i, box in enumerate(boxes)]
+
+
+def place_grid(ly, top, cells, spacing):
+    """Instantiates cells in top on a square grid, spacing microns between bounding boxes."""
+    # Cell.bbox(layer) does not update the layout by itself
+    ly.update()
+    boxes = [drawn_bbox(ly, c) for c in cells]
+    for cell, trans in zip(cells, grid_transforms(boxes, spacing, ly.dbu)):
+        top.insert(pya.CellInstArray(cell.cell_index(), trans))
+
+
+# Descriptions of the LayoutMetaInfo the PCells publish: their port table
+# and device record (see Bruno_Ports.py)
+CELL_META = {PORTS: "Port table", DEVICE: "Device record"}
+
+
+def cell_tables(ly, cell):
+    """
+    {cell name: {meta info name: value}} of the CELL_META tables of cell and
+    its sub-cells. The tables are meta info of the library cells, so library
+    proxies are followed to them.
+    """
+    tables = {}
+    for ci in [cell.cell_index()] + list(cell.called_cells()):
+        src = ly.cell(ci)
+        while src.is_library_cell():
+            src = src.library().layout().cell(src.library_cell_index())
+        values = dict((name, src.meta_info_value(name)) for name in CELL_META)
+        values = dict((name, v) for name, v in values.items() if v is not None)
+        if values:
+            tables[ly.cell(ci).name] = values
+    return tables
+
+
+def set_tables(cell, tables):
+    """Stores the tables of cell_tables on cell, persisted in the files it is written to."""
+    for name, value in (tables or {}).items():
+        cell.add_meta_info(pya.LayoutMetaInfo(name, value, CELL_META[name], True))
+
+
+def init_worker(technologies, modules):
+    """Pool initializer: registers the technologies and imports the modules like main()."""
+    for path in technologies:
+        register_technology(path)
+    for module in modules:
+        importlib.import_module(module)
+
+
+def build_variant(task):
+    """
+    Worker of the process pool and of stream_sweep: builds one variant in a
+    private layout and returns it as GDS2 bytes without context info, so the
+    parent reads plain cells instead of running the PCell again (GDS2 rather
+    than OASIS, which drops the size of the pin texts). Returns (index,
+    bytes, cell tables, worker pid, build time).
+    """
+    index, library, pcell, params, dbu = task
+    t0 = time.perf_counter()
+    decl = load_library(library).layout().pcell_declaration(pcell)
+    ly = pya.Layout()
+    ly.dbu = dbu
+    cell = ly.create_cell(pcell, library, convert_params(decl, params))
+    return index, gds_bytes(ly, cell, context=False), cell_tables(ly, cell), os.getpid(), time.perf_counter() - t0
+
+
+def cell_digest(ly, cell, digests):
+    """Hash of the shapes and instances of cell, children included; digests caches them by cell index."""
+    if cell.cell_index() not in digests:
+        h = hashlib.sha1()
+        for li in ly.layer_indexes():
+            if not cell.shapes(li).is_empty():
+                h.update(str(ly.get_info(li)).encode())
+                h.update(";".join(sorted(str(s) for s in cell.shapes(li).each())).encode())
+        for inst in cell.each_inst():
+            a = inst.cell_inst
+            h.update(cell_digest(ly, inst.cell, digests).encode())
+            h.update(str((a.cplx_trans, a.a, a.b, a.na, a.nb)).encode())
+        digests[cell.cell_index()] = h.hexdigest()
+    return digests[cell.cell_index()]
+
+
+class VariantMerger(object):
+    """
+    Merges variants built in other layouts into ly, keeping their hierarchy.
+    Sub-cells shared by the variants (Y-branches, via stacks) are stored once:
+    a child is reused when ly already has a cell of the same name and content,
+    and gets a unique name if only the name matches. The cell tables given by
+    source cell name (port tables, device records) are stored on the merged
+    cells.
+    """
+
+    def __init__(self, ly):
+        self.ly = ly
+        self.cells = {}
+
+    def merge(self, src_ly, src_cell, name, tables=None):
+        """Copies src_cell of src_ly into a new cell name of ly and returns it."""
+        cell = self.ly.create_cell(self.ly.unique_cell_name(name))
+        self.copy(src_ly, src_cell, cell, {}, {}, tables or {})
+        return cell
+
+    def copy(self, src_ly, src_cell, dst_cell, cell_map, digests, tables):
+        dst_cell.copy_shapes(src_cell)
+        set_tables(dst_cell, tables.get(src_cell.name))
+        for inst in src_cell.each_inst():
+            ci = inst.cell_index
+            if ci not in cell_map:
+                child = src_ly.cell(ci)
+                key = (child.name, cell_digest(src_ly, child, digests))
+                if key not in self.cells:
+                    dst_child = self.ly.create_cell(self.ly.unique_cell_name(child.name))
+                    self.copy(src_ly, child, dst_child, cell_map, digests, tables)
+                    self.cells[key] = dst_child.cell_index()
+                cell_map[ci] = self.cells[key]
+            # A new CellInstArray: a copy of the one read from GDS2 would still
+            # refer to the array repository of src_ly
+            a = inst.cell_inst
+            if a.is_regular_array():
+                dst_cell.insert(pya.CellInstArray(cell_map[ci], a.cplx_trans, a.a, a.b, a.na, a.nb))
+            else:
+                dst_cell.insert(pya.CellInstArray(cell_map[ci], a.cplx_trans))
+
+
+# GDS2 record types the stream writer looks at
+GDS_BGNSTR, GDS_STRNAME, GDS_ENDSTR, GDS_ENDEL, GDS_SNAME, GDS_ENDLIB = 0x05, 0x06, 0x07, 0x11, 0x12, 0x04
+
+
+def gds_records(data):
+    """(record type, record bytes) of the GDS2 stream data, up to ENDLIB."""
+    i = 0
+    while i < len(data):
+        size, rtype = struct.unpack(">HB", data[i:i + 3])
+        yield rtype, data[i:i + size]
+        if rtype == GDS_ENDLIB:
+            return
+        i += size
+
+
+def gds_string(record):
+    """Value of a GDS2 string record."""
+    return record[4:].rstrip(b"\0").decode()
+
+
+def gds_split(data):
+    """Header records (before the first structure) and [(name, records)] of the structures of data."""
+    header, structures = [], []
+    for rtype, record in gds_records(data):
+        if rtype == GDS_ENDLIB:
+            break
+        if rtype == GDS_BGNSTR:
+            structures.append([None, [record]])
+        elif not structures:
+            header.append(record)
+        else:
+            structures[-1][1].append(record)
+            if rtype == GDS_STRNAME:
+                structures[-1][0] = gds_string(record)
+    return header, structures
+
+
+def gds_elements(records):
+    """The elements of the structure records (BGNSTR, STRNAME and ENDSTR left out), as record lists."""
+    elements, element = [], []
+    for record in records[2:-1]:
+        element.append(record)
+        if record[2] == GDS_ENDEL:
+            elements.append(element)
+            element = []
+    return elements
+
+
+def gds_bytes(ly, cell=None, context=True):
+    """ly, or cell and its sub-cells, as GDS2 data, with the meta info unless context is False."""
+    opt = pya.SaveLayoutOptions()
+    opt.format = "GDS2"
+    opt.write_context_info = context
+    if cell is not None:
+        opt.add_cell(cell.cell_index())
+    return ly.write_bytes(opt)
+
+
+class GDSStreamWriter(object):
+    """
+    Writes a GDS2 file a variant at a time, so memory holds one variant
+    instead of the whole sweep. add() appends the cells of a variant layout
+    that the file does not have yet: sub-cells of the same name and content
+    are written once, and a cell whose name is taken by other content is
+    renamed. close() writes the top cell placing the variants.
+
+    The meta info of the cells (port tables, device records) is collected
+    from the context info of each variant. Readers only take the context
+    info from the first structure of the file, so the cells are streamed to
+    a temporary file next to path and copied behind it on close().
+    """
+
+    CONTEXT = "$$$CONTEXT_INFO$$$"
+
+    def __init__(self, path, dbu):
+        self.path = path
+        self.dbu = dbu
+        ly = pya.Layout()
+        ly.dbu = dbu
+        self.header = b"".join(gds_split(gds_bytes(ly))[0])
+        fd, self.body_path = tempfile.mkstemp(suffix=".gds", dir=os.path.dirname(os.path.abspath(path)))
+        self.body = os.fdopen(fd, "wb")
+        self.cells = {}
+        self.names = set()
+        self.context = []
+
+    def unique_name(self, name):
+        unique, n = name, 0
+        while unique in self.names:
+            n += 1
+            unique = "%s$%d" % (name, n)
+        self.names.add(unique)
+        return unique
+
+    def add(self, ly, top, name):
+        """Appends top of ly under name (made unique) with its sub-cells; returns the name used."""
+        digests = {}
+        new = set()
+        for ci in top.called_cells():
+            cell = ly.cell(ci)
+            key = (cell.name, cell_digest(ly, cell, digests))
+            if key not in self.cells:
+                self.cells[key] = self.unique_name(cell.name)
+                new.add(self.cells[key])
+            cell.name = self.cells[key]
+        top.name = self.unique_name(name)
+        new.add(top.name)
+        for structure, records in gds_split(gds_bytes(ly, top))[1]:
+            if structure == self.CONTEXT:
+                self.context += [e for e in gds_elements(records)
+                                 if any(r[2] == GDS_SNAME and gds_string(r) in new for r in e)]
+            elif structure in new:
+                self.body.write(b"".join(records))
+        return top.name
+
+    def close(self, top_name, placements, spacing):
+        """
+        Writes the file: the meta info, the cells added, and the top cell
+        top_name placing the cells of placements ([(name, drawn bounding
+        box)]) on the grid of place_grid.
+        """
+        ly = pya.Layout()
+        ly.dbu = self.dbu
+        top = ly.create_cell(self.unique_name(top_name))
+        for (name, _), trans in zip(placements, grid_transforms([b for _, b in placements], spacing, self.dbu)):
+            top.insert(pya.CellInstArray(ly.create_cell(name).cell_index(), trans))
+        records = [r for name, r in gds_split(gds_bytes(ly, context=False))[1] if name == top.name][0]
+        self.body.close()
+        try:
+            with open(self.path, "wb") as f:
+                f.write(self.header)
+                if self.context:
+                    name = self.CONTEXT.encode()
+                    f.write(records[0] + struct.pack(">HBB", 4 + len(name), GDS_STRNAME, 6) + name)
+                    f.write(b"".join(b"".join(e) for e in self.context))
+                    f.write(struct.pack(">HBB", 4, GDS_ENDSTR, 0))
+                with open(self.body_path, "rb") as body:
+                    shutil.copyfileobj(body, f)
+                f.write(b"".join(records))
+                f.write(struct.pack(">HBB", 4, GDS_ENDLIB, 0))
+        finally:
+            os.remove(self.body_path)
+
+
+def build_sweep(spec, pool=None):
+    """
+    Layout and top cell with every variant of the sweep spec placed on a
+    grid, and the build statistics per worker ({pid: [variants, seconds]}).
+    With a multiprocessing pool the variants are built by its workers and
+    merged here; otherwise they are library proxies built in this process.
+    """
+    lib = load_library(spec["library"])
+    decl = lib.layout().pcell_declaration(spec["pcell"])
+    if decl is None:
+        raise ValueError("No PCell %s in library %s" % (spec["pcell"], spec["library"]))
+    ly = pya.Layout()
+    ly.dbu = spec.get("dbu", lib.layout().dbu)
+    top = ly.create_cell(spec.get("top", spec["pcell"] + "_sweep"))
+    points = grid_points(spec.get("params", {}))
+    stats = {}
+    if pool is None:
+        t0 = time.perf_counter()
+        cells = [ly.create_cell(spec["pcell"], spec["library"], convert_params(decl, params))
+                 for params in points]
+        stats[os.getpid()] = [len(cells), time.perf_counter() - t0]
+        for cell in cells:
+            for name, values in cell_tables(ly, cell).items():
+                set_tables(ly.cell(name), values)
+    else:
+        for params in points:
+            convert_params(decl, params)
+        merger = VariantMerger(ly)
+        cells = [None] * len(points)
+        tasks = [(i, spec["library"], spec["pcell"], params, ly.dbu) for i, params in enumerate(points)]
+        for index, data, tables, pid, dt in pool.imap_unordered(build_variant, tasks):
+            src_ly = pya.Layout()
+            src_ly.read_bytes(data)
+            cells[index] = merger.merge(src_ly, src_ly.top_cell(), "%s_%d" % (spec["pcell"], index), tables)
+            worker = stats.setdefault(pid, [0, 0.0])
+            worker[0] += 1
+            worker[1] += dt
+    place_grid(ly, top, cells, spec.get("spacing", 20))
+    return ly, top, stats
+
+
+# Variants a worker builds for a streamed sweep before it is replaced
+STREAM_WORKER_TASKS = 50
+
+
+def stream_sweep(spec, path, pool=None):
+    """
+    Builds the sweep spec like build_sweep but writes each variant to the
+    GDS2 file path as soon as it is built (GDSStreamWriter), then the top
+    cell, so the memory of this process does not grow with the number of
+    variants. The variants are built in private layouts, by the workers of
+    pool if given; the library the variants are built with still keeps
+    them, which a pool recycling its workers (maxtasksperchild, see main)
+    bounds. Returns the number of variants and the statistics per worker.
+    """
+    lib = load_library(spec["library"])
+    decl = lib.layout().pcell_declaration(spec["pcell"])
+    if decl is None:
+        raise ValueError("No PCell %s in library %s" % (spec["pcell"], spec["library"]))
+    points = grid_points(spec.get("params", {}))
+    for params in points:
+        convert_params(decl, params)
+    dbu = spec.get("dbu", lib.layout().dbu)
+    writer = GDSStreamWriter(path, dbu)
+    placements = [None] * len(points)
+    stats = {}
+    tasks = [(i, spec["library"], spec["pcell"], params, dbu) for i, params in enumerate(points)]
+    for index, data, tables, pid, dt in (pool.imap_unordered if pool else map)(build_variant, tasks):
+        src_ly = pya.Layout()
+        src_ly.read_bytes(data)
+        src_cell = src_ly.top_cell()
+        for name, values in tables.items():
+            set_tables(src_ly.cell(name), values)
+        src_ly.update()
+        box = drawn_bbox(src_ly, src_cell)
+        placements[index] = (writer.add(src_ly, src_cell, "%s_%d" % (spec["pcell"], index)), box)
+        worker = stats.setdefault(pid, [0, 0.0])
+        worker[0] += 1
+        worker[1] += dt
+    writer.close(spec.get("top", spec["pcell"] + "_sweep"), placements, spec.get("spacing", 20))
+    return len(points), stats
+
+
+def write_layout(ly, top, path):
+    """Writes top and its hierarchy to path, as GDS or OASIS by the file extension."""
+    opt = pya.SaveLayoutOptions()
+    opt.set_format_from_filename(path)
+    opt.add_cell(top.cell_index())
+    ly.write(path, opt)
+
+
+def run_sweep(spec, output_dir=".", pool=None, stream=False):
+    """
+    Builds and writes the sweep spec. Returns the output path, the number of
+    variants and the statistics per worker of build_sweep. With stream the
+    variants are written as they are built (stream_sweep), to GDS2 only.
+    """
+    if stream:
+        path = os.path.join(output_dir, spec.get("output", spec.get("top", spec["pcell"] + "_sweep") + ".gds"))
+        if os.path.splitext(path)[1].lower() not in (".gds", ".gds2"):
+            raise ValueError("Streamed sweeps are written as GDS2, not %s" % path)
+        n, stats = stream_sweep(spec, path, pool)
+        return path, n, stats
+    ly, top, stats = build_sweep(spec, pool)
+    path = os.path.join(output_dir, spec.get("output", top.name + ".oas"))
+    write_layout(ly, top, path)
+    return path, top.child_instances(), stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes parameter sweeps of the Bruno PCells to GDS/OASIS.")
+    parser.add_argument("specs", nargs="+", help="JSON sweep spec files")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory of the output files")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes building the variants (0: one per core)")
+    parser.add_argument("--import", dest="modules", action="append", default=[],
+                        help="python module to import first, e.g. a PDK that registers its technology")
+    parser.add_argument("--technology", action="append", default=[],
+                        help=".lyt technology file to register")
+    parser.add_argument("--stream", action="store_true",
+                        help="write each variant to the (GDS2) output as soon as it is built")
+    args = parser.parse_args(argv)
+
+    init_worker(args.technology, args.modules)
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    jobs = args.jobs or multiprocessing.cpu_count()
+    pool = None
+    if jobs > 1 or args.stream:
+        # A library keeps every variant it has produced: streamed sweeps are
+        # built in workers, even with -j 1, replaced every STREAM_WORKER_TASKS
+        # variants to give that memory back
+        pool = multiprocessing.Pool(jobs, init_worker, (args.technology, args.modules),
+                                    STREAM_WORKER_TASKS if args.stream else None)
+    try:
+        for spec_file in args.specs:
+            for spec in load_specs(spec_file):
+                t0 = time.perf_counter()
+                path, n, stats = run_sweep(spec, args.output_dir, pool, args.stream)
+                dt = time.perf_counter() - t0
+                print("%s: %d variants of %s -> %s (%.1f s, %.1f variants/s)" % (
+                    spec_file, n, spec["pcell"], path, dt, n / dt))
+                if pool is not None:
+                    for pid, (count, busy) in sorted(stats.items()):
+                        print("  worker %d: %d variants in %.1f s, %.1f variants/s" % (
+                            pid, count, busy, count / busy if busy else 0))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,730 @@
+"""
+Benchmarks for the Bruno PCell libraries.
+
+Run inside KLayout, or standalone with the klayout and SiEPIC python modules
+installed and the technologies registered (e.g. siepic_ebeam_pdk for EBeam):
+
+  python Bruno_Benchmarks.py
+
+The PCell suite (run_suite) measures every AMF PCell and SWG_WDM over
+SUITE_GRIDS and saves the results as JSON; compare flags regressions
+between two saved runs:
+
+  python Bruno_Benchmarks.py suite -o new.json
+  python Bruno_Benchmarks.py compare old.json new.json
+
+check runs the checks of the PCells (check_grid_joints, check_ring_cells,
+check_shared_heater_pad, check_swg_hierarchy) and exits non-zero if one
+fails:
+
+  python Bruno_Benchmarks.py check
+
+BRUNO_BENCH_PRELUDE is python code run before the libraries are imported,
+e.g. "import siepic_ebeam_pdk" to register the technologies.
+
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pya
+import numpy as np
+
+
+AMF_PCELLS = ["Double_RR_MZI", "Double_RR_MZI_smallerSpiral", "MZI_isolated_sSpiral",
+              "MZI_isolated", "Double_RR_Isolated", "RR_Isolated"]
+
+
+def best_of(func, repeat=5):
+    """Best wall time of repeat calls to func, in seconds."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        dt = time.perf_counter() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+def swg_wdm_loop(shapes, Lc, Lt, Lambda, a, g, ws, wi):
+    """The per-period SWG loop that SWG_WDM.produce_impl used before batching."""
+    x0, y0 = -Lc/2 - Lt/2, -g/2 - ws/2
+    theta_t = np.arctan((ws-wi)/Lt)
+    for i in range(0, round(Lt/Lambda)):
+        shapes.insert(pya.Polygon([
+            pya.Point(x0 - Lt/2 + i*Lambda, y0 - (wi + np.sin(theta_t)*(i*Lambda))/2),
+            pya.Point(x0 - Lt/2 + i*Lambda, y0 + (wi + np.sin(theta_t)*(i*Lambda))/2),
+            pya.Point(x0 - Lt/2 + i*Lambda + a, y0 + (wi + np.sin(theta_t)*(i*Lambda + a))/2),
+            pya.Point(x0 - Lt/2 + i*Lambda + a, y0 - (wi + np.sin(theta_t)*(i*Lambda + a))/2)]))
+    for i in range(0, round(Lc/Lambda)):
+        shapes.insert(pya.Box(-Lc/2 + i*Lambda, -g/2, -Lc/2 + i*Lambda + a, -(g/2 + ws)))
+        shapes.insert(pya.Box(-Lc/2 + i*Lambda, g/2, -Lc/2 + i*Lambda + a, g/2 + ws))
+    for y0 in (-g/2 - ws/2, g/2 + ws/2):
+        x0 = Lc/2 + Lt/2
+        for i in range(0, round(Lt/Lambda)):
+            shapes.insert(pya.Polygon([
+                pya.Point(x0 - Lt/2 + i*Lambda, y0 - (ws - np.sin(theta_t)*(i*Lambda))/2),
+                pya.Point(x0 - Lt/2 + i*Lambda, y0 + (ws - np.sin(theta_t)*(i*Lambda))/2),
+                pya.Point(x0 - Lt/2 + i*Lambda + a, y0 + (ws - np.sin(theta_t)*(i*Lambda + a))/2),
+                pya.Point(x0 - Lt/2 + i*Lambda + a, y0 - (ws - np.sin(theta_t)*(i*Lambda + a))/2)]))
+
+
+def swg_wdm_batched(shapes, Lc, Lt, Lambda, a, g, ws, wi):
+    """The same segments through the NumPy generator and a single insert."""
+    from Bruno_EBeam_Library import swg_taper_segments, swg_coupler_segments, swg_region
+    theta_t = np.arctan((ws-wi)/Lt)
+    trapezoids = np.concatenate([
+        swg_taper_segments(-Lc/2 - Lt/2, -g/2 - ws/2, Lt, Lambda, a, wi, np.sin(theta_t)),
+        swg_taper_segments(Lc/2 + Lt/2, -g/2 - ws/2, Lt, Lambda, a, ws, -np.sin(theta_t)),
+        swg_taper_segments(Lc/2 + Lt/2, g/2 + ws/2, Lt, Lambda, a, ws, -np.sin(theta_t)),
+    ])
+    shapes.insert(swg_region(trapezoids, swg_coupler_segments(0, 0, Lc, Lambda, a, g, ws)))
+
+
+def bench_swg_wdm(cases=((34.4, 0.2), (100, 0.2), (500, 0.2), (500, 0.1), (2000, 0.2))):
+    """Loop vs batched SWG segment generation for (Lc, Lambda) pairs in microns."""
+    dbu = 0.001
+    print("SWG_WDM segments: Lc [um], Lambda [um], shapes, loop [ms], batched [ms], speedup")
+    for Lc, Lambda in cases:
+        args = dict(
+            Lc=round(Lc/Lambda)*Lambda/dbu, Lt=round(5.0/Lambda)*Lambda/dbu,
+            Lambda=Lambda/dbu, a=0.41*Lambda/dbu, g=0.1/dbu, ws=1.0/dbu, wi=0.5/dbu)
+
+        def run(generator):
+            ly = pya.Layout()
+            cell = ly.create_cell("SWG")
+            generator(cell.shapes(ly.layer(1, 0)), **args)
+            return cell.shapes(ly.layer(1, 0)).size()
+
+        n = run(swg_wdm_batched)
+        t_loop = best_of(lambda: run(swg_wdm_loop))
+        t_batched = best_of(lambda: run(swg_wdm_batched))
+        print("%8.1f  %5.3f  %7d  %9.2f  %9.2f  %5.1fx" % (
+            Lc, Lambda, n, t_loop*1e3, t_batched*1e3, t_loop/t_batched))
+
+
+def layout_stats(ly, cell):
+    """Flat shape count of cell and the size of cell written as GDS and OASIS."""
+    shapes = sum(1 for li in ly.layer_indexes() for _ in cell.begin_shapes_rec(li))
+    sizes = []
+    for ext in ("gds", "oas"):
+        fd, path = tempfile.mkstemp(suffix="." + ext)
+        os.close(fd)
+        opt = pya.SaveLayoutOptions()
+        opt.set_format_from_filename(path)
+        opt.add_cell(cell.cell_index())
+        ly.write(path, opt)
+        sizes.append(os.path.getsize(path))
+        os.remove(path)
+    return shapes, sizes[0], sizes[1]
+
+
+def bench_swg_wdm_hierarchy(lengths=(34.4, 500, 2000)):
+    """Flat vs cell array coupler of SWG_WDM: stored shapes and file sizes."""
+    import Bruno_EBeam_Library
+    print("SWG_WDM coupler: Lc [um], mode, stored shapes, flat shapes, GDS [kB], OASIS [kB]")
+    for Lc in lengths:
+        for hierarchical in (False, True):
+            ly = pya.Layout()
+            cell = ly.create_cell("SWG_WDM", "Bruno_EBeam_Library",
+                                  {"Lc": Lc, "hierarchical": hierarchical})
+            ly.cleanup()
+            stored = sum(c.shapes(li).size() for c in ly.each_cell() for li in ly.layer_indexes())
+            flat, gds, oas = layout_stats(ly, cell)
+            print("%8.1f  %-6s  %7d  %7d  %8.1f  %8.1f" % (
+                Lc, "array" if hierarchical else "flat", stored, flat, gds/1e3, oas/1e3))
+
+
+def bench_arc_cache(radii=(5, 10, 20)):
+    """Hits and misses of the shared arc outline cache over all AMF PCells."""
+    import Bruno_AMF_Library
+    from Bruno_AMF_Library import arc_outline
+    arc_outline.cache_clear()
+    ly = pya.Layout()
+    t0 = time.perf_counter()
+    for r in radii:
+        for name in AMF_PCELLS:
+            ly.create_cell(name, "Bruno_AMF_Library", {"r": r})
+    dt = time.perf_counter() - t0
+    info = arc_outline.cache_info()
+    print("AMF arc cache: %d PCells in %.1f ms, %d hits, %d misses, hit rate %.0f%%" % (
+        len(radii)*len(AMF_PCELLS), dt*1e3, info.hits, info.misses,
+        100.0*info.hits/max(1, info.hits + info.misses)))
+
+
+def produce_fresh(library, name, params=None):
+    """
+    Produces one variant of the PCell name of library in a private layout, so
+    neither KLayout's variant reuse nor the disk cache skips produce_impl.
+    Returns the layout, the variant cell and the wall time in seconds.
+    """
+    import Bruno_AMF_Library
+    decl = pya.Library.library_by_name(library).layout().pcell_declaration(name)
+    ly = pya.Layout()
+    ly.register_pcell(name, type(decl)())
+    enabled = Bruno_AMF_Library.PCELL_CACHE.enabled
+    Bruno_AMF_Library.PCELL_CACHE.enabled = False
+    try:
+        t0 = time.perf_counter()
+        cell = ly.create_cell(name, params or {})
+        dt = time.perf_counter() - t0
+    finally:
+        Bruno_AMF_Library.PCELL_CACHE.enabled = enabled
+    return ly, cell, dt
+
+
+def bench_shape_batching(repeat=5):
+    """Per PCell timings and polygon counts with and without ShapeBatch."""
+    import Bruno_AMF_Library
+    default = Bruno_AMF_Library.BATCH_SHAPES
+    print("AMF shape batching: PCell, polygons before, after, time before [ms], after [ms]")
+    for name in AMF_PCELLS:
+        result = []
+        for batch in (False, True):
+            Bruno_AMF_Library.BATCH_SHAPES = batch
+            times = []
+            for _ in range(repeat):
+                ly, cell, dt = produce_fresh("Bruno_AMF_Library", name)
+                times.append(dt)
+            polygons = sum(1 for li in ly.layer_indexes() for s in cell.shapes(li).each()
+                           if s.is_box() or s.is_polygon())
+            result += [polygons, min(times)]
+        Bruno_AMF_Library.BATCH_SHAPES = default
+        print("%-28s %5d %5d %8.2f %8.2f" % (
+            name, result[0], result[2], result[1]*1e3, result[3]*1e3))
+
+
+def bench_library_cells(radii=(5, 7.5, 10, 12.5, 15)):
+    """
+    Resolution of the Y-branch of SiEPIC_AMF_Library, the only cell the AMF
+    PCells take from another library (the spiral is drawn by spiral_cell),
+    while producing the four MZI PCells at several radii in one layout:
+    total time, then create_cell calls and time per cell as reported by
+    LibraryCells, resolving every instance (uncached) or once per layout.
+    """
+    import Bruno_AMF_Library
+    from Bruno_AMF_Library import LIBRARY_CELLS
+    names = AMF_PCELLS[:4]
+    enabled = Bruno_AMF_Library.PCELL_CACHE.enabled
+    Bruno_AMF_Library.PCELL_CACHE.enabled = False
+    try:
+        for cached in (False, True):
+            Bruno_AMF_Library.RESOLVE_CACHED = cached
+            LIBRARY_CELLS.clear()
+            ly = pya.Layout()
+            for name in names:
+                decl = pya.Library.library_by_name("Bruno_AMF_Library").layout().pcell_declaration(name)
+                ly.register_pcell(name, type(decl)())
+            t0 = time.perf_counter()
+            for r in radii:
+                for name in names:
+                    ly.create_cell(name, {"r": r})
+            dt = time.perf_counter() - t0
+            print("%s: %d PCells in %.1f ms" % (
+                "cached" if cached else "uncached", len(radii)*len(names), dt*1e3))
+            LIBRARY_CELLS.report()
+    finally:
+        Bruno_AMF_Library.RESOLVE_CACHED = True
+        Bruno_AMF_Library.PCELL_CACHE.enabled = enabled
+
+
+def bench_spiral(cases=((200, 8), (1000, 8), (5000, 4))):
+    """
+    Native spiral_polygons vs the EBeam-dev Spiral PCell (if that library is
+    installed) for (target length [um], spacing [um]) pairs.
+    """
+    from Bruno_AMF_Library import spiral_polygons
+    lib = pya.Library.library_by_name("EBeam-dev")
+    print("Spiral: target [um], spacing [um], exact length [um], native [ms], EBeam-dev [ms]")
+    for length, spacing in cases:
+        params = dict(length=length, wg_width=0.5, min_radius=5, wg_spacing=spacing, spiral_ports=1)
+        exact = spiral_polygons(**params)[1]
+        t_native = best_of(lambda: spiral_polygons(**params))
+        t_pcell = float("nan")
+        if lib and lib.layout().pcell_declaration("Spiral"):
+            decl = type(lib.layout().pcell_declaration("Spiral"))
+
+            def pcell():
+                ly = pya.Layout()
+                ly.register_pcell("Spiral", decl())
+                ly.create_cell("Spiral", params)
+            t_pcell = best_of(pcell)
+        print("%8.1f  %5.1f  %9.3f  %8.2f  %8.2f" % (
+            length, spacing, exact, t_native*1e3, t_pcell*1e3))
+
+
+def bench_netlist(counts=(1000, 4000, 16000)):
+    """
+    Bruno_Netlist.build_netlist on chains of count RR_Isolated instances,
+    each one abutting the next: the time per device should stay flat.
+    """
+    import Bruno_AMF_Library
+    import Bruno_Netlist
+    print("Netlist: devices, nets, build [ms], per device [us]")
+    for count in counts:
+        ly = pya.Layout()
+        top = ly.create_cell("TOP")
+        variant = ly.create_cell("RR_Isolated", "Bruno_AMF_Library", {})
+        ports = Bruno_AMF_Library.cell_ports(variant)
+        pitch = int(round((ports["opt2"]["x"] - ports["opt1"]["x"]) / ly.dbu))
+        for i in range(count):
+            top.insert(pya.CellInstArray(variant.cell_index(), pya.Trans(i * pitch, 0)))
+        netlist = {}
+        dt = best_of(lambda: netlist.update(Bruno_Netlist.build_netlist(ly, top)), repeat=3)
+        print("%6d  %6d  %8.1f  %6.1f" % (count, len(netlist["nets"]), dt*1e3, dt/count*1e6))
+
+
+STREAM_SCRIPT = """
+import json, os, resource, shutil, sys, tempfile, time
+sys.path.insert(0, %(path)r)
+%(prelude)s
+import Bruno_Batch
+directory = tempfile.mkdtemp()
+spec = os.path.join(directory, "spec.json")
+with open(spec, "w") as f:
+    json.dump(%(spec)r, f)
+t0 = time.perf_counter()
+Bruno_Batch.main([spec, "-o", directory] + %(args)r)
+dt = time.perf_counter() - t0
+print(json.dumps([resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                  os.path.getsize(os.path.join(directory, "sweep.gds")), dt]))
+shutil.rmtree(directory)
+"""
+
+
+def bench_stream_rss(counts=(25, 100, 400, 1600), pcell="Double_RR_MZI", path=None,
+                     prelude=os.environ.get("BRUNO_BENCH_PRELUDE", "import pya")):
+    """
+    Peak RSS of Bruno_Batch writing a GDS2 sweep of count distinct variants
+    (r swept), built in memory and then written, or streamed variant by
+    variant (--stream: the main process plus its largest worker). Each run
+    is a fresh interpreter (after prelude) with the PCell disk cache off, so
+    the peak is the memory of that sweep.
+    """
+    path = path or os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, BRUNO_PCELL_CACHE="0")
+    print("Sweep memory: variants, in memory [MB, s], streamed [MB + MB worker, s], GDS [MB]")
+    for count in counts:
+        spec = {"library": "Bruno_AMF_Library", "pcell": pcell, "output": "sweep.gds",
+                "params": {"r": [round(5 + 10.0 * i / count, 4) for i in range(count)]}}
+        row = []
+        for args in ([], ["--stream"]):
+            out = subprocess.check_output(
+                [sys.executable, "-c", STREAM_SCRIPT % dict(path=path, prelude=prelude, spec=spec, args=args)],
+                stderr=subprocess.DEVNULL, universal_newlines=True, env=env)
+            rss, worker, size, dt = json.loads(out.strip().splitlines()[-1])
+            row += [rss / 1024.0] + ([worker / 1024.0] if args else []) + [dt]
+        print("%6d  %8.1f %6.1f  %8.1f + %5.1f %6.1f  %7.1f" % tuple([count] + row + [size / 1e6]))
+
+
+def bench_shard(counts=(100, 400, 1600), tile=1000, pcell="Double_RR_MZI"):
+    """
+    Bruno_Shard on a GDS2 sweep of count variants of pcell: time to write
+    the tiles, and time to read the whole file against one tile.
+    """
+    import Bruno_Batch
+    import Bruno_Shard
+    print("Shard: variants, tiles, shard [s], read all [ms], read one tile [ms]")
+    for count in counts:
+        directory = tempfile.mkdtemp()
+        spec = {"library": "Bruno_AMF_Library", "pcell": pcell,
+                "params": {"r": [round(5 + 10.0 * i / count, 4) for i in range(count)]}}
+        ly, top, _ = Bruno_Batch.build_sweep(spec)
+        path = os.path.join(directory, "chip.gds")
+        Bruno_Batch.write_layout(ly, top, path)
+        name = top.name
+        ly = pya.Layout()
+        ly.read(path)
+        tiles = os.path.join(directory, "tiles")
+        os.makedirs(tiles)
+        t0 = time.perf_counter()
+        manifest = Bruno_Shard.shard(ly, ly.cell(name), tile, tiles)
+        dt = time.perf_counter() - t0
+        first = os.path.join(tiles, manifest["tiles"][0]["file"])
+        whole = best_of(lambda: pya.Layout().read(path), repeat=3)
+        one = best_of(lambda: pya.Layout().read(first), repeat=3)
+        print("%6d  %5d  %6.2f  %8.1f  %8.1f" % (count, len(manifest["tiles"]), dt, whole*1e3, one*1e3))
+        shutil.rmtree(directory)
+
+
+# Off-grid values of check_grid_joints: odd nanometres put the half lengths
+# of the PCells (MMI_L/2, w/2, ...) on half dbu ties
+ODD_NM_GRID = {"MMI_L": [29.001, 29.003, 30.001, 31.007], "w": [0.501, 0.503, 0.499, 0.45],
+               "MMI_w": [2.001], "tap_ls": [10.001]}
+
+
+def merged_count(library, name, params, layer_param="silayer"):
+    """Number of merged polygons of one fresh variant on the layer of its layer_param."""
+    decl = pya.Library.library_by_name(library).layout().pcell_declaration(name)
+    layer = dict((p.name, p.default) for p in decl.get_parameters())[layer_param]
+    ly, cell, _ = produce_fresh(library, name, params)
+    return pya.Region(cell.begin_shapes_rec(ly.layer(layer))).merged().count()
+
+
+def check_grid_joints(grid=ODD_NM_GRID):
+    """
+    Merged silicon polygon count of every AMF PCell over grid (one parameter
+    changed at a time, then MMI_L and w together) against its default
+    variant: a joint left open by a dbu splits the silicon into more pieces.
+    Returns the failures as (PCell, params, count, default count).
+    """
+    import Bruno_AMF_Library
+    cases = [{k: v} for k, values in sorted(grid.items()) for v in values]
+    cases.append({"MMI_L": grid["MMI_L"][0], "w": grid["w"][0]})
+    failures = []
+    print("Grid joints: PCell, default Si pieces, cases, failures")
+    for name in AMF_PCELLS:
+        expected = merged_count("Bruno_AMF_Library", name, {})
+        failed = [(name, params, n, expected) for params, n in
+                  ((params, merged_count("Bruno_AMF_Library", name, params)) for params in cases)
+                  if n != expected]
+        print("%-28s %3d %4d %4d" % (name, expected, len(cases), len(failed)))
+        for f in failed:
+            print("  %s: %d pieces" % (f[1], f[2]))
+        failures += failed
+    return failures
+
+
+def flat_layers(library, name, params):
+    """{layer: merged Region} of the flattened shapes of one fresh variant."""
+    ly, cell, _ = produce_fresh(library, name, params)
+    return dict((str(ly.get_info(li)), pya.Region(cell.begin_shapes_rec(li)).merged())
+                for li in ly.layer_indexes())
+
+
+# Off-grid values of check_swg_hierarchy: pitches, box lengths, gaps and
+# coupler lengths that do not fall on whole or half dbu
+SWG_GRID = {"Lambda": [0.35, 0.201, 0.199], "a": [0.0825, 0.0813], "g": [0.101, 0.1003],
+            "ws": [1.0005], "Lc": [34.41, 33.3]}
+
+
+def check_swg_hierarchy(grid=SWG_GRID):
+    """
+    SWG_WDM over grid (one parameter changed at a time) with the coupler as
+    a cell array against the same variant drawn flat: the flattened layers
+    must be equal. Returns the failures as (params, {layer: XOR area}).
+    """
+    import Bruno_EBeam_Library
+    cases = [{}] + [{k: v} for k, values in sorted(grid.items()) for v in values]
+    failures = []
+    print("SWG_WDM array vs flat: params, XOR area")
+    for params in cases:
+        array = flat_layers("Bruno_EBeam_Library", "SWG_WDM", dict(params, hierarchical=True))
+        flat = flat_layers("Bruno_EBeam_Library", "SWG_WDM", dict(params, hierarchical=False))
+        xor = dict((layer, (array.get(layer, pya.Region()) ^ flat.get(layer, pya.Region())).area())
+                   for layer in set(array) | set(flat))
+        xor = dict((layer, area) for layer, area in xor.items() if area)
+        print("  %-24s %s" % (params or "default", xor or 0))
+        if xor:
+            failures.append((params, xor))
+    return failures
+
+
+def check_ring_cells(grid=ODD_NM_GRID, names=("Double_RR_MZI", "Double_RR_MZI_smallerSpiral",
+                                              "Double_RR_Isolated")):
+    """
+    The ring block PCells over grid drawn with the shared ring block and its
+    mirrored half cells against the same variants drawn flat (SYMMETRY_CELLS
+    and SHARED_RING_BLOCK off): the flattened layers must be equal. Returns
+    the failures as (PCell, params, {layer: XOR area}).
+    """
+    import Bruno_AMF_Library
+    cases = [{}] + [{k: v} for k, values in sorted(grid.items()) for v in values]
+    cases.append({"MMI_L": grid["MMI_L"][0], "w": grid["w"][0]})
+    failures = []
+    print("Ring cells vs flat: PCell, cases, failures")
+    for name in names:
+        failed = []
+        for params in cases:
+            runs = []
+            for cells in (True, False):
+                Bruno_AMF_Library.SYMMETRY_CELLS = Bruno_AMF_Library.SHARED_RING_BLOCK = cells
+                try:
+                    runs.append(flat_layers("Bruno_AMF_Library", name, params))
+                finally:
+                    Bruno_AMF_Library.SYMMETRY_CELLS = Bruno_AMF_Library.SHARED_RING_BLOCK = True
+            shared, flat = runs
+            xor = dict((layer, (shared.get(layer, pya.Region()) ^ flat.get(layer, pya.Region())).area())
+                       for layer in set(shared) | set(flat))
+            xor = dict((layer, area) for layer, area in xor.items() if area)
+            if xor:
+                failed.append((name, params, xor))
+        print("%-28s %4d %4d" % (name, len(cases), len(failed)))
+        for f in failed:
+            print("  %s: XOR area %s" % (f[1], f[2]))
+        failures += failed
+    return failures
+
+
+def check_shared_heater_pad(pcell="RR_Isolated", pads=("elec3", "elec1")):
+    """
+    Two instances of pcell placed so that pad pads[0] of the first lies on
+    pad pads[1] of the second, as when two devices share a heater pad:
+    Bruno_Netlist.build_netlist must put both pads on one electrical net.
+    Returns the failures as (PCell, pads, net members).
+    """
+    import Bruno_AMF_Library
+    import Bruno_Netlist
+    ly = pya.Layout()
+    top = ly.create_cell("TOP")
+    variant = ly.create_cell(pcell, "Bruno_AMF_Library", {})
+    ports = Bruno_AMF_Library.cell_ports(variant)
+    print("Shared heater pad: PCell, pads, net ports, failures")
+    if not all(ports.get(pad, {}).get("type") == "electrical" for pad in pads):
+        print("%-28s %s/%s %4s %4d" % (pcell, pads[0], pads[1], "-", 1))
+        return [(pcell, pads, [])]
+    a, b = ports[pads[0]], ports[pads[1]]
+    top.insert(pya.CellInstArray(variant.cell_index(), pya.Trans()))
+    top.insert(pya.CellInstArray(variant.cell_index(), pya.Trans(
+        int(round((a["x"] - b["x"]) / ly.dbu)), int(round((a["y"] - b["y"]) / ly.dbu)))))
+    netlist = Bruno_Netlist.build_netlist(ly, top)
+    shared = [members for members in netlist["nets"].values()
+              if len(set(device for device, _ in members)) == 2
+              and set(port for _, port in members) == set(pads)]
+    members = shared[0] if shared else []
+    ok = len(shared) == 1 and len(members) == 2
+    print("%-28s %s/%s %4d %4d" % (pcell, pads[0], pads[1], len(members), 0 if ok else 1))
+    return [] if ok else [(pcell, pads, members)]
+
+
+# Parameter grids of the PCell suite: (library, PCell, defaults, {parameter: values}).
+# Each case changes one parameter of the defaults.
+SUITE_GRIDS = [("Bruno_AMF_Library", name, {},
+                {"r": [5, 10, 20], "MMI_L": [29, 60], "tap_ls": [10, 20]})
+               for name in AMF_PCELLS] + [
+    ("Bruno_EBeam_Library", "SWG_WDM", {},
+     {"Lc": [34.4, 500, 2000], "Lambda": [0.2, 0.1]}),
+]
+
+# Relative increase of a metric that compare reports as a regression
+TOLERANCES = {"time_ms": 0.2, "peak_py_kb": 0.2, "peak_rss_kb": 0.2,
+              "shapes": 0.0, "vertices": 0.0, "gds_bytes": 0.01, "oas_bytes": 0.01}
+
+# Absolute increase a regression must exceed as well, so the noise of small
+# values (a 1 ms case, a few kB) is not flagged
+FLOORS = {"time_ms": 1.0, "peak_py_kb": 64, "peak_rss_kb": 1024,
+          "shapes": 0, "vertices": 0, "gds_bytes": 256, "oas_bytes": 256}
+
+
+def suite_cases(grids=SUITE_GRIDS):
+    """(library, PCell, params) of every case of grids that the PCell declares."""
+    cases = []
+    for library, name, defaults, axes in grids:
+        decl = pya.Library.library_by_name(library).layout().pcell_declaration(name)
+        declared = dict((p.name, p.default) for p in decl.get_parameters())
+        cases.append((library, name, dict(defaults)))
+        for param, values in sorted(axes.items()):
+            if param not in declared:
+                continue
+            for value in values:
+                if value != defaults.get(param, declared[param]):
+                    params = dict(defaults)
+                    params[param] = value
+                    cases.append((library, name, params))
+    return cases
+
+
+def case_id(library, name, params):
+    return "%s/%s%s" % (library, name, "".join(",%s=%s" % kv for kv in sorted(params.items())))
+
+
+def measure_pcell(library, name, params, repeat=3):
+    """
+    Wall time (best of repeat), flat shape count per layer, vertex count,
+    peak memory and GDS/OASIS size of one fresh variant. peak_py_kb is the
+    peak of Python and NumPy allocations (tracemalloc); peak_rss_kb is the
+    rise of the process high water mark, which is only meaningful in a fresh
+    interpreter (run_suite(isolate=True)).
+    """
+    importlib.import_module(library)
+    times = []
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for _ in range(repeat):
+        ly, cell, dt = produce_fresh(library, name, params)
+        times.append(dt)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0
+    tracemalloc.start()
+    produce_fresh(library, name, params)
+    peak_py = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    shapes, vertices = {}, 0
+    for li in ly.layer_indexes():
+        n = 0
+        it = cell.begin_shapes_rec(li)
+        while not it.at_end():
+            shape = it.shape()
+            if shape.is_polygon() or shape.is_box() or shape.is_path():
+                vertices += shape.polygon.num_points()
+            n += 1
+            it.next()
+        if n:
+            shapes[str(ly.get_info(li))] = n
+    flat, gds, oas = layout_stats(ly, cell)
+    return {"id": case_id(library, name, params), "library": library, "pcell": name,
+            "params": params, "time_ms": min(times)*1e3, "shapes": flat,
+            "shapes_per_layer": shapes, "vertices": vertices, "peak_py_kb": peak_py/1024.0,
+            "peak_rss_kb": peak_rss, "gds_bytes": gds, "oas_bytes": oas}
+
+
+SUITE_SCRIPT = """
+import json, sys
+sys.path.insert(0, %(path)r)
+%(prelude)s
+import Bruno_Benchmarks
+print(json.dumps(Bruno_Benchmarks.measure_pcell(%(library)r, %(name)r, %(params)r, %(repeat)r)))
+"""
+
+
+def run_suite(path=None, grids=SUITE_GRIDS, repeat=3, isolate=False,
+              prelude=os.environ.get("BRUNO_BENCH_PRELUDE", "import pya")):
+    """
+    Runs measure_pcell for every case of grids, prints a table and saves the
+    results to the JSON file path. With isolate every case runs in a fresh
+    interpreter (after prelude), so peak_rss_kb is the memory of that case.
+    """
+    import Bruno_AMF_Library
+    import Bruno_EBeam_Library
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    print("PCell suite: case, time [ms], shapes, vertices, peak py [kB], peak rss [kB], GDS [kB], OASIS [kB]")
+    for library, name, params in suite_cases(grids):
+        if isolate:
+            out = subprocess.check_output(
+                [sys.executable, "-c", SUITE_SCRIPT % dict(path=here, prelude=prelude, library=library,
+                                                           name=name, params=params, repeat=repeat)],
+                stderr=subprocess.DEVNULL, universal_newlines=True)
+            r = json.loads(out.strip().splitlines()[-1])
+        else:
+            r = measure_pcell(library, name, params, repeat)
+        results.append(r)
+        print("%-60s %8.2f %7d %8d %8.0f %8d %8.1f %8.1f" % (
+            r["id"], r["time_ms"], r["shapes"], r["vertices"], r["peak_py_kb"],
+            r["peak_rss_kb"], r["gds_bytes"]/1e3, r["oas_bytes"]/1e3))
+    data = {"python": platform.python_version(), "klayout": getattr(pya, "__version__", ""),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"), "isolated": isolate, "results": results}
+    if path:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+    return data
+
+
+def compare(old_path, new_path, tolerances=TOLERANCES, floors=FLOORS):
+    """
+    Prints the metrics of the cases of two run_suite files and flags the
+    ones that grew by more than both their relative tolerance and their
+    absolute floor. peak_rss_kb is only compared when both runs are
+    isolated. Returns the regressions as (case id, metric, old, new).
+    """
+    with open(old_path) as f:
+        old_run = json.load(f)
+    with open(new_path) as f:
+        new_run = json.load(f)
+    old = dict((r["id"], r) for r in old_run["results"])
+    new = dict((r["id"], r) for r in new_run["results"])
+    regressions = []
+    print("Compare %s -> %s" % (old_path, new_path))
+    if not (old_run.get("isolated") and new_run.get("isolated")):
+        print("peak_rss_kb skipped: it is only comparable between isolated runs")
+        tolerances = dict((m, t) for m, t in tolerances.items() if m != "peak_rss_kb")
+    for key in sorted(set(old) | set(new)):
+        if key not in old or key not in new:
+            print("%-60s only in %s" % (key, old_path if key in old else new_path))
+            continue
+        for metric, tolerance in sorted(tolerances.items()):
+            a, b = old[key].get(metric), new[key].get(metric)
+            if a is None or b is None:
+                continue
+            flag = ""
+            if b > a * (1 + tolerance) and b - a > max(floors.get(metric, 0), 1e-9):
+                flag = "  REGRESSION"
+                regressions.append((key, metric, a, b))
+            if flag or metric == "time_ms":
+                print("%-60s %-12s %10.2f -> %10.2f  %+6.1f%%%s" % (
+                    key, metric, a, b, 100.0*(b - a)/a if a else 0, flag))
+    print("%d regressions" % len(regressions))
+    return regressions
+
+
+STARTUP_SCRIPT = """
+import sys, time
+sys.path.insert(0, %(path)r)
+%(prelude)s
+t0 = time.perf_counter()
+import %(module)s
+print(time.perf_counter() - t0, int("numpy" in sys.modules))
+"""
+
+
+def bench_startup(modules=("Bruno_AMF_Library", "Bruno_EBeam_Library"), path=None,
+                  prelude=os.environ.get("BRUNO_BENCH_PRELUDE", "import pya"), repeat=5):
+    """
+    Import and registration time of each library module, measured in a fresh
+    interpreter after prelude (which should register the technologies).
+    path is the directory holding the library files, by default this one.
+    """
+    path = path or os.path.dirname(os.path.abspath(__file__))
+    print("Library startup: module, import + registration [ms], numpy imported")
+    for module in modules:
+        best = None
+        for _ in range(repeat):
+            out = subprocess.check_output(
+                [sys.executable, "-c", STARTUP_SCRIPT % dict(path=path, prelude=prelude, module=module)],
+                stderr=subprocess.DEVNULL, universal_newlines=True)
+            dt, numpy_loaded = out.split()[-2:]
+            best = float(dt) if best is None else min(best, float(dt))
+        print("%-22s %8.2f  %s" % (module, best*1e3, "yes" if numpy_loaded == "1" else "no"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the Bruno PCell libraries.")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("suite", help="run the PCell suite and save the results as JSON")
+    p.add_argument("-o", "--output", default="bench_results.json")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--isolate", action="store_true", help="one fresh interpreter per case")
+    p = sub.add_parser("compare", help="flag regressions between two suite results")
+    p.add_argument("old")
+    p.add_argument("new")
+    sub.add_parser("check", help="check the grid joints, heater nets and SWG coupler arrays")
+    args = parser.parse_args()
+
+    if args.command in ("suite", "compare", "check"):
+        exec(os.environ.get("BRUNO_BENCH_PRELUDE", ""))
+    if args.command == "suite":
+        run_suite(args.output, repeat=args.repeat, isolate=args.isolate)
+    elif args.command == "compare":
+        sys.exit(1 if compare(args.old, args.new) else 0)
+    elif args.command == "check":
+        failures = check_grid_joints()
+        failures += check_ring_cells()
+        failures += check_shared_heater_pad()
+        failures += check_swg_hierarchy()
+        sys.exit(1 if failures else 0)
+    else:
+        bench_startup()
+        bench_swg_wdm()
+        bench_swg_wdm_hierarchy()
+        bench_arc_cache()
+        bench_shape_batching()
+        bench_library_cells()
+        bench_spiral()
+        bench_netlist()
+        bench_stream_rss()
+        bench_shard()
+        check_grid_joints()
+        check_ring_cells()
+        check_shared_heater_pad()
+        check_swg_hierarchy()
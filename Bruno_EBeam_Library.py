@@ -1,8 +1,83 @@
 import pya
-from pya import DPoint, DPath, Path, Polygon, Point, Text, Trans, Application, LayoutMetaInfo
+from pya import DPoint, DPath, Path, Polygon, Point, Text, Trans
 import numpy as np
 
 from SiEPIC.utils import get_technology_by_name
+from Bruno_Ports import port_table, device_info
+
+
+def swg_taper_segments(x0, y0, Lt, Lambda, a, w_start, slope):
+    """
+    Vertices of the SWG trapezoids along a taper centred on (x0, y0), as an
+    (n, 4, 2) array. The width grows linearly by slope from w_start.
+    """
+    s = np.arange(round(Lt/Lambda))*Lambda
+    x_l = x0 - Lt/2 + s
+    x_r = x_l + a
+    h_l = (w_start + slope*s)/2
+    h_r = (w_start + slope*(s + a))/2
+    return np.stack([
+        np.stack([x_l, y0 - h_l], axis=-1),
+        np.stack([x_l, y0 + h_l], axis=-1),
+        np.stack([x_r, y0 + h_r], axis=-1),
+        np.stack([x_r, y0 - h_r], axis=-1)], axis=1)
+
+
+def swg_pitch(Lambda):
+    """Lambda (in dbu) as an integer pitch if it is on grid, else None."""
+    pitch = round(Lambda)
+    return int(pitch) if abs(Lambda - pitch) < 1e-6 else None
+
+
+def swg_coupler_segments(x0, y0, Lc, Lambda, a, g, ws):
+    """
+    Corners (left, bottom, right, top) of both rows of SWG coupler boxes
+    centred on (x0, y0), as an (2n, 4) integer array. a, g/2 and ws are
+    rounded to dbu once, and so is the left end when Lambda is on grid
+    (swg_pitch), the boxes following at whole pitches: the same integers
+    swg_period_cell and its array use, so both modes draw the same boxes.
+    """
+    n = round(Lc/Lambda)
+    pitch = swg_pitch(Lambda)
+    if pitch is not None:
+        x_l = round(x0 - Lc/2) + np.arange(n, dtype=np.int64)*pitch
+    else:
+        x_l = np.round(x0 - Lc/2 + np.arange(n)*Lambda).astype(np.int64)
+    a, g2, ws = round(a), round(g/2), round(ws)
+    x_r = x_l + a
+    y0 = round(y0)
+    bottom = np.stack([x_l, np.full(n, y0 - g2 - ws), x_r, np.full(n, y0 - g2)], axis=-1)
+    top = np.stack([x_l, np.full(n, y0 + g2), x_r, np.full(n, y0 + g2 + ws)], axis=-1)
+    return np.concatenate([bottom, top])
+
+
+def swg_region(polygons, boxes):
+    """
+    Converts the vertex arrays to a Region in one pass. Coordinates are
+    truncated to integers like pya.Point does for float arguments.
+    """
+    region = pya.Region([
+        Polygon([Point(x, y) for x, y in pts], True)
+        for pts in polygons.astype(np.int64).tolist()])
+    region.insert(pya.Region([pya.Box(*box) for box in boxes.astype(np.int64).tolist()]))
+    return region
+
+
+def swg_period_cell(ly, layer, a, g, ws):
+    """
+    Returns the cell holding one SWG coupler period (the box pair of both
+    rows, left edge at x = 0), creating it in ly on first use. a, g/2 and
+    ws are rounded like in swg_coupler_segments.
+    """
+    a, g2, ws = round(a), round(g/2), round(ws)
+    info = ly.get_info(layer)
+    name = "SWG_period_%d_%d_%d_%d_%d" % (a, g2, ws, info.layer, info.datatype)
+    cell = ly.cell(name)
+    if cell is None:
+        cell = ly.create_cell(name)
+        cell.shapes(layer).insert(pya.Box(0, -g2 - ws, a, -g2))
+        cell.shapes(layer).insert(pya.Box(0, g2, a, g2 + ws))
+    return cell
 
 
 class SWG_WDM(pya.PCellDeclarationHelper):
@@ -27,6 +102,7 @@ class SWG_WDM(pya.PCellDeclarationHelper):
         self.param("Lb", self.TypeDouble, "Length of S-Bends", default = 10.0)
         self.param("Dy", self.TypeDouble, "S-bend vertical offset", default = 4.0)
         self.param("ws", self.TypeDouble, "Width of the Coupler SWG", default = 1.0)
+        self.param("hierarchical", self.TypeBoolean, "Coupler periods as cell array", default = False)
 
         self.param("layer", self.TypeLayer, "Layer", default = TECHNOLOGY['Waveguide'])
         self.param("pinrec", self.TypeLayer, "PinRec Layer", default = TECHNOLOGY['PinRec'])
@@ -62,73 +138,38 @@ class SWG_WDM(pya.PCellDeclarationHelper):
         from SiEPIC.utils import arc_wg_xy
         # def arc_wg_xy(x, y, r, w, theta_start, theta_stop, DevRec=None):
 
-        # Input Taper
-        # Triangle
-        x0, y0 = -Lc/2 - Lt/2, -g/2 - ws/2
-        pts = [
-            Point(x0 - Lt/2, y0 - wi/2),
-            Point(x0 - Lt/2, y0 + wi/2),
-            Point(x0 + Lt/2, y0 + wt/2),
-            Point(x0 + Lt/2, y0 - wt/2)]
-        shapes(LayerSiN).insert(Polygon(pts))
-        # SWG
-        x0, y0 = -Lc/2 - Lt/2, -g/2 - ws/2
-        theta_t = np.arctan((ws-wi)/Lt)
-        for i in range(0, round(Lt/Lambda)):
-            pts = [
-                Point(x0 - Lt/2 + i*Lambda, y0 - (wi + np.sin(theta_t)*(i*Lambda))/2),
-                Point(x0 - Lt/2 + i*Lambda, y0 + (wi + np.sin(theta_t)*(i*Lambda))/2),
-                Point(x0 - Lt/2 + i*Lambda + a, y0 + (wi + np.sin(theta_t)*(i*Lambda + a))/2),
-                Point(x0 - Lt/2 + i*Lambda + a, y0 - (wi + np.sin(theta_t)*(i*Lambda + a))/2)]
-            shapes(LayerSiN).insert(Polygon(pts))
-
-        # SWG Coupler
-        x0, y0 = 0, 0
-        for i in range(0, round(Lc/Lambda)):
-            box1 = Box(x0 - Lc/2 + i*Lambda, y0 - g/2,
-                x0 - Lc/2 + i*Lambda + a, y0 - (g/2 + ws))
-            box2 = Box(x0 - Lc/2 + i*Lambda, y0 + g/2,
-                x0 - Lc/2 + i*Lambda + a, y0 + g/2 + ws)
-            shapes(LayerSiN).insert(box1)
-            shapes(LayerSiN).insert(box2)
-
-        # Output Taper 1
-        # Triangle
-        x0, y0 = Lc/2 + Lt/2, -g/2 - ws/2
-        pts = [
-            Point(x0 - Lt/2, y0 - wt/2),
-            Point(x0 - Lt/2, y0 + wt/2),
-            Point(x0 + Lt/2, y0 + wi/2),
-            Point(x0 + Lt/2, y0 - wi/2)]
-        shapes(LayerSiN).insert(Polygon(pts))
-        # SWG
-        theta_t = np.arctan((ws-wi)/Lt)
-        for i in range(0, round(Lt/Lambda)):
-            pts = [
-                Point(x0 - Lt/2 + i*Lambda, y0 - (ws - np.sin(theta_t)*(i*Lambda))/2),
-                Point(x0 - Lt/2 + i*Lambda, y0 + (ws - np.sin(theta_t)*(i*Lambda))/2),
-                Point(x0 - Lt/2 + i*Lambda + a, y0 + (ws - np.sin(theta_t)*(i*Lambda + a))/2),
-                Point(x0 - Lt/2 + i*Lambda + a, y0 - (ws - np.sin(theta_t)*(i*Lambda + a))/2)]
-            shapes(LayerSiN).insert(Polygon(pts))
-
-        # Output Taper 2
-        # Triangle
-        x0, y0 = Lc/2 + Lt/2, g/2 + ws/2
-        pts = [
-            Point(x0 - Lt/2, y0 - wt/2),
-            Point(x0 - Lt/2, y0 + wt/2),
-            Point(x0 + Lt/2, y0 + wi/2),
-            Point(x0 + Lt/2, y0 - wi/2)]
-        shapes(LayerSiN).insert(Polygon(pts))
-        # SWG
+        # SWG segments: input taper, coupler and both output tapers
+        x_in, x_out = -Lc/2 - Lt/2, Lc/2 + Lt/2
+        y_bot, y_top = -g/2 - ws/2, g/2 + ws/2
         theta_t = np.arctan((ws-wi)/Lt)
-        for i in range(0, round(Lt/Lambda)):
-            pts = [
-                Point(x0 - Lt/2 + i*Lambda, y0 - (ws - np.sin(theta_t)*(i*Lambda))/2),
-                Point(x0 - Lt/2 + i*Lambda, y0 + (ws - np.sin(theta_t)*(i*Lambda))/2),
-                Point(x0 - Lt/2 + i*Lambda + a, y0 + (ws - np.sin(theta_t)*(i*Lambda + a))/2),
-                Point(x0 - Lt/2 + i*Lambda + a, y0 - (ws - np.sin(theta_t)*(i*Lambda + a))/2)]
-            shapes(LayerSiN).insert(Polygon(pts))
+        trapezoids = np.concatenate([
+            swg_taper_segments(x_in, y_bot, Lt, Lambda, a, wi, np.sin(theta_t)),
+            swg_taper_segments(x_out, y_bot, Lt, Lambda, a, ws, -np.sin(theta_t)),
+            swg_taper_segments(x_out, y_top, Lt, Lambda, a, ws, -np.sin(theta_t)),
+        ])
+        # The coupler is a regular array of one period cell when Lambda is
+        # on grid; flat boxes otherwise (or when requested for mask prep)
+        pitch = swg_pitch(Lambda)
+        if self.hierarchical and pitch is not None:
+            period = swg_period_cell(ly, LayerSiN, a, g, ws)
+            self.cell.insert(pya.CellInstArray(
+                period.cell_index(), pya.Trans(round(-Lc/2), 0),
+                pya.Vector(pitch, 0), pya.Vector(0, 0), round(Lc/Lambda), 1))
+            boxes = np.zeros((0, 4))
+        else:
+            boxes = swg_coupler_segments(0, 0, Lc, Lambda, a, g, ws)
+
+        # Triangles of the input and output tapers
+        triangles = np.array([
+            [[x_in - Lt/2, y_bot - wi/2], [x_in - Lt/2, y_bot + wi/2],
+             [x_in + Lt/2, y_bot + wt/2], [x_in + Lt/2, y_bot - wt/2]],
+            [[x_out - Lt/2, y_bot - wt/2], [x_out - Lt/2, y_bot + wt/2],
+             [x_out + Lt/2, y_bot + wi/2], [x_out + Lt/2, y_bot - wi/2]],
+            [[x_out - Lt/2, y_top - wt/2], [x_out - Lt/2, y_top + wt/2],
+             [x_out + Lt/2, y_top + wi/2], [x_out + Lt/2, y_top - wi/2]],
+        ])
+
+        shapes(LayerSiN).insert(swg_region(np.concatenate([triangles, trapezoids]), boxes))
 
         # S-bends
         x0, y0 = Lc/2 + Lt, g/2 + ws/2
@@ -152,15 +193,19 @@ class SWG_WDM(pya.PCellDeclarationHelper):
         shapes(LayerSiN).insert(arc1)
         shapes(LayerSiN).insert(arc2)
 
-        shapes(LayerPinRecN).insert(pya.Text(
-            "opt1", pya.Trans(pya.Trans.R0, -Lc/2 - Lt, -g/2 - ws/2)
-        )).text_size = 0.5/dbu
-        shapes(LayerPinRecN).insert(pya.Text(
-            "opt2", pya.Trans(pya.Trans.R0, Lc/2 + Lt + Lb, g/2 + ws/2 + 2*Dy)
-        )).text_size = 0.5/dbu
-        shapes(LayerPinRecN).insert(pya.Text(
-            "opt3", pya.Trans(pya.Trans.R0, Lc/2 + Lt + Lb, -(g/2 + ws/2 + 2*Dy))
-        )).text_size = 0.5/dbu
+        # Pin texts on the grid (pya.Trans truncates) and the same positions
+        # in the port table
+        pins = {
+            "opt1": (int(-Lc/2 - Lt), int(-g/2 - ws/2), 180, wi),
+            "opt2": (int(Lc/2 + Lt + Lb), int(g/2 + ws/2 + 2*Dy), 0, wi),
+            "opt3": (int(Lc/2 + Lt + Lb), int(-(g/2 + ws/2 + 2*Dy)), 0, wi),
+        }
+        for name, (x, y, direction, width) in sorted(pins.items()):
+            shapes(LayerPinRecN).insert(pya.Text(
+                name, pya.Trans(pya.Trans.R0, x, y)
+            )).text_size = 0.5/dbu
+        port_table(self.cell, dbu, pins)
+        device_info(self)
 
 
 class Bruno_EBeam_Library(pya.Library):
@@ -0,0 +1,298 @@
+"""
+Circuit netlists from the sub-netlists the Bruno PCells publish.
+
+Every PCell of Bruno_AMF_Library and Bruno_EBeam_Library stores its port
+table ("ports" meta info) and its device record ("device": PCell, library
+and parameters) on the cell it produces. build_netlist collects the device
+instances below a top cell, moves their ports into top coordinates and
+connects the ports that meet, looking them up in a grid of port positions
+instead of pairing pin shapes on the PinRec layer, so the work grows with
+the number of ports rather than with its square.
+
+Inside KLayout:
+
+  import Bruno_Netlist
+  netlist = Bruno_Netlist.build_netlist(layout, top_cell)
+  print(Bruno_Netlist.spice(netlist))
+
+or standalone on a layout file, e.g. the output of Bruno_Batch.py:
+
+  python Bruno_Netlist.py chip.oas -o chip.spi --json chip.json
+
+A layout holding library proxies needs the libraries (and the technologies
+they use) registered before it is read: pass their modules with --import.
+
+Two ports are connected when they lie within the tolerance of each other,
+have the same type and face each other (pads, with no direction, connect in
+any direction). The heater pads of the AMF PCells are electrical pads, so
+devices sharing a pad are on one electrical net. Ports left unconnected
+become the pins of the circuit.
+Width mismatches and optical nets with more than two ports are reported as
+warnings.
+
+"""
+
+import argparse
+import collections
+import importlib
+import json
+import os
+import sys
+import time
+
+import pya
+
+from Bruno_Ports import PORTS, DEVICE, source_cell
+
+
+Port = collections.namedtuple("Port", "device name x y direction width type")
+
+
+def device_record(cell):
+    """
+    (device record, port table) of cell, or None if cell is not a device.
+    Cells with a port table but no record (e.g. a via stack placed on its
+    own) are devices named after the cell, without parameters.
+    """
+    src = source_cell(cell)
+    ports = src.meta_info_value(PORTS)
+    if ports is None:
+        return None
+    record = src.meta_info_value(DEVICE) or {"component": cell.name, "library": None, "params": {}}
+    return record, ports
+
+
+def device_index(ly):
+    """
+    (device record of every cell of ly or None, set of the cells that are
+    or contain devices), for device_placements.
+    """
+    records = {}
+    relevant = set()
+    for ci in ly.each_cell_bottom_up():
+        cell = ly.cell(ci)
+        records[ci] = device_record(cell)
+        if records[ci] is not None or any(c in relevant for c in cell.each_child_cell()):
+            relevant.add(ci)
+    return records, relevant
+
+
+def device_placements(ly, top, index=None):
+    """
+    (cell index, ICplxTrans into top) of every device instance below top,
+    array members one by one. The tree is not entered below a device, and
+    sub-trees without devices are skipped. index is the device_index of ly,
+    computed if not given.
+    """
+    records, relevant = index or device_index(ly)
+    if records.get(top.cell_index()) is not None:
+        return records, [(top.cell_index(), pya.ICplxTrans())]
+    placements = []
+    stack = [(top, pya.ICplxTrans())]
+    while stack:
+        cell, trans = stack.pop()
+        for inst in cell.each_inst():
+            ci = inst.cell_index
+            if ci not in relevant:
+                continue
+            for t in inst.cell_inst.each_cplx_trans():
+                if records[ci] is not None:
+                    placements.append((ci, trans * t))
+                else:
+                    stack.append((ly.cell(ci), trans * t))
+    return records, placements
+
+
+def place_ports(device, table, trans, dbu):
+    """Ports of the port table of device moved by trans, in top dbu."""
+    ports = []
+    for name in sorted(table):
+        p = table[name]
+        pos = trans * pya.Point(int(round(p["x"] / dbu)), int(round(p["y"] / dbu)))
+        direction = p["direction"]
+        if direction is not None:
+            direction = round((trans.angle + (-direction if trans.is_mirror() else direction)) % 360, 6)
+        ports.append(Port(device, name, pos.x, pos.y, direction, p["width"] * trans.mag, p["type"]))
+    return ports
+
+
+def facing(a, b):
+    """True if ports a and b face each other, or one of them is a pad."""
+    if a.direction is None or b.direction is None:
+        return True
+    return abs((a.direction - b.direction) % 360 - 180) < 1e-6
+
+
+def connect(ports, tolerance):
+    """
+    Root index of the net of every port: ports within tolerance dbu of each
+    other, of the same type and facing each other are joined. The ports are
+    binned on a grid of tolerance + 1 dbu, so each one is compared with the
+    few ports of its own and the neighbouring bins only.
+    """
+    size = tolerance + 1
+    grid = collections.defaultdict(list)
+    for i, p in enumerate(ports):
+        grid[(p.x // size, p.y // size)].append(i)
+    parent = list(range(len(ports)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, p in enumerate(ports):
+        gx, gy = p.x // size, p.y // size
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in grid.get((gx + dx, gy + dy), ()):
+                    if j <= i:
+                        continue
+                    q = ports[j]
+                    if abs(p.x - q.x) <= tolerance and abs(p.y - q.y) <= tolerance \
+                            and p.type == q.type and facing(p, q):
+                        parent[root(j)] = root(i)
+    return [root(i) for i in range(len(ports))]
+
+
+def build_netlist(ly, top, tolerance=0.001):
+    """
+    Netlist of the devices below top, as a JSON serialisable dict:
+
+      devices:  name, component, library, params, cell, x, y (microns),
+                rotation, mirror and nets ({port: net}) of each device
+      nets:     {net: [[device, port], ...]}
+      pins:     nets with a single port, the pins of the circuit
+      warnings: width mismatches and optical nets of more than two ports
+
+    tolerance is the largest distance in microns between connected ports.
+    """
+    dbu = ly.dbu
+    records, placements = device_placements(ly, top)
+    # Devices in reading order, numbered per component
+    placements.sort(key=lambda p: (-p[1].disp.y, p[1].disp.x))
+    counts = collections.Counter()
+    devices = []
+    ports = []
+    for ci, trans in placements:
+        record, table = records[ci]
+        name = "%s_%d" % (record["component"], counts[record["component"]])
+        counts[record["component"]] += 1
+        devices.append({
+            "name": name,
+            "component": record["component"],
+            "library": record["library"],
+            "params": record["params"],
+            "cell": ly.cell(ci).name,
+            "x": round(trans.disp.x * dbu, 6),
+            "y": round(trans.disp.y * dbu, 6),
+            "rotation": trans.angle,
+            "mirror": trans.is_mirror(),
+            "nets": {},
+        })
+        ports += place_ports(len(devices) - 1, table, trans, dbu)
+
+    roots = connect(ports, int(round(tolerance / dbu)))
+    names = {}
+    nets = collections.OrderedDict()
+    for port, r in zip(ports, roots):
+        if r not in names:
+            names[r] = "N$%d" % len(names)
+        devices[port.device]["nets"][port.name] = names[r]
+        nets.setdefault(names[r], []).append(port)
+
+    warnings = []
+    for net, members in nets.items():
+        widths = set(round(p.width, 6) for p in members)
+        if len(widths) > 1:
+            warnings.append("%s: width mismatch %s" % (net, ", ".join(
+                "%s.%s %g" % (devices[p.device]["name"], p.name, p.width) for p in members)))
+        if len(members) > 2 and members[0].type == "optical":
+            warnings.append("%s: %d optical ports meet at %g, %g" % (
+                net, len(members), members[0].x * dbu, members[0].y * dbu))
+
+    return {
+        "top": top.name,
+        "devices": devices,
+        "nets": dict((net, [[devices[p.device]["name"], p.name] for p in members])
+                     for net, members in nets.items()),
+        "pins": [net for net, members in nets.items() if len(members) == 1],
+        "warnings": warnings,
+    }
+
+
+def spice_value(value):
+    """value as a SPICE parameter value, strings quoted."""
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return '"%s"' % value
+
+
+def spice(netlist):
+    """netlist of build_netlist as a SPICE sub-circuit, one X line per device."""
+    top = netlist["top"]
+    lines = ["* Netlist of %s, from the device records and port tables of its cells" % top,
+             ".subckt %s %s" % (top, " ".join(netlist["pins"]))]
+    for d in netlist["devices"]:
+        params = " ".join("%s=%s" % (k, spice_value(v)) for k, v in sorted(d["params"].items()))
+        lines.append("X%s %s %s library=%s %s" % (
+            d["name"], " ".join(d["nets"][p] for p in sorted(d["nets"])), d["component"],
+            spice_value(d["library"] or ""), params))
+    lines.append(".ends %s" % top)
+    for w in netlist["warnings"]:
+        lines.append("* warning: %s" % w)
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Netlist of a layout of Bruno PCells from their port tables.")
+    parser.add_argument("layout", help="GDS/OASIS file")
+    parser.add_argument("--top", help="top cell (default: the single top cell of the layout)")
+    parser.add_argument("-o", "--output", help="SPICE output file (default: standard output)")
+    parser.add_argument("--json", help="also write the netlist as JSON to this file")
+    parser.add_argument("--tolerance", type=float, default=0.001,
+                        help="largest distance between connected ports, in microns")
+    parser.add_argument("--import", dest="modules", action="append", default=[],
+                        help="python module to import first, e.g. a PDK or the Bruno libraries")
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    for module in args.modules:
+        importlib.import_module(module)
+
+    ly = pya.Layout()
+    ly.read(args.layout)
+    if args.top:
+        top = ly.cell(args.top)
+        if top is None:
+            parser.error("no cell %s in %s" % (args.top, args.layout))
+    else:
+        tops = ly.top_cells()
+        if len(tops) != 1:
+            parser.error("%s has %d top cells, select one with --top" % (args.layout, len(tops)))
+        top = tops[0]
+
+    t0 = time.perf_counter()
+    netlist = build_netlist(ly, top, args.tolerance)
+    dt = time.perf_counter() - t0
+    text = spice(netlist)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(netlist, f, indent=1)
+    sys.stderr.write("%s: %d devices, %d nets, %d pins, %d warnings (%.2f s)\n" % (
+        top.name, len(netlist["devices"]), len(netlist["nets"]), len(netlist["pins"]),
+        len(netlist["warnings"]), dt))
+
+
+if __name__ == "__main__":
+    main()
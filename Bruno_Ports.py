@@ -0,0 +1,81 @@
+"""
+Port tables and device records of the Bruno PCells.
+
+Every PCell of Bruno_AMF_Library and Bruno_EBeam_Library publishes two
+LayoutMetaInfo on the cell it produces: its ports (PORTS, written by
+port_table) and its device record (DEVICE, written by device_info). The
+libraries write them and Bruno_Batch.py, Bruno_Netlist.py and
+Bruno_Shard.py read them, all through this module, so the names and the
+format are defined once.
+
+"""
+
+import pya
+from pya import LayoutMetaInfo
+
+
+# Name of the LayoutMetaInfo holding the port table of a cell
+PORTS = "ports"
+
+# Name of the LayoutMetaInfo holding the device record of a PCell variant
+DEVICE = "device"
+
+
+def port_table(cell, dbu, ports, grid=None):
+    """
+    Publishes the ports of cell as its PORTS meta info, next to the pin
+    paths and texts on the PinRec layer, so routers, netlisters and checkers
+    look them up by name instead of scanning shapes. ports maps each name to
+    (x, y, direction, width[, type]) in dbu and degrees, the direction
+    pointing out of the device (None for pads). The table stores the
+    position snapped by grid (the Grid of an AMF device, like its pins) or
+    else rounded to the nearest dbu, and the width in microns, type
+    "optical" unless given.
+    """
+    table = {}
+    for name, port in ports.items():
+        x, y, direction, width = port[:4]
+        if grid is not None:
+            x, y = grid.x(x), grid.y(y)
+        table[name] = {
+            "x": round(int(round(x)) * dbu, 6),
+            "y": round(int(round(y)) * dbu, 6),
+            "direction": direction,
+            "width": round(width * dbu, 6),
+            "type": port[4] if len(port) > 4 else "optical",
+        }
+    cell.add_meta_info(LayoutMetaInfo(PORTS, table, "Port table", True))
+
+
+def device_info(decl):
+    """
+    Publishes the device record of the variant decl is producing as the
+    DEVICE meta info of its cell: the PCell and library names and the
+    parameter values (layers as strings, guiding shapes left out). With the
+    port table it is the sub-netlist of the variant that Bruno_Netlist.py
+    connects through the port positions.
+    """
+    params = {}
+    for p in decl.get_parameters():
+        if p.type == pya.PCellParameterDeclaration.TypeShape:
+            continue
+        value = getattr(decl, p.name)
+        params[p.name] = str(value) if isinstance(value, pya.LayerInfo) else value
+    lib = decl.layout.library()
+    info = {"component": decl.name(), "library": lib.name() if lib else None, "params": params}
+    decl.cell.add_meta_info(LayoutMetaInfo(DEVICE, info, "Device record", True))
+
+
+def source_cell(cell):
+    """cell, or the library cell holding the meta info of a library proxy."""
+    while cell.is_library_cell():
+        cell = cell.library().layout().cell(cell.library_cell_index())
+    return cell
+
+
+def cell_ports(cell):
+    """
+    Port table of cell published by port_table, or None. Library proxies
+    are followed to the library cell, which holds the meta info.
+    """
+    return source_cell(cell).meta_info_value(PORTS)
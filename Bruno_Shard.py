@@ -0,0 +1,290 @@
+"""
+Sharded export of large layouts: one file per tile and a manifest.
+
+Splits the placement of a top cell into square tiles and writes each tile
+to its own file, with a JSON manifest holding the bounding box and the
+device list of every tile, so viewers and downstream checks open only the
+tiles of the region they need instead of the whole chip:
+
+  python Bruno_Shard.py chip.gds --tile 2000 -o chip_tiles -j 4
+
+Instances are not cut. The placement is walked down from the top cell,
+entering the cells larger than a tile but never a device (a cell with a port
+table, see Bruno_Netlist.py); every instance left, and every shape of the
+cells entered, goes to the tile holding the centre of its bounding box. The
+tile file of column c and row r (counted from the lower left corner of the
+top cell) holds a top cell <top>_<c>_<r> with these instances and shapes in
+the coordinates of the original top cell, so the tiles overlay. Its
+bounding box reaches past the tile area by the instances across the border.
+
+The manifest (manifest.json in the output directory) lists per tile its
+file, area, bounding box and devices, the latter in the format of the
+devices of Bruno_Netlist.build_netlist without the nets. tiles_in selects
+the tiles overlapping a region:
+
+  manifest = json.load(open("chip_tiles/manifest.json"))
+  files = [t["file"] for t in Bruno_Shard.tiles_in(manifest, (0, 0, 500, 500))]
+
+With -j N the tiles are written by N worker processes, each reading the
+layout once. A layout holding library proxies needs the libraries (and the
+technologies they use) registered first: pass their modules with --import.
+
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import pya
+
+import Bruno_Netlist
+
+
+MANIFEST = "manifest.json"
+
+# Layout and device index of the layout being sharded, per process
+SOURCE = {}
+
+
+def read_layout(path, modules=()):
+    """Imports modules, then reads the layout file path."""
+    for module in modules:
+        importlib.import_module(module)
+    ly = pya.Layout()
+    ly.read(path)
+    return ly
+
+
+def set_source(ly):
+    """Makes ly the layout write_tile takes its cells from."""
+    SOURCE["layout"] = ly
+    SOURCE["index"] = Bruno_Netlist.device_index(ly)
+
+
+def init_worker(path, modules):
+    """Pool initializer: reads the layout to shard once per worker."""
+    set_source(read_layout(path, modules))
+
+
+def tile_of(point, origin, size):
+    """(column, row) of the tile holding point, tiles of size dbu from origin."""
+    return int((point.x - origin[0]) // size), int((point.y - origin[1]) // size)
+
+
+def placement(ly, top, size, records):
+    """
+    (instances, entered) of the placement of top for tiles of size dbu, both
+    lists of (cell index, ICplxTrans into top): the instances that are
+    devices or fit in a tile, array members one by one, and the cells
+    entered (top first), whose own shapes are placed one by one.
+    """
+    if records.get(top.cell_index()) is not None:
+        return [(top.cell_index(), pya.ICplxTrans())], []
+    instances = []
+    entered = [(top.cell_index(), pya.ICplxTrans())]
+    stack = list(entered)
+    while stack:
+        ci, trans = stack.pop()
+        for inst in ly.cell(ci).each_inst():
+            child = ly.cell(inst.cell_index)
+            for t in inst.cell_inst.each_cplx_trans():
+                t = trans * t
+                box = t * child.bbox()
+                if records[child.cell_index()] is None and child.child_cells() \
+                        and max(box.width(), box.height()) > size:
+                    entered.append((child.cell_index(), t))
+                    stack.append((child.cell_index(), t))
+                else:
+                    instances.append((child.cell_index(), t))
+    return instances, entered
+
+
+def assign_tiles(ly, instances, entered, origin, size):
+    """
+    {(column, row): {"instances": [(cell index, trans string)], "entered":
+    [(cell index, trans string)]}}: every instance to the tile of the centre
+    of its bounding box, and every entered cell to the tiles holding the
+    centre of one of its shapes.
+    """
+    tiles = {}
+
+    def tile(key):
+        return tiles.setdefault(key, {"instances": [], "entered": []})
+
+    for ci, t in instances:
+        box = ly.cell(ci).bbox()
+        centre = t * (box.center() if not box.empty() else pya.Point())
+        tile(tile_of(centre, origin, size))["instances"].append((ci, t.to_s()))
+    for ci, t in entered:
+        keys = set()
+        for li in ly.layer_indexes():
+            for shape in ly.cell(ci).shapes(li).each():
+                keys.add(tile_of(t * shape.bbox().center(), origin, size))
+        for key in keys:
+            tile(key)["entered"].append((ci, t.to_s()))
+    return tiles
+
+
+def box_um(box, dbu):
+    """[left, bottom, right, top] of box in microns."""
+    return [round(v * dbu, 6) for v in (box.left, box.bottom, box.right, box.top)]
+
+
+def tile_devices(ly, tile, index):
+    """Devices below the tile cell, in reading order, like those of build_netlist."""
+    records, placements = Bruno_Netlist.device_placements(ly, tile, index)
+    placements.sort(key=lambda p: (-p[1].disp.y, p[1].disp.x))
+    devices = []
+    for ci, trans in placements:
+        record = records[ci][0]
+        devices.append({
+            "component": record["component"],
+            "library": record["library"],
+            "params": record["params"],
+            "cell": ly.cell(ci).name,
+            "x": round(trans.disp.x * ly.dbu, 6),
+            "y": round(trans.disp.y * ly.dbu, 6),
+            "rotation": trans.angle,
+            "mirror": trans.is_mirror(),
+        })
+    return devices
+
+
+def write_tile(task):
+    """
+    Worker of shard: builds the cell of one tile in the SOURCE layout,
+    writes it with its hierarchy to path, and removes it again. Returns the
+    manifest entry of the tile.
+    """
+    key, name, path, tile_task, origin, size = task
+    ly = SOURCE["layout"]
+    tile = ly.create_cell(name)
+    try:
+        for ci, t in tile_task["instances"]:
+            tile.insert(pya.CellInstArray(ci, pya.ICplxTrans.from_s(t)))
+        area = pya.Box(origin[0] + key[0] * size, origin[1] + key[1] * size,
+                       origin[0] + (key[0] + 1) * size, origin[1] + (key[1] + 1) * size)
+        shapes = 0
+        for ci, t in tile_task["entered"]:
+            t = pya.ICplxTrans.from_s(t)
+            search = t.inverted() * area
+            for li in ly.layer_indexes():
+                for shape in ly.cell(ci).shapes(li).each_touching(search):
+                    if tile_of(t * shape.bbox().center(), origin, size) == key:
+                        tile.shapes(li).insert(shape, t)
+                        shapes += 1
+        opt = pya.SaveLayoutOptions()
+        opt.set_format_from_filename(path)
+        opt.add_cell(tile.cell_index())
+        ly.write(path, opt)
+        return {
+            "name": tile.name,
+            "file": os.path.basename(path),
+            "column": key[0],
+            "row": key[1],
+            "area": box_um(area, ly.dbu),
+            "bbox": box_um(tile.bbox(), ly.dbu),
+            "instances": len(tile_task["instances"]),
+            "shapes": shapes,
+            "devices": tile_devices(ly, tile, SOURCE["index"]),
+        }
+    finally:
+        ly.delete_cell(tile.cell_index())
+
+
+def shard(ly, top, tile, output_dir, ext=".gds", pool=None):
+    """
+    Writes the tiles of top, tile microns wide, to output_dir as <top>_<c>_<r>
+    files with extension ext, and their manifest. The tiles are written by
+    the workers of pool if given, which must have read the same layout file
+    (init_worker), else in this process. Returns the manifest.
+    """
+    set_source(ly)
+    size = int(round(tile / ly.dbu))
+    bbox = top.bbox()
+    origin = (bbox.left, bbox.bottom)
+    instances, entered = placement(ly, top, size, SOURCE["index"][0])
+    tiles = assign_tiles(ly, instances, entered, origin, size)
+    tasks = []
+    for key, tile_task in sorted(tiles.items(), key=lambda kv: (kv[0][1], kv[0][0])):
+        name = "%s_%d_%d" % (top.name, key[0], key[1])
+        tasks.append((key, name, os.path.join(output_dir, name + ext), tile_task, origin, size))
+    entries = list((pool.imap_unordered if pool else map)(write_tile, tasks))
+    entries.sort(key=lambda e: (e["row"], e["column"]))
+    manifest = {
+        "top": top.name,
+        "dbu": ly.dbu,
+        "tile": tile,
+        "origin": [round(origin[0] * ly.dbu, 6), round(origin[1] * ly.dbu, 6)],
+        "bbox": box_um(bbox, ly.dbu),
+        "tiles": entries,
+    }
+    with open(os.path.join(output_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def tiles_in(manifest, box):
+    """Tiles of manifest whose bounding box overlaps box (left, bottom, right, top) in microns."""
+    left, bottom, right, top = box
+    return [t for t in manifest["tiles"]
+            if t["bbox"][0] <= right and t["bbox"][2] >= left
+            and t["bbox"][1] <= top and t["bbox"][3] >= bottom]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes a layout as tiles, one file each, and a manifest.")
+    parser.add_argument("layout", help="GDS/OASIS file")
+    parser.add_argument("--tile", type=float, required=True, help="tile size in microns")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory of the tiles and the manifest")
+    parser.add_argument("--top", help="top cell (default: the single top cell of the layout)")
+    parser.add_argument("--format", choices=("gds", "oas"),
+                        help="format of the tiles (default: that of the layout)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes writing the tiles (0: one per core)")
+    parser.add_argument("--import", dest="modules", action="append", default=[],
+                        help="python module to import first, e.g. a PDK or the Bruno libraries")
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    if args.tile <= 0:
+        parser.error("the tile size must be positive")
+    ly = read_layout(args.layout, args.modules)
+    if args.top:
+        top = ly.cell(args.top)
+        if top is None:
+            parser.error("no cell %s in %s" % (args.top, args.layout))
+    else:
+        tops = ly.top_cells()
+        if len(tops) != 1:
+            parser.error("%s has %d top cells, select one with --top" % (args.layout, len(tops)))
+        top = tops[0]
+    ext = "." + args.format if args.format else os.path.splitext(args.layout)[1]
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    jobs = args.jobs or multiprocessing.cpu_count()
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, init_worker, (args.layout, args.modules))
+    try:
+        t0 = time.perf_counter()
+        manifest = shard(ly, top, args.tile, args.output_dir, ext, pool)
+        dt = time.perf_counter() - t0
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print("%s: %d tiles, %d devices -> %s (%.1f s)" % (
+        top.name, len(manifest["tiles"]), sum(len(t["devices"]) for t in manifest["tiles"]),
+        os.path.join(args.output_dir, MANIFEST), dt))
+
+
+if __name__ == "__main__":
+    main()